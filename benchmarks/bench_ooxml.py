@@ -0,0 +1,141 @@
+#bench_ooxml
+"""DOCX/PPTX解析基准：对象模型路径 vs 流式XML路径
+
+用法: python benchmarks/bench_ooxml.py [--paragraphs 20000] [--slides 500] [--repeat 3]
+用 python-docx / python-pptx 生成合成文档，每次解析都在独立子进程中进行，
+报告吞吐(MB/s)与解析期间的峰值RSS增量（采样间隔2ms）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 子进程中执行：先导入依赖并记录当前RSS，解析期间由采样线程记录峰值RSS
+CHILD = r"""
+import json, sys, threading, time
+import psutil
+sys.path.insert(0, {root!r})
+path, kind, impl = {path!r}, {kind!r}, {impl!r}
+import docx, pptx, ooxml_parser
+
+def legacy_docx(p):
+    content = ""
+    for para in docx.Document(p).paragraphs:
+        content += para.text + "\n"
+    return content
+
+def legacy_pptx(p):
+    content = ""
+    for slide in pptx.Presentation(p).slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text") and shape.text:
+                content += shape.text + "\n"
+    return content
+
+def streaming_docx(p):
+    return "\n".join(ooxml_parser.iter_docx_paragraphs(p))
+
+def streaming_pptx(p):
+    return "\n\n".join(ooxml_parser.iter_pptx_slides(p))
+
+func = {{"legacy": {{"docx": legacy_docx, "pptx": legacy_pptx}},
+         "streaming": {{"docx": streaming_docx, "pptx": streaming_pptx}}}}[impl][kind]
+proc = psutil.Process()
+base = proc.memory_info().rss
+peak = [base]
+done = threading.Event()
+
+def sample():
+    while not done.is_set():
+        peak[0] = max(peak[0], proc.memory_info().rss)
+        time.sleep(0.002)
+
+sampler = threading.Thread(target=sample)
+sampler.start()
+start = time.perf_counter()
+text = func(path)
+elapsed = time.perf_counter() - start
+done.set()
+sampler.join()
+peak[0] = max(peak[0], proc.memory_info().rss)
+print(json.dumps({{"seconds": elapsed, "peak_rss_delta": peak[0] - base, "chars": len(text)}}))
+"""
+
+
+def make_docx(path, paragraphs):
+    import docx
+    document = docx.Document()
+    for i in range(paragraphs):
+        document.add_paragraph(f"第{i}段：知识库文档解析基准测试文本，包含中文与English混排内容。" * 3)
+        if i % 200 == 0:
+            table = document.add_table(rows=5, cols=4)
+            for r in range(5):
+                for c in range(4):
+                    table.cell(r, c).text = f"单元格{r}-{c}"
+    document.save(path)
+
+
+def make_pptx(path, slides):
+    import pptx
+    from pptx.util import Inches
+    presentation = pptx.Presentation()
+    for i in range(slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"第{i}页 标题"
+        slide.placeholders[1].text = "\n".join(f"要点{j}：演示文稿解析基准测试" for j in range(8))
+        table = slide.shapes.add_table(4, 3, Inches(1), Inches(4), Inches(6), Inches(1.5)).table
+        for r in range(4):
+            for c in range(3):
+                table.cell(r, c).text = f"数据{r}{c}"
+        slide.notes_slide.notes_text_frame.text = f"第{i}页的讲者备注。"
+    presentation.save(path)
+
+
+def run_child(path, kind, impl):
+    code = CHILD.format(root=str(ROOT), path=str(path), kind=kind, impl=impl)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较DOCX/PPTX对象模型解析与流式XML解析")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--slides", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        docs = {
+            "docx": Path(tmp) / "bench.docx",
+            "pptx": Path(tmp) / "bench.pptx",
+        }
+        make_docx(docs["docx"], args.paragraphs)
+        make_pptx(docs["pptx"], args.slides)
+
+        report = {}
+        for kind, path in docs.items():
+            size_mb = os.path.getsize(path) / 1e6
+            report[kind] = {"file_mb": round(size_mb, 3)}
+            for impl in ("legacy", "streaming"):
+                runs = [run_child(path, kind, impl) for _ in range(args.repeat)]
+                seconds = statistics.median(r["seconds"] for r in runs)
+                report[kind][impl] = {
+                    "seconds": round(seconds, 4),
+                    "mb_per_s": round(size_mb / seconds, 3) if seconds else None,
+                    "peak_rss_delta_mb": round(max(r["peak_rss_delta"] for r in runs) / 1e6, 2),
+                    "chars": runs[0]["chars"],
+                }
+            legacy, streaming = report[kind]["legacy"], report[kind]["streaming"]
+            report[kind]["speedup"] = round(legacy["seconds"] / streaming["seconds"], 2) if streaming["seconds"] else None
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
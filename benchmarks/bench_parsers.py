@@ -0,0 +1,231 @@
+#bench_parsers
+"""file_parser.parse_file 分格式基准
+
+用法: python benchmarks/bench_parsers.py [--pdf-pages 200] [--docx-paragraphs 5000] [--pptx-slides 200]
+                                         [--txt-mb 20] [--repeat 3] [--no-resource-pdfs]
+                                         [--baseline benchmarks/parser_baseline.json] [--save-baseline]
+                                         [--threshold 0.25] [--output report.json]
+
+合成文档：PDF（纯文本页，按页数控制）、DOCX（段落+表格）、PPTX（标题/要点/表格/备注）、
+TXT（UTF-8与GBK两种编码，按MB控制）；另外逐个测量 PDF_resource/*.pdf。
+每次解析在独立子进程中进行，报告吞吐(MB/s)、页/s（PDF按页、PPTX按幻灯片）、
+解析期间的峰值RSS增量以及写入字节数（parse_file落地的临时文件）。
+指定的基线文件存在时逐项比较：吞吐下降或峰值RSS增长超过 --threshold 即以非零状态码退出；
+--save-baseline 把本次结果写为新基线（基线与机器相关，应在同一台机器上生成和比较）。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_ooxml import make_docx, make_pptx  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "parser_baseline.json"
+RSS_NOISE_MB = 5.0  # 峰值RSS的比较忽略小于该值的变化，避免采样抖动误报
+
+# 子进程中执行：先导入解析依赖并记录当前RSS与I/O计数，解析期间由采样线程记录峰值RSS
+CHILD = r"""
+import json, sys, threading, time
+import psutil
+sys.path.insert(0, {root!r})
+path, name = {path!r}, {name!r}
+import PyPDF2, ooxml_parser
+from file_parser import parse_file
+
+proc = psutil.Process()
+
+def written():
+    io = proc.io_counters()
+    return getattr(io, "write_chars", io.write_bytes)
+
+base = proc.memory_info().rss
+peak = [base]
+done = threading.Event()
+
+def sample():
+    while not done.is_set():
+        peak[0] = max(peak[0], proc.memory_info().rss)
+        time.sleep(0.002)
+
+sampler = threading.Thread(target=sample)
+sampler.start()
+written_before = written()
+start = time.perf_counter()
+with open(path, "rb") as f:
+    text = parse_file(f, original_filename=name)
+elapsed = time.perf_counter() - start
+written_after = written()
+done.set()
+sampler.join()
+peak[0] = max(peak[0], proc.memory_info().rss)
+print(json.dumps({{"seconds": elapsed, "peak_rss_delta": peak[0] - base,
+                  "written": written_after - written_before, "chars": len(text or "")}}))
+"""
+
+_WORDS = ["knowledge", "base", "retrieval", "vector", "embedding", "chunk", "parser",
+          "benchmark", "document", "semantic", "index", "query", "answer", "context"]
+
+
+def make_pdf(path, pages, lines_per_page=50):
+    """生成纯文本PDF（Helvetica，不依赖第三方库），返回页数"""
+    rng = random.Random(pages)
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for p in range(pages):
+        content_id, page_id = 4 + 2 * p, 5 + 2 * p
+        lines = [f"Page {p} line {i}: " + " ".join(rng.choice(_WORDS) for _ in range(12))
+                 for i in range(lines_per_page)]
+        stream = ("BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET").encode("ascii")
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(b"%d 0 R" % page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for obj_id in sorted(objects):
+            offsets[obj_id] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id]))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for obj_id in sorted(objects):
+            f.write(b"%010d 00000 n \n" % offsets[obj_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return pages
+
+
+def make_txt(path, size_mb, encoding):
+    """生成中英混排文本，按目标编码写出约size_mb大小"""
+    rng = random.Random(encoding)
+    words = ["知识库", "向量", "检索", "嵌入", "模型", "文档", "分块", "问答", "语义", "索引"] + _WORDS
+    target = int(size_mb * 1e6)
+    written = 0
+    with open(path, "w", encoding=encoding) as f:
+        while written < target:
+            line = "".join(rng.choice(words) for _ in range(30)) + "。\n"
+            f.write(line)
+            written += len(line.encode(encoding))
+
+
+def pdf_page_count(path):
+    import PyPDF2
+    return len(PyPDF2.PdfReader(str(path)).pages)
+
+
+def run_child(path, name):
+    code = CHILD.format(root=str(ROOT), path=str(path), name=name)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def build_cases(tmp, args):
+    """返回 {用例名: (文件路径, 解析时使用的文件名, 页数或None)}"""
+    tmp = Path(tmp)
+    cases = {}
+    pdf = tmp / "synthetic.pdf"
+    cases["pdf_synthetic"] = (pdf, "synthetic.pdf", make_pdf(pdf, args.pdf_pages))
+    docx = tmp / "synthetic.docx"
+    make_docx(docx, args.docx_paragraphs)
+    cases["docx_synthetic"] = (docx, "synthetic.docx", None)
+    pptx = tmp / "synthetic.pptx"
+    make_pptx(pptx, args.pptx_slides)
+    cases["pptx_synthetic"] = (pptx, "synthetic.pptx", args.pptx_slides)
+    for encoding in ("utf-8", "gbk"):
+        txt = tmp / f"synthetic_{encoding}.txt"
+        make_txt(txt, args.txt_mb, encoding)
+        cases[f"txt_{encoding.replace('-', '')}"] = (txt, txt.name, None)
+    if not args.no_resource_pdfs:
+        for path in sorted((ROOT / "PDF_resource").glob("*.pdf")):
+            cases[f"pdf_resource:{path.name}"] = (path, path.name, pdf_page_count(path))
+    return cases
+
+
+def measure(path, name, pages, repeat):
+    runs = [run_child(path, name) for _ in range(repeat)]
+    seconds = statistics.median(r["seconds"] for r in runs)
+    size_mb = os.path.getsize(path) / 1e6
+    return {
+        "file_mb": round(size_mb, 3),
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(size_mb / seconds, 3) if seconds else None,
+        "pages": pages,
+        "pages_per_s": round(pages / seconds, 2) if pages and seconds else None,
+        "peak_rss_delta_mb": round(max(r["peak_rss_delta"] for r in runs) / 1e6, 2),
+        "temp_write_mb": round(statistics.median(r["written"] for r in runs) / 1e6, 3),
+        "chars": runs[0]["chars"],
+    }
+
+
+def compare(results, baseline, threshold):
+    """与基线逐项比较，返回回退列表（缺少基线的用例跳过）"""
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if not previous:
+            continue
+        if previous.get("mb_per_s") and current["mb_per_s"] is not None \
+                and current["mb_per_s"] < previous["mb_per_s"] * (1 - threshold):
+            regressions.append(f"{case}: 吞吐 {current['mb_per_s']} MB/s < 基线 {previous['mb_per_s']} MB/s")
+        rss_growth = current["peak_rss_delta_mb"] - previous["peak_rss_delta_mb"]
+        if rss_growth > RSS_NOISE_MB and current["peak_rss_delta_mb"] > previous["peak_rss_delta_mb"] * (1 + threshold):
+            regressions.append(f"{case}: 峰值RSS {current['peak_rss_delta_mb']} MB > 基线 {previous['peak_rss_delta_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="file_parser.parse_file 分格式吞吐/内存基准")
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    parser.add_argument("--docx-paragraphs", type=int, default=5000)
+    parser.add_argument("--pptx-slides", type=int, default=200)
+    parser.add_argument("--txt-mb", type=float, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-resource-pdfs", action="store_true", help="不测量 PDF_resource 下的真实PDF")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的相对回退比例")
+    parser.add_argument("--output", default=None, help="报告JSON输出路径")
+    args = parser.parse_args()
+
+    config = {"pdf_pages": args.pdf_pages, "docx_paragraphs": args.docx_paragraphs,
+              "pptx_slides": args.pptx_slides, "txt_mb": args.txt_mb}
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = build_cases(tmp, args)
+        results = {case: measure(path, name, pages, args.repeat) for case, (path, name, pages) in cases.items()}
+
+    report = {"config": config, "results": results}
+    baseline_path = Path(args.baseline)
+    exit_code = 0
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        report["baseline"] = f"已保存到 {baseline_path}"
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if baseline.get("config") != config:
+            report["baseline"] = "基线的合成文档规模与本次不同，跳过比较"
+        else:
+            regressions = compare(results, baseline["results"], args.threshold)
+            report["baseline"] = {"path": str(baseline_path), "threshold": args.threshold, "regressions": regressions}
+            exit_code = 1 if regressions else 0
+    else:
+        report["baseline"] = "未找到基线文件，使用 --save-baseline 生成"
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
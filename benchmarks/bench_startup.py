@@ -0,0 +1,88 @@
+#bench_startup
+"""启动耗时基准
+
+用法: python benchmarks/bench_startup.py [--runs 5] [--max-seconds 1.0] [--render]
+在全新子进程中测量 `import main` 的墙钟时间，并用 -X importtime 列出最耗时的模块；
+--render 时额外用 streamlit AppTest 测量首屏（侧边栏+知识库页）渲染时间。
+中位耗时超过 --max-seconds 时以非零状态码退出。
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SNIPPET = (
+    "import sys, time; sys.path.insert(0, {root!r}); "
+    "t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+)
+
+RENDER_SNIPPET = (
+    "import sys, time; sys.path.insert(0, {root!r}); "
+    "from streamlit.testing.v1 import AppTest; "
+    "t = time.perf_counter(); at = AppTest.from_file({main!r}, default_timeout=60); at.run(); "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _run(snippet):
+    out = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _slowest_imports(top=15):
+    """解析 -X importtime 输出，返回累计耗时最高的模块"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {str(ROOT)!r}); import main"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(cumulative_us) / 1e6))
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量应用启动耗时")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    parser.add_argument("--render", action="store_true", help="额外测量AppTest首屏渲染时间")
+    args = parser.parse_args()
+
+    import_times = [_run(IMPORT_SNIPPET.format(root=str(ROOT))) for _ in range(args.runs)]
+    report = {
+        "import_main_median_s": statistics.median(import_times),
+        "import_main_max_s": max(import_times),
+        "slowest_imports": [{"module": m, "cumulative_s": round(s, 4)} for m, s in _slowest_imports()],
+    }
+    budget = report["import_main_median_s"]
+
+    if args.render:
+        start = time.perf_counter()
+        render_times = [
+            _run(RENDER_SNIPPET.format(root=str(ROOT), main=str(ROOT / "main.py")))
+            for _ in range(args.runs)
+        ]
+        report["first_render_median_s"] = statistics.median(render_times)
+        report["render_wall_s"] = time.perf_counter() - start
+        budget = report["first_render_median_s"]
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if budget > args.max_seconds:
+        print(f"启动耗时 {budget:.3f}s 超过预算 {args.max_seconds}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
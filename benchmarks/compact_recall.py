@@ -0,0 +1,62 @@
+#compact_recall
+"""紧凑向量存储的召回率与内存评估
+
+用法: python benchmarks/compact_recall.py --index ./compact_index --mode pq [--k 3] [--min-recall 0.95]
+以已存储向量加噪声后作为查询，比较两阶段检索与全精度暴力检索的recall@k。
+召回率低于阈值时以非零状态码退出。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from compact_index import CompactVectorIndex  # noqa: E402
+from config import COMPACT_RESCORE_CANDIDATES, PQ_SUBVECTORS  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估紧凑向量存储的recall@k与常驻内存")
+    parser.add_argument("--index", default="./compact_index")
+    parser.add_argument("--mode", choices=["float16", "pq"], required=True)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=COMPACT_RESCORE_CANDIDATES)
+    parser.add_argument("--noise", type=float, default=0.05, help="查询扰动相对向量范数的比例")
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    args = parser.parse_args()
+
+    index = CompactVectorIndex(args.index, mode=args.mode, pq_subvectors=PQ_SUBVECTORS)
+    if not len(index):
+        print("索引为空，请先写入或迁移向量", file=sys.stderr)
+        sys.exit(2)
+
+    rng = np.random.default_rng(0)
+    alive = np.flatnonzero(index.alive)
+    picks = rng.choice(alive, min(args.queries, len(alive)), replace=False)
+    base = np.asarray(index._full_vectors()[np.sort(picks)])
+    scale = np.linalg.norm(base, axis=1, keepdims=True) * args.noise / np.sqrt(base.shape[1])
+    queries = base + rng.normal(size=base.shape).astype(np.float32) * scale
+
+    recall = index.measure_recall(queries, k=args.k, candidates=args.candidates)
+    footprint = index.memory_footprint()
+    report = {
+        "mode": args.mode,
+        "k": args.k,
+        "candidates": args.candidates,
+        "recall": recall,
+        **footprint,
+        "compression": footprint["full_bytes"] / footprint["resident_bytes"] if footprint["resident_bytes"] else None,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if recall < args.min_recall:
+        print(f"召回率不足: recall@{args.k}={recall:.4f} < {args.min_recall}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
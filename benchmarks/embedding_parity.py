@@ -0,0 +1,46 @@
+#embedding_parity
+"""嵌入后端一致性与速度检查
+
+用法: python benchmarks/embedding_parity.py --backend onnx_int8 [--min-cosine 0.99]
+与torch路径的最小余弦相似度低于阈值时以非零状态码退出。
+同一检查也作为pytest运行（tests/test_embedding_parity.py，缺少模型或onnxruntime时跳过）。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from embedding_backend import check_parity, SUPPORTED_BACKENDS  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "检索增强生成（RAG）结合了向量检索与大语言模型。",
+    "如何在本地部署ChromaDB并持久化向量数据？",
+    "GCC编译器的优化选项-O2与-O3有什么区别？",
+    "知识库中的文档会被切分为固定长度并带有重叠的文本块。",
+    "为什么量化后的模型在CPU上推理更快？",
+    "The quick brown fox jumps over the lazy dog.",
+    "表格中的单元格内容与演示文稿的备注同样需要被索引。",
+    "推荐使用哪种文本分割策略处理长篇技术报告？",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较嵌入后端与torch路径的向量一致性")
+    parser.add_argument("--backend", choices=[b for b in SUPPORTED_BACKENDS if b not in ("torch", "stub")], required=True)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--repeat", type=int, default=8, help="样本重复次数，用于放大计时差异")
+    args = parser.parse_args()
+
+    texts = SAMPLE_TEXTS * args.repeat
+    report = check_parity(texts, args.backend)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if report["min_cosine"] < args.min_cosine:
+        print(f"一致性不足: min_cosine={report['min_cosine']:.4f} < {args.min_cosine}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
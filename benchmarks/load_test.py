@@ -0,0 +1,286 @@
+#load_test
+"""多会话并发压测
+
+用法: python benchmarks/load_test.py [--sessions 50] [--questions 5] [--uploads 1]
+                                     [--llm-latency-ms 800] [--stub-embeddings] [--output report.json]
+
+每个模拟会话通过 streamlit AppTest 无浏览器地驱动真实页面代码：
+入库路径调用 knowledge_base_manager.add_file_to_knowledge_base，问答路径通过
+chat_input 驱动 UI.qa_interface。大模型请求指向本地OpenAI兼容模拟服务（可配置延迟），
+--stub-embeddings 时使用确定性哈希嵌入替代真实模型。
+所有数据写入独立的临时工作目录，不影响现有知识库。
+报告吞吐、各操作的延迟分位数、每会话CPU与内存、Chroma与注册表的锁竞争统计，
+以及问答的tokens用量（模拟服务按前缀估算提示词缓存命中）。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+QUESTIONS = [
+    "知识库中的文档是如何切分的？",
+    "为什么需要向量检索？",
+    "如何配置嵌入模型的线程数？",
+    "比较float16与PQ两种存储方式",
+    "推荐使用哪种回收站保留期？",
+    "文档解析支持哪些格式",
+]
+
+
+def _ingest_script():
+    """AppTest入库脚本：上传内容通过session_state传入"""
+    from io import BytesIO
+    import streamlit as st
+    from session_manager import init_session
+    from knowledge_base_manager import add_file_to_knowledge_base
+
+    class _Upload(BytesIO):
+        """模拟Streamlit的UploadedFile"""
+
+        def __init__(self, name, data, mime):
+            super().__init__(data)
+            self.name = name
+            self.type = mime
+
+    init_session()
+    for name, data, mime in st.session_state.pop("lt_uploads", []):
+        add_file_to_knowledge_base(_Upload(name, data, mime))
+
+
+def _qa_script():
+    """AppTest问答脚本：渲染问答页，问题通过chat_input提交"""
+    from session_manager import init_session
+    from UI import qa_interface
+
+    init_session()
+    qa_interface()
+
+
+def _synthetic_document(session_id, doc_id, size_kb):
+    """生成内容唯一的中文文本文档（文件ID基于内容哈希，需避免重复；每行带随机编号，避免被判为近重复）"""
+    rng = random.Random(f"{session_id}-{doc_id}")
+    words = ["知识库", "向量", "检索", "嵌入", "模型", "文档", "分块", "问答", "语义", "索引", "压测", "会话"]
+    lines = [f"压测文档 会话{session_id} 文档{doc_id}"]
+    size = 0
+    while size < size_kb * 1024:
+        line = f"{rng.randrange(10 ** 8):08d} " + "".join(rng.choice(words) for _ in range(20)) + "。"
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return "\n".join(lines).encode("utf-8")
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "p50_s": round(pick(0.50), 4),
+        "p90_s": round(pick(0.90), 4),
+        "p95_s": round(pick(0.95), 4),
+        "p99_s": round(pick(0.99), 4),
+        "max_s": round(ordered[-1], 4),
+    }
+
+
+class _Session(threading.Thread):
+    def __init__(self, session_id, args, results, errors, llm_usage):
+        super().__init__(name=f"session-{session_id}", daemon=True)
+        self.session_id = session_id
+        self.args = args
+        self.results = results
+        self.errors = errors
+        self.llm_usage = llm_usage
+        # AppTest.from_function 以内容哈希为名重写脚本文件，必须在任何会话开始运行前于主线程构造，
+        # 否则并发重写可能让正在运行的会话读到被截断的空脚本
+        from streamlit.testing.v1 import AppTest
+        self.ingest_app = AppTest.from_function(_ingest_script, default_timeout=args.timeout) if args.uploads else None
+        self.qa_app = AppTest.from_function(_qa_script, default_timeout=args.timeout) if args.questions else None
+
+    def _record(self, op, seconds, app):
+        self.results.append((op, seconds))
+        if app.exception:
+            self.errors.append(f"{op}@{self.session_id}: {app.exception[0].value}")
+
+    def run(self):
+        try:
+            if self.ingest_app is not None:
+                app = self.ingest_app
+                app.session_state["lt_uploads"] = [
+                    (f"loadtest_{self.session_id}_{i}.txt",
+                     _synthetic_document(self.session_id, i, self.args.doc_kb),
+                     "text/plain")
+                    for i in range(self.args.uploads)
+                ]
+                start = time.perf_counter()
+                app.run()
+                self._record("ingest", time.perf_counter() - start, app)
+
+            if self.qa_app is not None:
+                app = self.qa_app
+                app.run()
+                rng = random.Random(self.session_id)
+                for _ in range(self.args.questions):
+                    start = time.perf_counter()
+                    app.chat_input[0].set_value(rng.choice(QUESTIONS)).run()
+                    self._record("qa", time.perf_counter() - start, app)
+                self.llm_usage.extend(app.session_state["llm_usage"])
+        except Exception as e:
+            self.errors.append(f"session {self.session_id}: {e!r}")
+
+
+def _pin_shared_runtime():
+    """AppTest每次运行都会安装并在结束时清空全局Runtime单例、临时打开再恢复global.appTest配置，
+    多会话并发时会互相拆掉对方的运行环境；这里固定一个共享的模拟Runtime并常开该配置"""
+    from unittest.mock import MagicMock
+    from streamlit import config as st_config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    try:
+        from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+        shared.dataframe_source_mgr = DataframeSourceManager()
+    except ImportError:
+        pass
+    Runtime.instance = classmethod(lambda cls: shared)
+    Runtime.exists = classmethod(lambda cls: True)
+    st_config.set_option("global.appTest", True)
+
+
+class _ResourceSampler(threading.Thread):
+    """周期采样进程RSS峰值"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(name="rss-sampler", daemon=True)
+        import psutil
+        self.proc = psutil.Process()
+        self.interval = interval
+        self.peak = self.proc.memory_info().rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self.proc.memory_info().rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多会话并发压测（入库与问答路径）")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=5, help="每个会话的提问次数")
+    parser.add_argument("--uploads", type=int, default=1, help="每个会话上传的文档数")
+    parser.add_argument("--doc-kb", type=int, default=64, help="每个合成文档的大小(KB)")
+    parser.add_argument("--ramp-up-s", type=float, default=5.0, help="所有会话在该时间内依次启动")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--stub-embeddings", action="store_true", help="使用确定性哈希嵌入替代真实模型")
+    parser.add_argument("--timeout", type=float, default=300, help="单次脚本运行的超时(秒)")
+    parser.add_argument("--workdir", default=None, help="数据目录，默认使用临时目录")
+    parser.add_argument("--output", default=None, help="报告JSON输出路径")
+    args = parser.parse_args()
+
+    from mock_openai_server import start_server
+    server, base_url = start_server(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms)
+
+    # 环境变量必须在导入项目模块（config）之前设置
+    os.environ["RBQA_API_BASE_URL"] = base_url
+    if args.stub_embeddings:
+        os.environ["RBQA_EMBEDDING_BACKEND"] = "stub"
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="rbqa_loadtest_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+
+    import psutil
+    from contention import lock_stats, reset_lock_stats
+    from vector_store import get_vector_count, get_embedding_function
+    from ai_service import summarize_usage
+
+    # 预先加载共享资源，避免把模型加载时间计入首个会话
+    # （设置了RBQA_INDEX_SERVICE_URL时压测的是连接共享索引服务的副本）
+    get_embedding_function()
+    get_vector_count("default")
+    reset_lock_stats()
+    _pin_shared_runtime()
+
+    proc = psutil.Process()
+    rss_before = proc.memory_info().rss
+    cpu_before = sum(proc.cpu_times()[:2])
+    sampler = _ResourceSampler()
+    sampler.start()
+
+    results, errors, llm_usage = [], [], []
+    sessions = [_Session(i, args, results, errors, llm_usage) for i in range(args.sessions)]
+    start = time.perf_counter()
+    for session in sessions:
+        session.start()
+        time.sleep(args.ramp_up_s / max(args.sessions, 1))
+    for session in sessions:
+        session.join()
+    duration = time.perf_counter() - start
+
+    sampler.stop()
+    cpu_seconds = sum(proc.cpu_times()[:2]) - cpu_before
+    server.shutdown()
+
+    by_op = {}
+    for op, seconds in results:
+        by_op.setdefault(op, []).append(seconds)
+
+    report = {
+        "config": {
+            "sessions": args.sessions,
+            "questions_per_session": args.questions,
+            "uploads_per_session": args.uploads,
+            "doc_kb": args.doc_kb,
+            "llm_latency_ms": args.llm_latency_ms,
+            "stub_embeddings": args.stub_embeddings,
+            "workdir": str(workdir),
+        },
+        "duration_s": round(duration, 3),
+        "throughput_ops_per_s": {op: round(len(v) / duration, 3) for op, v in by_op.items()},
+        "latency": {op: _percentiles(v) for op, v in by_op.items()},
+        "errors": {"count": len(errors), "samples": errors[:10]},
+        "cpu": {
+            "total_s": round(cpu_seconds, 3),
+            "per_session_s": round(cpu_seconds / max(args.sessions, 1), 3),
+            "utilization": round(cpu_seconds / duration / (psutil.cpu_count() or 1), 3),
+        },
+        "memory": {
+            "rss_before_mb": round(rss_before / 1e6, 1),
+            "rss_peak_mb": round(sampler.peak / 1e6, 1),
+            "per_session_mb": round((sampler.peak - rss_before) / 1e6 / max(args.sessions, 1), 2),
+        },
+        "lock_contention": lock_stats(),
+        "llm_usage": summarize_usage(llm_usage),
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#mock_openai_server
+"""本地OpenAI兼容模拟服务（仅 /chat/completions 与 /models）
+
+用法: python benchmarks/mock_openai_server.py [--port 8765] [--latency-ms 800] [--jitter-ms 200]
+应用侧设置环境变量 RBQA_API_BASE_URL=http://127.0.0.1:8765/v1/ 即可接入。
+回答内容是固定模板，用量字段按字符数粗略估算（约2字符/token）。
+提示词缓存按前缀模拟：消息序列化后以CACHE_BLOCK_CHARS为块，与此前请求相同的最长前缀计为缓存命中，
+同时返回OpenAI格式(prompt_tokens_details.cached_tokens)与DeepSeek格式(prompt_cache_hit_tokens)。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_BLOCK_CHARS = 128
+
+
+class _PrefixCache:
+    """记录见过的提示词前缀（按块），返回新请求与其最长公共前缀的字符数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prefixes = set()
+
+    def lookup_and_add(self, text):
+        boundaries = range(CACHE_BLOCK_CHARS, len(text) + 1, CACHE_BLOCK_CHARS)
+        cached = 0
+        with self._lock:
+            for end in boundaries:
+                key = hash(text[:end])
+                if key not in self._prefixes:
+                    break
+                cached = end
+            self._prefixes.update(hash(text[:end]) for end in boundaries)
+        return cached
+
+
+class _Handler(BaseHTTPRequestHandler):
+    latency_s = 0.8
+    jitter_s = 0.2
+    prefix_cache = _PrefixCache()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        time.sleep(max(0.0, self.latency_s + random.uniform(-self.jitter_s, self.jitter_s)))
+        messages = request.get("messages", [])
+        serialized = "".join(f"<{m.get('role')}>{m.get('content') or ''}" for m in messages)
+        prompt_chars = len(serialized)
+        answer = f"【模拟回答】已收到{len(messages)}条消息，共{prompt_chars}字符。参见【文献1】。"
+        prompt_tokens = max(1, prompt_chars // 2)
+        cached_tokens = min(prompt_tokens, self.prefix_cache.lookup_and_add(serialized) // 2)
+        completion_tokens = max(1, len(answer) // 2)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                "prompt_cache_hit_tokens": cached_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - cached_tokens
+            }
+        })
+
+
+def start_server(host="127.0.0.1", port=0, latency_ms=800, jitter_ms=200):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port=0 时自动分配端口"""
+    handler = type("MockHandler", (_Handler,), {
+        "latency_s": latency_ms / 1000.0,
+        "jitter_s": jitter_ms / 1000.0,
+        "prefix_cache": _PrefixCache(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.host, args.port, args.latency_ms, args.jitter_ms)
+    print(f"模拟服务已启动: {base_url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+#compact_index
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+
+
+class CompactVectorIndex:
+    """紧凑向量索引：内存中只保留float16或PQ编码，全精度向量以memmap形式留在磁盘
+
+    检索分两步：先用紧凑向量近似打分选出候选，再读取候选的全精度向量精确重排。
+    距离度量与Chroma默认的L2（平方欧氏距离）保持一致。
+    """
+
+    PQ_CENTROIDS = 256
+
+    def __init__(self, directory, mode="float16", pq_subvectors=64, pq_train_min=2048, block_rows=8192):
+        if mode not in ("float16", "pq"):
+            raise ValueError(f"不支持的紧凑存储模式: {mode}")
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.pq_subvectors = pq_subvectors
+        self.pq_train_min = max(pq_train_min, self.PQ_CENTROIDS)
+        self.block_rows = block_rows
+        self._lock = threading.RLock()
+
+        self.dim = None
+        self.ids: List[str] = []
+        self.source_ids: List[str] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes = None         # float16: (N, dim) float16；pq: (N, m) uint8
+        self.approx_norms = None  # float16模式下近似向量的平方范数
+        self.codebook = None      # pq: (m, 256, dim/m) float32
+        self._full = None
+        self._load()
+
+    # ---------- 持久化 ----------
+    @property
+    def _meta_path(self):
+        return self.dir / "meta.json"
+
+    @property
+    def _full_path(self):
+        return self.dir / "full.f32"
+
+    def _load(self):
+        if not self._meta_path.exists():
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("mode") != self.mode:
+            raise ValueError(f"索引目录 {self.dir} 的存储模式为 {meta.get('mode')}，与配置 {self.mode} 不一致")
+        self.dim = meta["dim"]
+        self.ids = meta["ids"]
+        self.source_ids = meta["source_ids"]
+        self.alive = np.load(self.dir / "alive.npy")
+        if (self.dir / "codes.npy").exists():
+            self.codes = np.load(self.dir / "codes.npy")
+        if (self.dir / "norms.npy").exists():
+            self.approx_norms = np.load(self.dir / "norms.npy")
+        if (self.dir / "codebook.npy").exists():
+            self.codebook = np.load(self.dir / "codebook.npy")
+        # 写入向量后、保存元数据前中断时，磁盘上会多出未登记的行
+        self._trim_to_meta()
+
+    def _trim_to_meta(self):
+        """磁盘上多出的行（保存中途失败留下的）截断到元数据记录的行数"""
+        rows = len(self.ids)
+        if self.dim and self._full_path.exists() and self._full_path.stat().st_size > rows * self.dim * 4:
+            os.truncate(self._full_path, rows * self.dim * 4)
+        self.alive = self.alive[:rows]
+        if self.codes is not None:
+            self.codes = self.codes[:rows] if len(self.codes) >= rows else None
+        if self.mode == "pq" and (self.codes is None or self.codebook is None):
+            self.codes = self.codebook = None  # 码本与编码不完整时丢弃，向量数达标后重新训练
+        if self.approx_norms is not None:
+            self.approx_norms = self.approx_norms[:rows]
+
+    def _replace(self, name, write):
+        """写入临时文件后整体替换，中途失败不会留下写了一半的文件"""
+        tmp = self.dir / f"{name}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, self.dir / name)
+
+    def _save(self):
+        # 数组先落盘，元数据最后替换：元数据中的行数始终不超过已写入的向量
+        self._replace("alive.npy", lambda f: np.save(f, self.alive))
+        if self.codes is not None:
+            self._replace("codes.npy", lambda f: np.save(f, self.codes))
+        if self.approx_norms is not None:
+            self._replace("norms.npy", lambda f: np.save(f, self.approx_norms))
+        if self.codebook is not None:
+            self._replace("codebook.npy", lambda f: np.save(f, self.codebook))
+        meta = json.dumps({
+            "mode": self.mode,
+            "dim": self.dim,
+            "ids": self.ids,
+            "source_ids": self.source_ids
+        })
+        self._replace("meta.json", lambda f: f.write(meta.encode("utf-8")))
+
+    def _full_vectors(self):
+        """以只读memmap方式访问磁盘上的全精度向量"""
+        if self._full is None and self.ids:
+            self._full = np.memmap(self._full_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+        return self._full
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    # ---------- 编码 ----------
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.mode == "float16":
+            return vectors.astype(np.float16)
+        m = self.pq_subvectors
+        sub_dim = self.dim // m
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        centroid_norms = (self.codebook ** 2).sum(axis=2)
+        for j in range(m):
+            sub = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+            # argmin ||x-c||² = argmin (||c||² - 2x·c)
+            codes[:, j] = np.argmin(centroid_norms[j] - 2 * sub @ self.codebook[j].T, axis=1)
+        return codes
+
+    def _train_pq(self, iterations=20, seed=0):
+        """在现有全精度向量上训练PQ码本，并对所有向量重新编码"""
+        if self.dim % self.pq_subvectors:
+            raise ValueError(f"向量维度 {self.dim} 无法被PQ子空间数 {self.pq_subvectors} 整除")
+        full = self._full_vectors()
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(full), self.PQ_CENTROIDS * 40)
+        sample = np.asarray(full[np.sort(rng.choice(len(full), sample_size, replace=False))])
+
+        m = self.pq_subvectors
+        sub_dim = self.dim // m
+        codebook = np.empty((m, self.PQ_CENTROIDS, sub_dim), dtype=np.float32)
+        for j in range(m):
+            sub = sample[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = sub[rng.choice(len(sub), self.PQ_CENTROIDS, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmin((centroids ** 2).sum(axis=1) - 2 * sub @ centroids.T, axis=1)
+                for c in range(self.PQ_CENTROIDS):
+                    members = sub[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+            codebook[j] = centroids
+        self.codebook = codebook
+        self.codes = np.concatenate([
+            self._encode(np.asarray(full[i:i + self.block_rows]))
+            for i in range(0, len(full), self.block_rows)
+        ])
+
+    # ---------- 写入与删除 ----------
+    def add(self, ids: List[str], source_ids: List[str], vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(ids) != len(vectors) or len(source_ids) != len(vectors):
+            raise ValueError("ids、source_ids与向量数量不一致")
+        if not len(vectors):
+            return
+        with self._lock:
+            if self.dim is None:
+                if self.mode == "pq" and vectors.shape[1] % self.pq_subvectors:
+                    raise ValueError(f"向量维度 {vectors.shape[1]} 无法被PQ子空间数 {self.pq_subvectors} 整除")
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+            # 写入是一个事务：编码、训练或保存失败时回滚到写入前的状态，磁盘行数与元数据保持一致
+            previous = (self.dim, len(self.ids), self.alive, self.codes, self.approx_norms, self.codebook)
+            try:
+                self.dim = vectors.shape[1]
+                with open(self._full_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                self._full = None
+
+                self.ids.extend(ids)
+                self.source_ids.extend(source_ids)
+                self.alive = np.concatenate([self.alive, np.ones(len(vectors), dtype=bool)])
+
+                if self.mode == "float16":
+                    new_codes = self._encode(vectors)
+                    new_norms = (new_codes.astype(np.float32) ** 2).sum(axis=1)
+                    self.codes = new_codes if self.codes is None else np.concatenate([self.codes, new_codes])
+                    self.approx_norms = new_norms if self.approx_norms is None else np.concatenate([self.approx_norms, new_norms])
+                elif self.codebook is not None:
+                    new_codes = self._encode(vectors)
+                    self.codes = np.concatenate([self.codes, new_codes])
+                elif len(self.ids) >= self.pq_train_min:
+                    self._train_pq()
+                self._save()
+            except BaseException:
+                self._rollback(previous)
+                raise
+
+    def _rollback(self, previous):
+        dim, rows, self.alive, self.codes, self.approx_norms, self.codebook = previous
+        self._full = None
+        del self.ids[rows:]
+        del self.source_ids[rows:]
+        if self._full_path.exists():
+            os.truncate(self._full_path, rows * (dim or 0) * 4)
+        self.dim = dim
+        # 保存可能已替换了部分数组文件，尽量把磁盘恢复到写入前的状态（失败时由_load按元数据截断）
+        if rows:
+            try:
+                self._save()
+            except Exception:
+                pass
+
+    def remove_sources(self, source_ids):
+        """将指定来源的向量标记为删除，删除比例过高时压缩磁盘文件"""
+        targets = set(source_ids)
+        with self._lock:
+            for i, sid in enumerate(self.source_ids):
+                if sid in targets:
+                    self.alive[i] = False
+            if len(self.ids) and (~self.alive).mean() > 0.3:
+                self.compact()
+            else:
+                self._save()
+
+    def compact(self):
+        """物理移除已删除的行"""
+        with self._lock:
+            keep = np.flatnonzero(self.alive)
+            full = self._full_vectors()
+            tmp_path = self._full_path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                for i in range(0, len(keep), self.block_rows):
+                    f.write(np.asarray(full[keep[i:i + self.block_rows]]).tobytes())
+            self._full = None
+            del full
+            os.replace(tmp_path, self._full_path)
+
+            self.ids = [self.ids[i] for i in keep]
+            self.source_ids = [self.source_ids[i] for i in keep]
+            self.alive = np.ones(len(keep), dtype=bool)
+            if self.codes is not None:
+                self.codes = self.codes[keep]
+            if self.approx_norms is not None:
+                self.approx_norms = self.approx_norms[keep]
+            self._save()
+
+    # ---------- 检索 ----------
+    def _approx_distances(self, query: np.ndarray) -> np.ndarray:
+        """分块计算近似距离，避免把整个紧凑矩阵一次性转换为float32"""
+        n = len(self.ids)
+        dists = np.empty(n, dtype=np.float32)
+        if self.mode == "pq" and self.codebook is None:
+            # 码本尚未训练（数据量小），直接在全精度向量上计算
+            full = self._full_vectors()
+            for i in range(0, n, self.block_rows):
+                block = np.asarray(full[i:i + self.block_rows])
+                dists[i:i + len(block)] = ((block - query) ** 2).sum(axis=1)
+            return dists
+
+        if self.mode == "float16":
+            for i in range(0, n, self.block_rows):
+                block = self.codes[i:i + self.block_rows].astype(np.float32)
+                dists[i:i + len(block)] = self.approx_norms[i:i + len(block)] - 2 * block @ query
+            return dists
+
+        m = self.pq_subvectors
+        sub_dim = self.dim // m
+        # 非对称距离计算(ADC)：先求查询子向量到各质心的距离表
+        table = ((self.codebook - query.reshape(m, 1, sub_dim)) ** 2).sum(axis=2)
+        cols = np.arange(m)
+        for i in range(0, n, self.block_rows):
+            block = self.codes[i:i + self.block_rows]
+            dists[i:i + len(block)] = table[cols, block].sum(axis=1)
+        return dists
+
+    def search(self, query, k: int = 3, candidates: int = 50, mask=None) -> Tuple[List[str], List[float]]:
+        """返回 (ids, 精确L2距离)，mask为可选的布尔数组，用于额外过滤"""
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if not self.ids:
+                return [], []
+            valid = self.alive if mask is None else (self.alive & mask)
+            valid_count = int(valid.sum())
+            if not valid_count:
+                return [], []
+
+            approx = self._approx_distances(query)
+            approx[~valid] = np.inf
+            n_cand = min(max(candidates, k), valid_count)
+            cand = np.argpartition(approx, n_cand - 1)[:n_cand]
+
+            # 对候选读取全精度向量做精确重排
+            cand = np.sort(cand)
+            exact = ((np.asarray(self._full_vectors()[cand]) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            return [self.ids[cand[i]] for i in order], [float(exact[i]) for i in order]
+
+    def source_mask(self, source_ids, include=True) -> np.ndarray:
+        """根据source_id集合构造过滤mask"""
+        targets = set(source_ids)
+        hits = np.fromiter((sid in targets for sid in self.source_ids), dtype=bool, count=len(self.source_ids))
+        return hits if include else ~hits
+
+    def iter_vectors(self, source_ids=None, block_rows=None):
+        """按块遍历存活行的 (ids, 全精度向量)，可按source_id过滤，用于快照导出"""
+        block_rows = block_rows or self.block_rows
+        with self._lock:
+            keep = self.alive if source_ids is None else self.alive & self.source_mask(source_ids)
+            rows = np.flatnonzero(keep)
+            full = self._full_vectors()
+            for i in range(0, len(rows), block_rows):
+                block = rows[i:i + block_rows]
+                yield [self.ids[j] for j in block], np.asarray(full[block], dtype=np.float32)
+
+    def exact_search(self, query, k: int = 3) -> List[str]:
+        """全精度暴力检索，用于评估召回率"""
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            full = self._full_vectors()
+            dists = np.empty(len(self.ids), dtype=np.float32)
+            for i in range(0, len(self.ids), self.block_rows):
+                block = np.asarray(full[i:i + self.block_rows])
+                dists[i:i + len(block)] = ((block - query) ** 2).sum(axis=1)
+            dists[~self.alive] = np.inf
+            top = np.argsort(dists)[:k]
+            return [self.ids[i] for i in top if np.isfinite(dists[i])]
+
+    def measure_recall(self, queries, k: int = 3, candidates: int = 50) -> float:
+        """两阶段检索相对全精度暴力检索的recall@k"""
+        hits, total = 0, 0
+        for q in queries:
+            truth = set(self.exact_search(q, k))
+            found, _ = self.search(q, k, candidates)
+            hits += len(truth & set(found))
+            total += len(truth)
+        return hits / total if total else 1.0
+
+    def memory_footprint(self) -> dict:
+        """常驻内存（紧凑编码）与磁盘全精度向量的字节数"""
+        resident = 0
+        for arr in (self.codes, self.approx_norms, self.codebook):
+            if arr is not None:
+                resident += arr.nbytes
+        return {
+            "resident_bytes": resident,
+            "full_bytes": len(self.ids) * (self.dim or 0) * 4,
+            "vectors": len(self)
+        }
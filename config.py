@@ -6,20 +6,127 @@ os.environ["HF_HUB_OFFLINE"] = "0"                   # 确保仍允许在线下
 # API 配置
 # 默认API密钥，可以在应用的UI界面中进行覆盖
 API_KEY = "sk-g40Ua40lLiQhMcEN1b710a5d63E14bD89921Ed47D8B371Fb"
-API_BASE_URL = "https://api.gpt.ge/v1/"
+API_BASE_URL = os.environ.get("RBQA_API_BASE_URL", "https://api.gpt.ge/v1/")  # 压测时可指向本地模拟服务
 DEEPSEEK_MODEL = "deepseek-chat"
+# 大模型计费（每百万tokens的价格），用于调试面板估算费用；缓存命中的输入tokens按缓存价计
+LLM_PRICE_CURRENCY = "¥"
+LLM_PRICE_INPUT_PER_M = 2.0
+LLM_PRICE_CACHED_INPUT_PER_M = 0.5
+LLM_PRICE_OUTPUT_PER_M = 8.0
 
 # 模型配置
 EMBEDDING_MODEL_SENTENCE_TRANSFORMER = 'paraphrase-multilingual-MiniLM-L12-v2'
 EMBEDDING_MODEL_LANGCHAIN = "GanymedeNil/text2vec-large-chinese"
+MODEL_WARMUP_DELAY = 1.0  # 首屏渲染后再开始后台预热模型（秒）
+
+# 嵌入后端配置
+# torch: 原始HuggingFaceEmbeddings路径；torch_int8: PyTorch动态int8量化；
+# onnx: ONNX Runtime导出；onnx_int8: ONNX Runtime + int8动态量化；
+# stub: 确定性哈希替身（无语义，仅用于压测）
+EMBEDDING_BACKEND = os.environ.get("RBQA_EMBEDDING_BACKEND", "torch")
+EMBEDDING_NUM_THREADS = int(os.environ.get("RBQA_EMBEDDING_THREADS", os.cpu_count() or 4))  # intra-op线程数
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_LENGTH = 512
+ONNX_EXPORT_DIR = "./onnx_models"  # ONNX导出与量化模型的缓存目录
+# >0 时把该时间窗内多个线程的嵌入请求合并为一次批量计算（索引服务默认开启）
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get("RBQA_EMBEDDING_BATCH_WINDOW_MS", 0))
+EMBEDDING_MAX_BATCH = 256                     # 合并后单批的最大文本数
 
 # 数据库配置
 CHROMA_DB_PATH = "./chroma_db"
 FILE_REGISTRY_DB = "./file_registry.json"  # 确保此路径不依赖其他模块
 
+# 向量存储配置
+# chroma: Chroma原生float32存储；float16 / pq: 紧凑索引，内存中只保留float16或PQ编码，
+# 全精度向量以memmap形式留在磁盘上，仅用于候选重排
+VECTOR_STORAGE = os.environ.get("RBQA_VECTOR_STORAGE", "chroma")
+COMPACT_INDEX_PATH = "./compact_index"
+COMPACT_DOC_COLLECTION = "langchain_compact"  # 紧凑模式下只存文本与元数据的Chroma集合
+COMPACT_RESCORE_CANDIDATES = 50               # 近似打分后参与精确重排的候选数
+PQ_SUBVECTORS = 64                            # PQ子空间数，1024维时每个向量编码为64字节
+PQ_TRAIN_MIN = 2048                           # 向量数达到该值后才训练PQ码本
+
 # 文本分割配置
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+TEXT_SAMPLE_BYTES = 64 * 1024   # 文本文件编码检测读取的样本大小
+TEXT_BLOCK_CHARS = 1_000_000    # 文本/Markdown流式读取时每块的字符数
+INGEST_BATCH_CHUNKS = 256       # 入库时每批嵌入并写入向量库的块数
 
 # 持久化存储配置（仅定义路径，不执行操作）
-PERSISTENT_UPLOAD_FOLDER = "./persistent_uploads"
\ No newline at end of file
+PERSISTENT_UPLOAD_FOLDER = "./persistent_uploads"
+SNAPSHOT_STATE_PATH = "./snapshot_state.json"  # 记录各知识库最近一次快照导出/导入，用于增量快照
+
+# 回收站配置：软删除的文件超过保留期后由后台任务物理删除
+RECYCLE_BIN_RETENTION_DAYS = 30
+RECYCLE_BIN_PURGE_INTERVAL_S = 3600  # 后台定期清理各知识库回收站的间隔（秒）
+
+# 多知识库配置
+# 默认知识库沿用上面的Chroma集合、注册表与上传目录；
+# 其他知识库各自拥有独立集合，注册表与上传目录位于 KNOWLEDGE_BASES_ROOT/<名称>/ 下
+DEFAULT_KNOWLEDGE_BASE = "default"
+KNOWLEDGE_BASES_ROOT = "./knowledge_bases"
+
+# 多路查询检索配置
+MULTI_QUERY_MAX_VARIANTS = 4   # 单次检索最多使用的查询变体数（含原问题）
+MULTI_QUERY_FETCH_K = 8        # 每个变体召回的候选数，融合后再截断为k
+RRF_K = 60                     # 倒数排名融合(RRF)的平滑常数
+
+# 意图识别配置
+# 每个意图的原型向量是示例问题嵌入的均值；问题与最相近原型的余弦相似度低于阈值时回退到关键词规则。
+# 可在 INTENT_EXAMPLES_PATH 指向的JSON文件（{"意图": ["示例问题", ...]}）中追加示例或新增意图
+INTENT_EXAMPLES = {
+    "操作指导": ["如何安装和配置这个系统？", "怎样一步步完成部署", "具体的操作步骤是什么", "怎么使用这个功能",
+             "How do I set this up?"],
+    "原因解释": ["为什么会出现这个错误？", "导致这种现象的原因是什么", "这个机制的原理是什么", "为何要这样设计",
+             "Why does this happen?"],
+    "比较分析": ["这两种方法有什么区别？", "比较一下它们的优缺点", "A和B哪个性能更好", "对比不同方案的差异",
+             "What is the difference between A and B?"],
+    "推荐建议": ["你推荐使用哪种方案？", "有什么改进建议", "我应该选择哪个版本", "最佳实践是什么",
+             "What would you recommend?"],
+    "信息查询": ["什么是向量数据库？", "介绍一下这个概念", "这个参数表示什么意思", "文档中提到了哪些内容",
+             "What is this?"],
+}
+INTENT_EXAMPLES_PATH = "./intent_examples.json"
+INTENT_MIN_SIMILARITY = 0.4
+# 各意图的检索参数：k为最终返回的文献数，fetch_k为多路检索时每个查询变体的召回数
+INTENT_RETRIEVAL = {
+    "操作指导": {"k": 4, "fetch_k": 10},
+    "原因解释": {"k": 4, "fetch_k": 8},
+    "比较分析": {"k": 6, "fetch_k": 12},
+    "推荐建议": {"k": 4, "fetch_k": 8},
+    "信息查询": {"k": 3, "fetch_k": 8},
+}
+
+# 语料词表配置：入库时为每个文件提取标题与高频词/标识符，问题中命中时把检索限定在对应文件
+VOCABULARY_TERMS_PER_SOURCE = 20     # 每个文件保存的高频词与标识符数
+VOCABULARY_MIN_COUNT = 3             # 中文词组至少出现的次数
+VOCABULARY_SCAN_CHARS = 200_000      # 提取词表时最多扫描的字符数（长文档只看开头部分）
+VOCABULARY_MAX_SOURCE_FRACTION = 0.2  # 关联文件占比超过该值的词视为通用词，不用于限定检索范围
+VOCABULARY_MIN_TITLE_CHARS = 4       # 完整标题至少这么长才直接限定到该文件（过短的标题如“AI”按普通词条判断）
+
+# 近重复文档检测：上传时用MinHash签名与LSH分桶查找相似文档，签名保存在注册表旁的索引文件中
+MINHASH_INDEX_PATH = "./minhash_index.jsonl"
+MINHASH_PERMUTATIONS = 128       # 签名长度
+MINHASH_BANDS = 16               # LSH分段数（每段 128/16=8 行，候选相似度阈值约0.7）
+MINHASH_SHINGLE_SIZE = 5         # 字符shingle长度
+MINHASH_LOG_COMPACT_MIN = 256    # 签名日志中过期记录超过 有效记录数+该值 时压缩
+NEAR_DUPLICATE_THRESHOLD = 0.8   # 估计Jaccard相似度不低于该值视为近重复
+# 发现近重复时的处理：ask（在页面上让用户选择）/ skip（跳过）/ replace（替换旧版本）/ keep（作为新文档保留）
+NEAR_DUPLICATE_POLICY = "ask"
+
+# 对话记录：持久化到SQLite，消息只引用块id；页面只渲染最近一段，更早的消息按需加载
+CONVERSATION_DB_PATH = "./conversations.db"
+CONVERSATION_PAGE_SIZE = 20        # 每次渲染/加载的消息条数
+CONVERSATION_PROMPT_HISTORY = 6    # 带入提示词的最近消息条数
+
+# 共享索引服务配置
+# 设置 RBQA_INDEX_SERVICE_URL（如 http://127.0.0.1:8766）后，应用副本不再在进程内打开Chroma、
+# 注册表和嵌入模型，而是通过HTTP访问由 index_service.py 启动的唯一索引进程；为空时保持进程内模式
+INDEX_SERVICE_URL = os.environ.get("RBQA_INDEX_SERVICE_URL", "")
+INDEX_SERVICE_HOST = "127.0.0.1"
+INDEX_SERVICE_PORT = 8766
+INDEX_SERVICE_POOL_SIZE = 8    # 每个应用副本保持的长连接数
+INDEX_SERVICE_TIMEOUT = 300    # 单次请求超时（秒），大文件入库时嵌入耗时较长
+# 索引服务与应用副本共享的访问令牌（请求头 X-RBQA-Token），服务端未设置时拒绝启动
+INDEX_SERVICE_TOKEN = os.environ.get("RBQA_INDEX_SERVICE_TOKEN", "")
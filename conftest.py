@@ -0,0 +1,2 @@
+#conftest
+# 仓库根目录的conftest使pytest把根目录加入sys.path，测试可以直接导入顶层模块
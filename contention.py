@@ -0,0 +1,74 @@
+#contention
+import threading
+import time
+
+_registry_lock = threading.Lock()
+_locks = {}
+
+
+class InstrumentedLock:
+    """可重入锁，记录获取次数、等待总时长和最长等待，用于观察共享资源的锁竞争"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._stats_lock:
+            self.acquisitions = 0
+            self.contended = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+    def __enter__(self):
+        # 先尝试无等待获取，只有失败时才计为一次竞争
+        if self._lock.acquire(blocking=False):
+            wait = 0.0
+        else:
+            start = time.perf_counter()
+            self._lock.acquire()
+            wait = time.perf_counter() - start
+        with self._stats_lock:
+            self.acquisitions += 1
+            if wait:
+                self.contended += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "total_wait_s": round(self.total_wait, 6),
+                "max_wait_s": round(self.max_wait, 6),
+            }
+
+
+def get_lock(name):
+    """按名称获取进程内共享的锁"""
+    with _registry_lock:
+        if name not in _locks:
+            _locks[name] = InstrumentedLock(name)
+        return _locks[name]
+
+
+def lock_stats():
+    """所有命名锁的竞争统计"""
+    with _registry_lock:
+        locks = list(_locks.values())
+    return {lock.name: lock.stats() for lock in locks}
+
+
+def reset_lock_stats():
+    with _registry_lock:
+        locks = list(_locks.values())
+    for lock in locks:
+        lock.reset()
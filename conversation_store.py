@@ -0,0 +1,137 @@
+#conversation_store
+"""对话记录的持久化存储（SQLite）
+
+每轮问答写入一条用户消息和一条助手消息；助手消息的参考文献只保存 (知识库, 块id, 文件名)，
+正文在展开时通过 vector_store.get_chunks 按需取回。会话状态里只保存对话ID和窗口偏移，
+页面每次只读取固定条数的一页消息，内存与渲染开销不随对话长度增长。
+对话库由所有浏览器会话共用，每个对话记录所属的浏览器（owner），列表与打开对话都按它过滤。
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+from datetime import datetime
+from config import CONVERSATION_DB_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    refs TEXT,
+    analysis TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id);
+"""
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def _connect(path=CONVERSATION_DB_PATH):
+    # 每次操作使用独立连接：Streamlit的回调与后台线程不共享连接，多个副本可同时读写同一文件
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _init_lock:
+        if path not in _initialized:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+            # 早期的对话库没有owner列：补上该列，旧对话归属为空，不会出现在任何浏览器的列表中
+            if "owner" not in {row["name"] for row in conn.execute("PRAGMA table_info(conversations)")}:
+                conn.execute("ALTER TABLE conversations ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_owner ON conversations(owner, updated_at)")
+            conn.commit()
+            _initialized.add(path)
+    return conn
+
+
+def _message(row):
+    return {
+        "id": row["id"],
+        "role": row["role"],
+        "content": row["content"],
+        "references": json.loads(row["refs"]) if row["refs"] else [],
+        "analysis": json.loads(row["analysis"]) if row["analysis"] else None,
+    }
+
+
+def reference_entries(docs):
+    """检索结果 -> 参考文献条目（只保存定位信息，不保存正文）"""
+    return [{
+        "kb": doc.metadata.get("kb"),
+        "chunk_id": doc.metadata.get("chunk_id"),
+        "source": doc.metadata.get("source", f"文档{i}"),
+    } for i, doc in enumerate(docs, 1)]
+
+
+def create_conversation(title, owner):
+    """新建属于owner（浏览器标识）的对话，返回对话ID"""
+    conversation_id = uuid.uuid4().hex
+    now = datetime.now().isoformat()
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT INTO conversations (id, owner, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                     (conversation_id, owner, title[:50], now, now))
+    return conversation_id
+
+
+def conversation_exists(conversation_id, owner):
+    """对话存在且属于owner"""
+    with closing(_connect()) as conn:
+        return conn.execute("SELECT 1 FROM conversations WHERE id = ? AND owner = ?",
+                            (conversation_id, owner)).fetchone() is not None
+
+
+def add_message(conversation_id, role, content, references=None, analysis=None):
+    """追加一条消息，返回消息ID"""
+    now = datetime.now().isoformat()
+    with closing(_connect()) as conn, conn:
+        cursor = conn.execute(
+            "INSERT INTO messages (conversation_id, role, content, refs, analysis, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (conversation_id, role, content,
+             json.dumps(references, ensure_ascii=False) if references else None,
+             json.dumps(analysis, ensure_ascii=False, default=str) if analysis else None,
+             now))
+        conn.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+        return cursor.lastrowid
+
+
+def count_messages(conversation_id):
+    with closing(_connect()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?",
+                            (conversation_id,)).fetchone()[0]
+
+
+def recent_messages(conversation_id, limit, offset=0):
+    """跳过最新的offset条之后的limit条消息，按时间先后排列"""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT * FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (conversation_id, limit, offset)).fetchall()
+    return [_message(row) for row in reversed(rows)]
+
+
+def list_conversations(owner, limit=20):
+    """owner最近更新的对话 [{id, title, updated_at, messages}]"""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT c.id, c.title, c.updated_at, COUNT(m.id) AS messages FROM conversations c "
+            "LEFT JOIN messages m ON m.conversation_id = c.id WHERE c.owner = ? "
+            "GROUP BY c.id ORDER BY c.updated_at DESC LIMIT ?", (owner, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def delete_conversation(conversation_id):
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
@@ -0,0 +1,146 @@
+#document_catalog
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 可排序字段；缺失值排在最后。回收站还可按删除时间排序
+SORT_FIELDS = ("upload_time", "name", "size", "type")
+
+
+class DocumentCatalog:
+    """会话内的文档目录：按ID索引文档与回收站条目，维护标记倒排索引和排序结果缓存
+
+    查找、删除、恢复、打标记都是O(1)；分页查询只在目录变化后重新排序一次。
+    """
+
+    def __init__(self, entries: Iterable[Dict] = ()):
+        self._active = {}      # id -> 文档条目（保持插入顺序）
+        self._deleted = {}     # id -> 回收站条目（含deleted_time）
+        self._tag_index = {}   # 标记 -> 拥有该标记的在库文档ID集合
+        self._sorted = {}      # (是否回收站, 排序字段, 是否降序) -> 排好序的ID列表
+        for entry in entries:
+            if entry.get("deleted_time"):
+                self._deleted[entry["id"]] = entry
+            else:
+                self.add(entry)
+
+    # ---------- 查找 ----------
+    def __contains__(self, file_id):
+        return file_id in self._active
+
+    def __len__(self):
+        return len(self._active)
+
+    def get(self, file_id) -> Optional[Dict]:
+        return self._active.get(file_id) or self._deleted.get(file_id)
+
+    def is_deleted(self, file_id) -> bool:
+        return file_id in self._deleted
+
+    def deleted_count(self) -> int:
+        return len(self._deleted)
+
+    def tags(self) -> List[str]:
+        return sorted(tag for tag, ids in self._tag_index.items() if ids)
+
+    # ---------- 修改 ----------
+    def _changed(self):
+        self._sorted.clear()
+
+    def _index_tags(self, entry):
+        for tag in entry.get("tags", []):
+            self._tag_index.setdefault(tag, set()).add(entry["id"])
+
+    def _unindex_tags(self, entry):
+        for tag in entry.get("tags", []):
+            self._tag_index.get(tag, set()).discard(entry["id"])
+
+    def add(self, entry: Dict):
+        entry.setdefault("tags", [])
+        self._active[entry["id"]] = entry
+        self._index_tags(entry)
+        self._changed()
+
+    def mark_deleted(self, file_id, deleted_time) -> Optional[Dict]:
+        """移入回收站，返回条目；文件不在库中时返回None"""
+        entry = self._active.pop(file_id, None)
+        if entry is None:
+            return None
+        self._unindex_tags(entry)
+        entry["deleted_time"] = deleted_time
+        self._deleted[file_id] = entry
+        self._changed()
+        return entry
+
+    def restore(self, file_id) -> Optional[Dict]:
+        """从回收站移回，返回条目；不在回收站时返回None"""
+        entry = self._deleted.pop(file_id, None)
+        if entry is None:
+            return None
+        entry.pop("deleted_time", None)
+        self.add(entry)
+        return entry
+
+    def remove(self, file_id) -> Optional[Dict]:
+        """从目录中彻底移除（在库或回收站），返回条目；不存在时返回None"""
+        entry = self._active.pop(file_id, None)
+        if entry is not None:
+            self._unindex_tags(entry)
+        else:
+            entry = self._deleted.pop(file_id, None)
+        self._changed()
+        return entry
+
+    def clear_deleted(self):
+        self._deleted.clear()
+        self._changed()
+
+    def toggle_tag(self, file_id, tag) -> bool:
+        entry = self._active.get(file_id)
+        if entry is None:
+            return False
+        if tag in entry["tags"]:
+            entry["tags"].remove(tag)
+            self._tag_index.get(tag, set()).discard(file_id)
+        else:
+            entry["tags"].append(tag)
+            self._tag_index.setdefault(tag, set()).add(file_id)
+        return True
+
+    # ---------- 分页查询 ----------
+    def _sorted_ids(self, deleted, sort_by, descending):
+        key = (deleted, sort_by, descending)
+        if key not in self._sorted:
+            entries = self._deleted if deleted else self._active
+            present = [i for i, e in entries.items() if e.get(sort_by) is not None]
+            missing = [i for i, e in entries.items() if e.get(sort_by) is None]
+            present.sort(key=lambda i: entries[i][sort_by], reverse=descending)
+            self._sorted[key] = present + missing
+        return self._sorted[key]
+
+    def _filtered_ids(self, search, tags, sort_by, descending, deleted):
+        if sort_by not in SORT_FIELDS and not (deleted and sort_by == "deleted_time"):
+            raise ValueError(f"不支持的排序字段: {sort_by}")
+        ids = self._sorted_ids(deleted, sort_by, descending)
+        tags = list(tags)
+        if tags and not deleted:
+            allowed = set.intersection(*(self._tag_index.get(t, set()) for t in tags))
+            ids = [i for i in ids if i in allowed]
+        if search:
+            entries = self._deleted if deleted else self._active
+            needle = search.lower()
+            ids = [i for i in ids if needle in entries[i]["name"].lower()]
+        return ids
+
+    def count(self, search: str = "", tags: Iterable[str] = (), deleted: bool = False) -> int:
+        """匹配搜索与标记条件的文档数"""
+        if not search and not tags:
+            return len(self._deleted if deleted else self._active)
+        return len(self._filtered_ids(search, tags, "upload_time", True, deleted))
+
+    def query(self, search: str = "", tags: Iterable[str] = (), sort_by: str = "upload_time",
+              descending: bool = True, page: int = 1, page_size: int = 20,
+              deleted: bool = False) -> Tuple[List[Dict], int]:
+        """按文件名搜索、按标记过滤（需同时具有所有标记）并排序，返回 (当前页条目, 匹配总数)"""
+        ids = self._filtered_ids(search, tags, sort_by, descending, deleted)
+        entries = self._deleted if deleted else self._active
+        start = (max(page, 1) - 1) * page_size
+        return [entries[i] for i in ids[start:start + page_size]], len(ids)
@@ -0,0 +1,280 @@
+#embedding_backend
+import abc
+import queue
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import List, Dict
+from config import (
+    EMBEDDING_MODEL_LANGCHAIN,
+    EMBEDDING_BACKEND,
+    EMBEDDING_NUM_THREADS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_LENGTH,
+    ONNX_EXPORT_DIR,
+    EMBEDDING_MAX_BATCH
+)
+
+SUPPORTED_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8", "stub")
+
+
+class _TransformerEmbeddings(abc.ABC):
+    """CPU嵌入后端基类，接口与LangChain的Embeddings保持一致
+
+    池化方式与sentence-transformers对普通transformers模型的默认处理相同
+    （attention mask加权的mean pooling，不做归一化），保证与torch路径的向量可互换。
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_LANGCHAIN, num_threads=EMBEDDING_NUM_THREADS,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_length=EMBEDDING_MAX_LENGTH):
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    @abc.abstractmethod
+    def _forward(self, encoded: Dict):
+        """返回 last_hidden_state，形状为 (batch, seq, dim) 的numpy数组"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+        if not texts:
+            return []
+        # 按长度排序后分批，减少padding带来的无效计算
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch_idx = order[start:start + self.batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            hidden = self._forward(encoded)
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            for i, vec in zip(batch_idx, pooled):
+                results[i] = vec.astype(np.float32).tolist()
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class TorchInt8Embeddings(_TransformerEmbeddings):
+    """PyTorch动态int8量化（仅量化Linear层）"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        import torch
+        from transformers import AutoModel
+        torch.set_num_threads(self.num_threads)
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _forward(self, encoded):
+        import torch
+        inputs = {k: torch.from_numpy(v) for k, v in encoded.items()}
+        with torch.inference_mode():
+            return self.model(**inputs).last_hidden_state.numpy()
+
+
+class OnnxEmbeddings(_TransformerEmbeddings):
+    """ONNX Runtime推理，首次使用时导出模型并缓存到ONNX_EXPORT_DIR"""
+
+    def __init__(self, quantize=False, export_dir=ONNX_EXPORT_DIR, **kwargs):
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+        model_path = self._ensure_exported(Path(export_dir) / self.model_name.replace("/", "__"), quantize)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _ensure_exported(self, target_dir: Path, quantize: bool) -> Path:
+        """导出fp32 ONNX模型，需要时再生成int8动态量化版本"""
+        target_dir.mkdir(parents=True, exist_ok=True)
+        fp32_path = target_dir / "model.onnx"
+        if not fp32_path.exists():
+            import torch
+            from transformers import AutoModel
+            model = AutoModel.from_pretrained(self.model_name)
+            model.eval()
+            dummy = self.tokenizer(["导出"], return_tensors="pt")
+            # 按BERT类模型forward的位置参数顺序排列输入
+            input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+            dynamic_axes = {name: {0: "batch", 1: "seq"} for name in input_names}
+            dynamic_axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+            torch.onnx.export(
+                model,
+                tuple(dummy[name] for name in input_names),
+                str(fp32_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        if not quantize:
+            return fp32_path
+
+        int8_path = target_dir / "model_int8.onnx"
+        if not int8_path.exists():
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+        return int8_path
+
+    def _forward(self, encoded):
+        import numpy as np
+        feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        return self.session.run(["last_hidden_state"], feeds)[0]
+
+
+class StubEmbeddings:
+    """确定性的哈希嵌入（字符二元组特征哈希），无语义能力，仅用于压测与离线调试
+
+    同时提供 embed_documents/embed_query（LangChain接口）与 encode（sentence-transformers接口）。
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _vector(self, text):
+        import numpy as np
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(len(text) - 1, 1)):
+            h = zlib.crc32(text[i:i + 2].encode("utf-8"))
+            vec[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t).tolist() for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text).tolist()
+
+    def encode(self, sentences, **kwargs):
+        import numpy as np
+        return np.stack([self._vector(s) for s in sentences])
+
+
+class BatchingEmbeddings:
+    """把多个线程并发提交的嵌入请求合并为一次批量计算
+
+    第一个请求到达后最多再等待window_ms收集其他请求，合并后交给内层嵌入函数，
+    再按提交顺序拆分结果。查询按单条文档嵌入（各后端对查询与文档的计算相同）。
+    """
+
+    def __init__(self, inner, window_ms, max_batch=EMBEDDING_MAX_BATCH):
+        self.inner = inner
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.requests = 0
+        self.batches = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0]["texts"])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    slot = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(slot)
+                size += len(slot["texts"])
+
+            texts = [t for slot in pending for t in slot["texts"]]
+            try:
+                vectors = self.inner.embed_documents(texts)
+                offset = 0
+                for slot in pending:
+                    slot["vectors"] = vectors[offset:offset + len(slot["texts"])]
+                    offset += len(slot["texts"])
+            except Exception as e:
+                for slot in pending:
+                    slot["error"] = e
+            self.requests += len(pending)
+            self.batches += 1
+            for slot in pending:
+                slot["done"].set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        slot = {"texts": list(texts), "done": threading.Event()}
+        self._queue.put(slot)
+        slot["done"].wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["vectors"]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_requests_per_batch": round(self.requests / self.batches, 2) if self.batches else 0.0
+        }
+
+
+def create_embedding_function(backend=EMBEDDING_BACKEND):
+    """按配置创建嵌入函数"""
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_LANGCHAIN,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': False}
+        )
+    if backend == "torch_int8":
+        return TorchInt8Embeddings()
+    if backend == "onnx":
+        return OnnxEmbeddings(quantize=False)
+    if backend == "onnx_int8":
+        return OnnxEmbeddings(quantize=True)
+    if backend == "stub":
+        return StubEmbeddings()
+    raise ValueError(f"未知的嵌入后端: {backend}，可选值: {', '.join(SUPPORTED_BACKENDS)}")
+
+
+def check_parity(texts: List[str], backend: str, reference=None) -> Dict:
+    """比较指定后端与torch路径的向量余弦一致性及耗时"""
+    import numpy as np
+    reference = reference or create_embedding_function("torch")
+    candidate = create_embedding_function(backend)
+
+    start = time.perf_counter()
+    ref = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    ref_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cand = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    cand_seconds = time.perf_counter() - start
+
+    cosine = (ref * cand).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(cand, axis=1))
+    return {
+        "backend": backend,
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "torch_seconds": ref_seconds,
+        "backend_seconds": cand_seconds,
+        "speedup": ref_seconds / cand_seconds if cand_seconds else float("inf"),
+    }
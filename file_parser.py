@@ -1,43 +1,51 @@
 #file_parser
+# PyPDF2 / python-pptx / python-docx / nltk 体积较大，均在首次使用时才导入，避免拖慢应用启动
 import os
-import json
-import pandas as pd
-import PyPDF2
 import tempfile
-import pptx
-from docx import Document
 import streamlit as st
 import hashlib
 import re
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 from file_registry import FileRegistry
-from config import PERSISTENT_UPLOAD_FOLDER
+from knowledge_bases import resolve_kb, upload_folder
 from pathlib import Path
 from werkzeug.utils import secure_filename
-import nltk
-
-# 下载nltk资源
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('punkt')
-    nltk.download('stopwords')
-
-def save_uploaded_file(file, file_id):
-    """持久化保存文件"""
+from text_stream import STREAMED_TYPES, read_text, iter_text_blocks, iter_text_chunks
+from near_duplicates import MinHasher, minhash_signature
+from vocabulary_index import extract_terms
+from config import VOCABULARY_SCAN_CHARS
+
+_nltk_ready = False
+
+def _ensure_nltk():
+    """首次需要时检查并下载nltk资源"""
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt')
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('punkt')
+        nltk.download('stopwords')
+    _nltk_ready = True
+
+def save_uploaded_file(file, file_id, kb=None, terms=None):
+    """持久化保存文件到知识库的上传目录（terms随注册一并写入）"""
+    kb = resolve_kb(kb)
     try:
         # 确保文件名安全且唯一
         safe_name = f"{file_id}_{secure_filename(file.name)}"
-        save_path = os.path.join(PERSISTENT_UPLOAD_FOLDER, safe_name)
+        folder = upload_folder(kb)
+        folder.mkdir(parents=True, exist_ok=True)
+        save_path = os.path.join(folder, safe_name)
         
         # 保存文件
         with open(save_path, "wb") as f:
             f.write(file.getbuffer())
             
         # 注册文件
-        FileRegistry.add_file(file_id, file.name, save_path)
+        FileRegistry.add_file(file_id, file.name, save_path, kb, terms=terms)
         return save_path
     except Exception as e:
         st.error(f"文件保存失败: {str(e)}")
@@ -50,52 +58,47 @@ def parse_file(file, original_filename=None):
     tmp_path = None  # 初始化tmp_path
 
     try:
-        # 根据文件对象的类型获取文件名和内容
+        # 根据文件对象的类型获取文件名
         if hasattr(file, 'getvalue'):  # Streamlit UploadedFile
             filename_for_type = file.name
             filename_for_error = file.name
-            file_content = file.getvalue()
         else:  # 标准文件句柄 (from open(..., 'rb'))
             # 对于文件句柄，必须依赖传递的original_filename来获取类型
             filename_for_type = original_filename if original_filename else file.name
             filename_for_error = file.name # 在错误日志中记录实际路径
-            file_content = file.read()
 
         # 使用os.path.splitext安全地获取文件扩展名
-        _ , file_ext = os.path.splitext(filename_for_type)
-        file_type = file_ext.lower().replace('.', '')
+        file_type = _file_type(file, filename_for_type)
+
+        # DOCX/PPTX直接从文件对象流式解析XML部件，无需整体读入内存或写临时文件
+        if file_type in ("docx", "pptx"):
+            from ooxml_parser import iter_docx_paragraphs, iter_pptx_slides
+            file.seek(0)
+            if file_type == "docx":
+                content = "\n".join(iter_docx_paragraphs(file))
+            else:
+                content = "\n\n".join(iter_pptx_slides(file))
+            return content if content and content.strip() else ""
 
+        # 纯文本与Markdown按块解码（编码由文件开头的样本判断），不写临时文件
+        if file_type in STREAMED_TYPES:
+            content = read_text(file)
+            return content if content and content.strip() else ""
+
+        file_content = file.getvalue() if hasattr(file, 'getvalue') else file.read()
         with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp:
             tmp.write(file_content)
             tmp_path = tmp.name
 
-        if file_type == "txt":
-            # 尝试用utf-8解码，如果失败则尝试其他编码
-            try:
-                with open(tmp_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                with open(tmp_path, "r", encoding="gbk", errors='ignore') as f:
-                    content = f.read()
-
-        elif file_type == "pdf":
+        if file_type == "pdf":
+            import PyPDF2
             reader = PyPDF2.PdfReader(tmp_path)
+            pages = []
             for page in reader.pages:
                 text = page.extract_text()
                 if text:
-                    content += text + "\n"
-
-        elif file_type == "docx":
-            doc = Document(tmp_path)
-            for para in doc.paragraphs:
-                content += para.text + "\n"
-
-        elif file_type == "pptx":
-            prs = pptx.Presentation(tmp_path)
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text:
-                        content += shape.text + "\n"
+                    pages.append(text + "\n")
+            content = "".join(pages)
 
         return content if content and content.strip() else ""
 
@@ -107,10 +110,52 @@ def parse_file(file, original_filename=None):
         if tmp_path and os.path.exists(tmp_path):
             os.unlink(tmp_path)
     
+def _file_type(file, original_filename=None):
+    name = original_filename or file.name
+    return os.path.splitext(name)[1].lower().replace('.', '')
+
+def parse_features(file, original_filename=None):
+    """解析文件并计算入库所需的特征，返回 (正文, MinHash签名, 词表)；提取不到文本时返回None
+
+    纯文本与Markdown只分块扫描一遍，边读边计算签名、只保留开头部分用于提取词表，正文返回None，
+    入库时由iter_chunks再次流式分块，整个过程不在内存中保留全文。
+    """
+    if _file_type(file, original_filename) not in STREAMED_TYPES:
+        content = parse_file(file, original_filename)
+        if not content:
+            return None
+        return content, minhash_signature(content), extract_terms(content)
+
+    hasher, head, head_len, has_text = MinHasher(), [], 0, False
+    try:
+        for block in iter_text_blocks(file):
+            hasher.update(block)
+            has_text = has_text or bool(block.strip())
+            if head_len < VOCABULARY_SCAN_CHARS:
+                head.append(block[:VOCABULARY_SCAN_CHARS - head_len])
+                head_len += len(head[-1])
+    except Exception as e:
+        st.error(f"解析文件 '{original_filename or file.name}' 时出错: {str(e)}")
+        return None
+    return (None, hasher.signature(), extract_terms("".join(head))) if has_text else None
+
+def iter_chunks(file, content, splitter, original_filename=None):
+    """文件分块，返回 (块文本, 额外metadata)
+
+    content为None（parse_features对纯文本与Markdown的结果）时从文件流式分块，Markdown块附带标题路径；
+    否则分割已解析的正文。
+    """
+    if content is None:
+        return iter_text_chunks(file, _file_type(file, original_filename), splitter)
+    return ((chunk, {}) for chunk in splitter.split_text(content))
+
 def preprocess_text(text):
     """文本预处理"""
     if not text:
         return ""
+    _ensure_nltk()
+    from nltk.tokenize import word_tokenize
+    from nltk.corpus import stopwords
     
     # 转换为小写
     text = text.lower()
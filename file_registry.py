@@ -2,43 +2,138 @@
 import json
 from pathlib import Path
 from datetime import datetime
-from config import FILE_REGISTRY_DB
+from knowledge_bases import resolve_kb, registry_path
+from contention import get_lock
+from config import INDEX_SERVICE_URL
+
+# 注册表是“读-改-写”的JSON文件，多个会话并发写入时需要串行化
+_registry_lock = get_lock("registry")
+
+def _remote(op, **kwargs):
+    """共享索引服务模式：注册表由索引进程持有，多个应用副本通过它读写"""
+    from index_client import get_index_client
+    return get_index_client().call(f"registry.{op}", **kwargs)
 
 class FileRegistry:
+    """文件注册表，每个知识库一个独立的注册表文件；kb为None时使用当前知识库"""
+
     @staticmethod
-    def load():
+    def load(kb=None):
         """加载文件注册表"""
-        try:
-            if Path(FILE_REGISTRY_DB).exists():
-                with open(FILE_REGISTRY_DB, 'r') as f:
-                    return json.load(f)
-            return {}
-        except json.JSONDecodeError:
-            return {}
+        if INDEX_SERVICE_URL:
+            return _remote("load", kb=resolve_kb(kb))
+        with _registry_lock:
+            path = registry_path(resolve_kb(kb))
+            try:
+                if path.exists():
+                    with open(path, 'r') as f:
+                        return json.load(f)
+                return {}
+            except json.JSONDecodeError:
+                return {}
 
     @staticmethod
-    def save(registry):
-        """保存文件注册表"""
-        with open(FILE_REGISTRY_DB, 'w') as f:
-            json.dump(registry, f, indent=2)
+    def save(registry, kb=None):
+        """保存（整体覆盖）文件注册表；共享索引服务不提供远程覆盖，只能在索引进程所在节点调用"""
+        if INDEX_SERVICE_URL:
+            raise RuntimeError("共享索引服务模式下不能远程覆盖注册表")
+        with _registry_lock:
+            path = registry_path(resolve_kb(kb))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(registry, f, indent=2)
 
     @staticmethod
-    def add_file(file_id, filename, filepath):
-        """注册新文件"""
-        registry = FileRegistry.load()
-        registry[file_id] = {
-            "filename": filename,
-            "filepath": str(Path(filepath).absolute()),
-            "timestamp": datetime.now().isoformat()
-        }
-        FileRegistry.save(registry)
+    def add_file(file_id, filename, filepath, kb=None, terms=None):
+        """注册新文件；terms为入库时提取的词表（见vocabulary_index）"""
+        if INDEX_SERVICE_URL:
+            # 路径在本进程解析为绝对路径，索引进程与应用副本需共享同一文件系统
+            return _remote("add_file", file_id=file_id, filename=filename,
+                           filepath=str(Path(filepath).absolute()), kb=resolve_kb(kb), terms=terms)
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            registry[file_id] = {
+                "filename": filename,
+                "filepath": str(Path(filepath).absolute()),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "size": Path(filepath).stat().st_size  # 存下大小，加载文件列表时无需逐个stat
+            }
+            if terms is not None:
+                registry[file_id]["terms"] = terms
+            FileRegistry.save(registry, kb)
 
     @staticmethod
-    def remove_file(file_id):
+    def remove_file(file_id, kb=None):
         """移除文件注册"""
-        registry = FileRegistry.load()
-        if file_id in registry:
-            del registry[file_id]
-            FileRegistry.save(registry)
+        if INDEX_SERVICE_URL:
+            return _remote("remove_file", file_id=file_id, kb=resolve_kb(kb))
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            if file_id in registry:
+                del registry[file_id]
+                FileRegistry.save(registry, kb)
+                return True
+            return False
+
+    @staticmethod
+    def mark_deleted(file_id, kb=None):
+        """软删除：记录删除时间，文件与向量保留到回收站清理时"""
+        if INDEX_SERVICE_URL:
+            return _remote("mark_deleted", file_id=file_id, kb=resolve_kb(kb))
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            if file_id not in registry:
+                return False
+            registry[file_id]["deleted_time"] = datetime.now().isoformat(timespec="seconds")
+            FileRegistry.save(registry, kb)
+            return True
+
+    @staticmethod
+    def mark_restored(file_id, kb=None):
+        """清除软删除标记"""
+        if INDEX_SERVICE_URL:
+            return _remote("mark_restored", file_id=file_id, kb=resolve_kb(kb))
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            if file_id not in registry or "deleted_time" not in registry[file_id]:
+                return False
+            del registry[file_id]["deleted_time"]
+            FileRegistry.save(registry, kb)
             return True
-        return False
\ No newline at end of file
+
+    @staticmethod
+    def relocate(paths, kb=None):
+        """批量更新文件路径（file_id -> 新路径），返回实际更新的条数"""
+        if INDEX_SERVICE_URL:
+            return _remote("relocate", paths=paths, kb=resolve_kb(kb))
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            updated = 0
+            for file_id, filepath in paths.items():
+                if file_id in registry:
+                    registry[file_id]["filepath"] = str(Path(filepath).absolute())
+                    updated += 1
+            if updated:
+                FileRegistry.save(registry, kb)
+            return updated
+
+    @staticmethod
+    def set_terms(terms, kb=None):
+        """批量写入文件词表（file_id -> 词列表），返回实际更新的条数"""
+        if INDEX_SERVICE_URL:
+            return _remote("set_terms", terms=terms, kb=resolve_kb(kb))
+        with _registry_lock:
+            registry = FileRegistry.load(kb)
+            updated = 0
+            for file_id, file_terms in terms.items():
+                if file_id in registry:
+                    registry[file_id]["terms"] = file_terms
+                    updated += 1
+            if updated:
+                FileRegistry.save(registry, kb)
+            return updated
+
+    @staticmethod
+    def deleted_ids(kb=None):
+        """回收站中的文件ID（即检索时需要过滤的墓碑集合）"""
+        return {file_id for file_id, info in FileRegistry.load(kb).items() if "deleted_time" in info}
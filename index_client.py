@@ -0,0 +1,86 @@
+#index_client
+import http.client
+import json
+import queue
+import threading
+from typing import List
+from urllib.parse import urlsplit
+from config import INDEX_SERVICE_URL, INDEX_SERVICE_POOL_SIZE, INDEX_SERVICE_TIMEOUT, INDEX_SERVICE_TOKEN
+
+_client_lock = threading.Lock()
+_client = None
+
+
+class IndexServiceError(RuntimeError):
+    """索引服务返回的错误"""
+
+
+class IndexServiceClient:
+    """共享索引服务的HTTP客户端，复用长连接（连接池），线程安全"""
+
+    def __init__(self, base_url, pool_size=INDEX_SERVICE_POOL_SIZE, timeout=INDEX_SERVICE_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        # 池中最多保留pool_size条空闲连接，超出的并发请求用临时连接，用完即关闭
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def call(self, op, **kwargs):
+        """调用索引服务的一个操作，参数与返回值均为JSON"""
+        body = json.dumps(kwargs, ensure_ascii=False).encode("utf-8")
+        # 复用的长连接可能已被服务端关闭，此时换新连接重试一次
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                conn.request("POST", f"{self.prefix}/{op}", body=body,
+                             headers={"Content-Type": "application/json", "X-RBQA-Token": INDEX_SERVICE_TOKEN})
+                response = conn.getresponse()
+                payload = json.loads(response.read() or b"{}")
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            self._release(conn)
+            if response.status != 200:
+                raise IndexServiceError(payload.get("error", f"HTTP {response.status}"))
+            return payload.get("result")
+
+
+class RemoteEmbeddings:
+    """通过索引服务计算嵌入，应用副本本身不加载嵌入模型"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.call("embed_documents", texts=list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.call("embed_query", text=text)
+
+
+def get_index_client():
+    """进程内共享的索引服务客户端"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IndexServiceClient(INDEX_SERVICE_URL)
+        return _client
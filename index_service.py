@@ -0,0 +1,168 @@
+#index_service
+"""共享索引服务
+
+用法: python index_service.py [--host 127.0.0.1] [--port 8766]
+应用副本设置 RBQA_INDEX_SERVICE_URL=http://127.0.0.1:8766 后，向量库、注册表和嵌入模型
+都由本进程唯一持有，多个Streamlit副本可以安全地共用同一个知识库。
+所有副本的嵌入请求在这里按时间窗合并为批量计算（RBQA_EMBEDDING_BATCH_WINDOW_MS，默认5ms）。
+上传文件仍由各副本写入本地目录，因此索引进程与副本需运行在同一台机器（共享文件系统）上。
+服务与副本需设置相同的 RBQA_INDEX_SERVICE_TOKEN：请求必须带有该令牌且为application/json，
+因此浏览器页面无法借用户的本机访问伪造请求。清空向量库、整体覆盖注册表等破坏性操作不提供远程接口。
+"""
+import argparse
+import hmac
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 索引进程自身始终以进程内模式访问Chroma与注册表，必须在导入config之前设置
+os.environ.pop("RBQA_INDEX_SERVICE_URL", None)
+os.environ.setdefault("RBQA_EMBEDDING_BATCH_WINDOW_MS", "5")
+
+import vector_store as db_op  # noqa: E402
+import near_duplicates  # noqa: E402
+import reconcile  # noqa: E402
+from file_registry import FileRegistry  # noqa: E402
+from knowledge_bases import check_kb_name  # noqa: E402
+from contention import lock_stats  # noqa: E402
+from config import (  # noqa: E402
+    INDEX_SERVICE_HOST,
+    INDEX_SERVICE_PORT,
+    INDEX_SERVICE_TOKEN,
+    DEFAULT_KNOWLEDGE_BASE
+)
+
+
+def _documents(docs):
+    return [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]
+
+
+# 操作名与 vector_store / FileRegistry / near_duplicates 的函数名一一对应，参数按关键字传递
+_OPERATIONS = {
+    "embed_documents": lambda texts: db_op.get_embedding_function().embed_documents(texts),
+    "embed_query": lambda text: db_op.get_embedding_function().embed_query(text),
+    "add_texts_to_db": db_op.add_texts_to_db,
+    "add_embedded_texts": db_op.add_embedded_texts,
+    "has_source": db_op.has_source,
+    "source_counts": db_op.source_counts,
+    "source_chunks": db_op.source_chunks,
+    "search_db": lambda **kwargs: _documents(db_op.search_db(**kwargs)),
+    "search_db_multi": lambda **kwargs: _documents(db_op.search_db_multi(**kwargs)),
+    "get_chunks": lambda **kwargs: _documents(db_op.get_chunks(**kwargs)),
+    "get_tombstones": lambda kb: sorted(db_op.get_tombstones(kb)),
+    "tombstone_source": db_op.tombstone_source,
+    "revive_source": db_op.revive_source,
+    "delete_from_db_by_source_id": db_op.delete_from_db_by_source_id,
+    "delete_sources": db_op.delete_sources,
+    "load_existing_documents": db_op.load_existing_documents,
+    "get_vector_count": db_op.get_vector_count,
+    "migrate_to_compact_storage": db_op.migrate_to_compact_storage,
+    # 核对修复在本进程内持锁执行，各副本启动时的核对不会同时对同一文件“检查后入库”
+    "reconcile_knowledge_base": reconcile.reconcile_knowledge_base,
+    "registry.load": FileRegistry.load,
+    "registry.add_file": FileRegistry.add_file,
+    "registry.remove_file": FileRegistry.remove_file,
+    "registry.mark_deleted": FileRegistry.mark_deleted,
+    "registry.mark_restored": FileRegistry.mark_restored,
+    "registry.relocate": FileRegistry.relocate,
+    "registry.set_terms": FileRegistry.set_terms,
+    "dedup.register": near_duplicates.register_signature,
+    "dedup.remove": near_duplicates.remove_signatures,
+    "dedup.query": lambda signature, kb, threshold: near_duplicates.find_near_duplicates(signature, kb, threshold),
+    "dedup.ids": lambda kb: sorted(near_duplicates.signature_ids(kb)),
+}
+
+
+def service_stats():
+    """嵌入合并与锁竞争统计"""
+    embeddings = db_op.get_embedding_function()
+    return {
+        "embedding_batching": embeddings.stats() if hasattr(embeddings, "stats") else None,
+        "locks": lock_stats()
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持长连接，配合客户端连接池
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send_json(200, {"result": {"status": "ok", **service_stats()}})
+        else:
+            self._send_json(404, {"error": f"未知路径: {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        op = self.path.strip("/")
+        # 浏览器跨站只能发送text/plain等“简单请求”且无法附带自定义请求头，两项检查缺一不可
+        if not hmac.compare_digest(self.headers.get("X-RBQA-Token", "").encode("utf-8"),
+                                   INDEX_SERVICE_TOKEN.encode("utf-8")):
+            self._send_json(401, {"error": "访问令牌无效"})
+            return
+        if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            self._send_json(415, {"error": "请求体必须为application/json"})
+            return
+        operation = _OPERATIONS.get(op)
+        if operation is None:
+            self._send_json(404, {"error": f"未知操作: {op}"})
+            return
+        try:
+            kwargs = json.loads(body or b"{}")
+            if not isinstance(kwargs, dict):
+                raise ValueError("请求体必须是JSON对象")
+            if kwargs.get("kb") is not None:
+                check_kb_name(kwargs["kb"])
+        except ValueError as e:  # JSONDecodeError是ValueError的子类
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            self._send_json(200, {"result": operation(**kwargs)})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 默认监听队列只有5，多个副本同时建连时会被重置
+
+
+def start_service(host=INDEX_SERVICE_HOST, port=INDEX_SERVICE_PORT):
+    """预热嵌入模型与默认知识库后启动服务，返回server（调用方负责serve_forever）"""
+    if not INDEX_SERVICE_TOKEN:
+        raise RuntimeError("未设置 RBQA_INDEX_SERVICE_TOKEN，索引服务拒绝启动")
+    db_op.get_embedding_function()
+    db_op.get_vector_db(DEFAULT_KNOWLEDGE_BASE)
+    return _Server((host, port), _Handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享索引服务（向量库、注册表与嵌入模型）")
+    parser.add_argument("--host", default=INDEX_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=INDEX_SERVICE_PORT)
+    args = parser.parse_args()
+
+    try:
+        server = start_service(args.host, args.port)
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"索引服务已启动: http://{args.host}:{server.server_address[1]}（Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#intent_classifier
+import json
+import logging
+from pathlib import Path
+import numpy as np
+import streamlit as st
+from model_loader import get_embedding_model
+from config import (
+    INTENT_EXAMPLES,
+    INTENT_EXAMPLES_PATH,
+    INTENT_MIN_SIMILARITY,
+    INTENT_RETRIEVAL,
+    MULTI_QUERY_FETCH_K
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTENT = "信息查询"
+
+# 关键词规则：没有嵌入模型或原型相似度过低时使用，按顺序匹配
+KEYWORD_RULES = [
+    ("操作指导", ["如何", "怎样", "步骤"]),
+    ("原因解释", ["为什么", "原因", "为何"]),
+    ("比较分析", ["比较", "对比", "vs"]),
+    ("推荐建议", ["推荐", "建议", "应该"]),
+]
+
+
+def keyword_intent(question):
+    """关键词规则识别意图"""
+    text = question.lower()
+    for intent, words in KEYWORD_RULES:
+        if any(word in text for word in words):
+            return intent
+    return DEFAULT_INTENT
+
+
+def retrieval_profile(intent):
+    """意图对应的检索参数（k与fetch_k），未配置的意图使用默认值"""
+    return {"k": 3, "fetch_k": MULTI_QUERY_FETCH_K, **INTENT_RETRIEVAL.get(intent, {})}
+
+
+def load_examples(path=INTENT_EXAMPLES_PATH):
+    """配置中的示例问题，加上JSON文件中追加的示例（文件不存在或格式错误时忽略）"""
+    examples = {intent: list(questions) for intent, questions in INTENT_EXAMPLES.items()}
+    path = Path(path)
+    if path.exists():
+        try:
+            extra = json.loads(path.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            extra = {}
+        for intent, questions in extra.items():
+            examples.setdefault(intent, []).extend(questions)
+    return examples
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class IntentClassifier:
+    """原型向量意图分类器：每个意图一行单位向量，分类只需一次矩阵-向量乘法"""
+
+    def __init__(self, model, examples, min_similarity=INTENT_MIN_SIMILARITY):
+        self.intents = [intent for intent, questions in examples.items() if questions]
+        texts = [q for intent in self.intents for q in examples[intent]]
+        vectors = _normalize(np.asarray(model.encode(texts), dtype=np.float32))
+        # 每个意图的原型 = 其示例嵌入的均值（再归一化），所有示例一次批量编码
+        prototypes, start = [], 0
+        for intent in self.intents:
+            count = len(examples[intent])
+            prototypes.append(vectors[start:start + count].mean(axis=0))
+            start += count
+        self.prototypes = _normalize(np.stack(prototypes))
+        self.min_similarity = min_similarity
+
+    def scores(self, embedding):
+        """问题嵌入与各意图原型的余弦相似度"""
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        return dict(zip(self.intents, (self.prototypes @ query).tolist()))
+
+    def classify(self, embedding):
+        """返回 (意图, 相似度)；最高相似度低于阈值时意图为None"""
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        similarities = self.prototypes @ query
+        best = int(np.argmax(similarities))
+        score = float(similarities[best])
+        return (self.intents[best] if score >= self.min_similarity else None), score
+
+
+@st.cache_resource
+def _build_classifier():
+    # 模型不可用时抛出异常而不是返回None：cache_resource不缓存异常，模型恢复后下次调用即可重建
+    model = get_embedding_model()
+    if model is None:
+        raise RuntimeError("嵌入模型不可用")
+    return IntentClassifier(model, load_examples())
+
+
+def get_intent_classifier():
+    """进程内共享的意图分类器，嵌入模型不可用时返回None"""
+    try:
+        return _build_classifier()
+    except Exception as e:
+        logger.warning("意图分类器初始化失败: %s", e)
+        return None
+
+
+def classify_intent(question, embedding=None):
+    """用问题已有的嵌入做原型分类，失败或置信度不足时回退到关键词规则
+
+    返回 {"intent", "score", "method"}，method 为 "prototype" 或 "keyword"。
+    """
+    classifier = get_intent_classifier() if embedding is not None else None
+    if classifier is not None:
+        intent, score = classifier.classify(embedding)
+        if intent is not None:
+            return {"intent": intent, "score": round(score, 3), "method": "prototype"}
+        return {"intent": keyword_intent(question), "score": round(score, 3), "method": "keyword"}
+    return {"intent": keyword_intent(question), "score": None, "method": "keyword"}
@@ -1,88 +1,205 @@
 #knowledge_base_manager
 import re
 import streamlit as st
-from datetime import datetime
-from file_parser import parse_file, generate_file_id,save_uploaded_file
+from datetime import datetime, timedelta
+from file_parser import parse_features, iter_chunks, generate_file_id, save_uploaded_file
 import vector_store as db_op
 import os
 from file_registry import FileRegistry
 from pathlib import Path
+from ai_service import rewrite_query
+from model_loader import get_embedding_model, get_text_splitter
+from intent_classifier import classify_intent, retrieval_profile
+from near_duplicates import find_near_duplicates, register_signature, remove_signatures
+from config import MULTI_QUERY_MAX_VARIANTS, RECYCLE_BIN_RETENTION_DAYS, NEAR_DUPLICATE_POLICY, INGEST_BATCH_CHUNKS
+
+# 按意图补充的检索改写模板
+INTENT_REWRITE_TEMPLATES = {
+    "操作指导": "{question} 具体步骤 操作方法",
+    "原因解释": "{question} 原因 机制 原理",
+    "比较分析": "{question} 区别 优缺点 对比",
+    "推荐建议": "{question} 建议 最佳实践",
+    "信息查询": "{question} 定义 概念 说明",
+}
+
 # 语义分析函数
 def semantic_analysis(question):
-    # 1. 意图识别
-    intent = "信息查询"  # 默认意图
-
-    if any(word in question.lower() for word in ["如何", "怎样", "步骤"]):
-        intent = "操作指导"
-    elif any(word in question.lower() for word in ["为什么", "原因", "为何"]):
-        intent = "原因解释"
-    elif any(word in question.lower() for word in ["比较", "对比", "vs"]):
-        intent = "比较分析"
-    elif any(word in question.lower() for word in ["推荐", "建议", "应该"]):
-        intent = "推荐建议"
-
-    # 2. 关键实体提取（简化版）
-    entities = re.findall(r'[\u4e00-\u9fff]{2,}|[a-zA-Z]{3,}', question)
-
-    # 3. 生成语义向量
-    model = st.session_state.embedding_model
+    # 1. 生成语义向量（意图识别与上下文关联分析都复用它）
+    model = get_embedding_model()
     embedding = model.encode([question])[0] if model else None
 
+    # 2. 意图识别：与意图原型向量做一次相似度计算，置信度不足时回退到关键词规则
+    intent_info = classify_intent(question, embedding)
+    intent = intent_info["intent"]
+
+    # 3. 关键实体提取（简化版）
+    entities = re.findall(r'[\u4e00-\u9fff]{2,}|[a-zA-Z]{3,}', question)
+
     return {
         "intent": intent,
+        "intent_score": intent_info["score"],
+        "intent_method": intent_info["method"],
         "entities": entities,
-        "embedding": embedding
+        "embedding": embedding,
+        "retrieval": retrieval_profile(intent)
     }
 
+# 构建多路检索的查询变体
+def build_query_variants(question, semantic_info, api_key=None, use_llm=False,
+                         max_variants=MULTI_QUERY_MAX_VARIANTS):
+    """基于实体、意图以及可选的LLM改写生成查询变体（原问题总在首位）"""
+    variants = [question]
+
+    # 1. 实体组合查询：去掉口语化成分，只保留关键词
+    entities = semantic_info.get("entities") or []
+    if entities:
+        variants.append(" ".join(entities))
+
+    # 2. 意图改写
+    template = INTENT_REWRITE_TEMPLATES.get(semantic_info.get("intent"))
+    if template:
+        variants.append(template.format(question=question))
+
+    # 3. LLM改写（可选，会增加一次接口调用）
+    if use_llm:
+        rewritten = rewrite_query(question, api_key)
+        if rewritten:
+            variants.append(rewritten)
+
+    # 去重并保持顺序
+    unique = []
+    for v in variants:
+        v = v.strip()
+        if v and v not in unique:
+            unique.append(v)
+    return unique[:max_variants]
+
 # 新增文件到知识库
 def add_file_to_knowledge_base(file):
-    """处理上传的文件，将其添加到知识库和向量存储中."""
-    # 1. 从文件内容生成唯一ID
-    file_content = file.getvalue()
-    file_id = generate_file_id(file_content)
+    """处理上传的文件，将其添加到知识库和向量存储中.
+
+    与已有文档近重复的文件在嵌入之前被拦下，按 NEAR_DUPLICATE_POLICY 处理或等待用户选择。
+    """
+    # 1. 从文件内容生成唯一ID（直接对上传缓冲区计算，不复制内容）
+    file_id = generate_file_id(file.getbuffer())
 
-    # 2. 检查文件是否已在当前会话中处理，防止重复
-    if any(f['id'] == file_id for f in st.session_state.uploaded_files):
+    # 2. 检查文件是否已在当前会话中处理，防止重复（包括等待确认与已跳过的近重复文件）
+    catalog = st.session_state.catalog
+    if file_id in catalog or file_id in st.session_state.pending_duplicates \
+            or file_id in st.session_state.skipped_uploads:
+        return
+    # 回收站中的同一文件直接恢复，向量仍在库中，无需重新嵌入；已被清理则按新文件入库
+    if catalog.is_deleted(file_id) and restore_file(file_id):
         return
 
-    # 3. 解析文件内容
-    content = parse_file(file)
-    if not content:
+    # 3. 解析文件内容，同时计算MinHash签名与词表（纯文本与Markdown流式扫描，不保留全文）
+    features = parse_features(file)
+    if features is None:
         st.warning(f"无法从文件 '{file.name}' 中提取文本内容，已跳过。")
         return
+    content, signature, terms = features
+
+    # 4. 近重复检测：MinHash签名经LSH查找相似的已入库文档（回收站中的文档不计）
+    matches = [(fid, sim) for fid, sim in find_near_duplicates(signature)
+               if fid in catalog and not catalog.is_deleted(fid)]
+    if matches:
+        st.session_state.pending_duplicates[file_id] = {
+            "file": file, "content": content, "signature": signature, "terms": terms, "matches": matches
+        }
+        if NEAR_DUPLICATE_POLICY != "ask":
+            resolve_duplicate(file_id, NEAR_DUPLICATE_POLICY)
+        return
+
+    _ingest_file(file, file_id, content, signature, terms)
+
+def resolve_duplicate(file_id, action):
+    """处理等待确认的近重复上传
+
+    action: skip 跳过该文件；replace 入库并把相似的旧版本移入回收站；keep 作为新文档入库。
+    后两种都只嵌入与旧版本不同的块，相同块直接复用旧向量。
+    """
+    pending = st.session_state.pending_duplicates.pop(file_id, None)
+    if pending is None:
+        return
+    file = pending["file"]
+    if action == "skip":
+        st.session_state.skipped_uploads.add(file_id)
+        st.toast(f"已跳过与已有文档重复的文件 '{file.name}'。")
+        return
 
-    # 4. 持久化保存文件并注册
-    save_uploaded_file(file, file_id)
+    catalog = st.session_state.catalog
+    old_ids = [fid for fid, _ in pending["matches"] if fid in catalog and not catalog.is_deleted(fid)]
+    reused = _ingest_file(file, file_id, pending["content"], pending["signature"], pending["terms"],
+                          reuse_from=old_ids)
+    if action == "replace":
+        for old_id in old_ids:
+            delete_file(old_id)
+    if reused is not None:
+        st.toast(f"文件 '{file.name}' 已入库：{reused[0]}个片段复用旧向量，{reused[1]}个片段重新嵌入。")
 
-    # 5. 将文件信息添加到会话状态以供UI显示
-    st.session_state.uploaded_files.append({
+def _ingest_file(file, file_id, content, signature, terms, reuse_from=()):
+    """保存、注册、分块并分批嵌入文件，返回 (复用向量的块数, 新嵌入的块数)；没有有效片段时返回None
+
+    content为None时（纯文本与Markdown）从文件流式分块；reuse_from 中旧文件的块与新文件文本完全相同时
+    直接复用其向量，只嵌入变化的块。
+    """
+    # 1. 持久化保存文件并注册（同时保存词表，用于问题中的实体链接）
+    save_uploaded_file(file, file_id, terms=terms)
+
+    # 2. 将文件信息添加到文档目录以供UI显示（不保存全文）
+    # 与注册表的timestamp同一格式（ISO），重新加载的条目与新上传的条目才能按上传时间正确排序
+    upload_time = datetime.now().isoformat(timespec="seconds")
+    st.session_state.catalog.add({
         "id": file_id,
         "name": file.name,
         "type": file.type,
-        "content": content,  # 注意：在会话中存储完整内容可能消耗大量内存
-        "upload_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "size": len(file.getbuffer()),
+        "upload_time": upload_time,
         "tags": ["新上传"]
     })
 
-    # 6. 对内容进行分块
-    chunks = st.session_state.text_splitter.split_text(content)
-    
-    # 过滤掉空块并准备元数据
-    filtered_data = [
-        (c, {
-            "source": file.name,
-            "source_id": file_id,
-            "type": file.type.split("/")[-1],
-            "upload_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }) for c in chunks if c and isinstance(c, str) and c.strip()
-    ]
-
-    if not filtered_data:
+    # 3. 分块并按批写入向量库，内存中只保留一批块（Markdown块的metadata带有标题路径）
+    metadata = {
+        "source": file.name,
+        "source_id": file_id,
+        "type": file.type.split("/")[-1],
+        "upload_time": upload_time
+    }
+    known = {}
+    for old_id in reuse_from:
+        known.update(db_op.source_chunks(old_id))
+
+    reused = embedded = 0
+    batch = []
+    try:
+        for chunk, extra in iter_chunks(file, content, get_text_splitter()):
+            # 过滤掉空块
+            if not chunk or not isinstance(chunk, str) or not chunk.strip():
+                continue
+            batch.append((chunk, {**metadata, **extra}))
+            if len(batch) >= INGEST_BATCH_CHUNKS:
+                counts = _store_batch(batch, known)
+                reused, embedded, batch = reused + counts[0], embedded + counts[1], []
+        if batch:
+            counts = _store_batch(batch, known)
+            reused, embedded = reused + counts[0], embedded + counts[1]
+    except Exception:
+        # 中途失败时删除已写入的批次：文件保持“已注册、无向量”，核对时会被完整地重新入库
+        db_op.delete_from_db_by_source_id(file_id)
+        raise
+
+    if not reused + embedded:
         st.warning(f"文件 '{file.name}' 未提取到有效文本片段，未存入知识库。")
-        return
-        
-    chunks, metadatas = zip(*filtered_data)
-    chunks, metadatas = list(chunks), list(metadatas)
+        return None
+
+    # 4. 保存MinHash签名，供之后的上传做近重复检测（没有签名时也记录，核对时不再重复计算）
+    register_signature(file_id, signature)
+    return reused, embedded
+
+def _store_batch(batch, known):
+    """写入一批块，返回 (复用向量的块数, 新嵌入的块数)；known为旧版本的 块文本 -> 向量"""
+    chunks = [chunk for chunk, _ in batch]
+    metadatas = [m for _, m in batch]
 
     # 确保所有元数据字段都是ChromaDB接受的类型
     for m in metadatas:
@@ -92,49 +209,32 @@ def add_file_to_knowledge_base(file):
             elif not isinstance(v, (str, int, float, bool)):
                 m[k] = str(v)
 
-    # 7. 将块和元数据添加到向量数据库
-    db_op.add_texts_to_db(texts=chunks, metadatas=metadatas)
-
-    # 8. 将块信息添加到会话状态知识库（用于UI显示）
-    for chunk in chunks:
-        st.session_state.knowledge_base.append({
-            "source": file.name,
-            "source_id": file_id,
-            "content": chunk,
-            "type": file.type.split("/")[-1]
-        })
+    if not known:
+        db_op.add_texts_to_db(texts=chunks, metadatas=metadatas)
+        return 0, len(chunks)
+    # 近重复文件只嵌入与旧版本不同的块
+    new_texts = [c for c in chunks if c not in known]
+    changed = list(dict.fromkeys(new_texts))
+    vectors = dict(zip(changed, db_op.get_embedding_function().embed_documents(changed))) if changed else {}
+    db_op.add_embedded_texts(chunks, metadatas, [known[c] if c in known else vectors[c] for c in chunks])
+    return len(chunks) - len(new_texts), len(new_texts)
 
 # 删除文件处理
 def delete_file(file_id):
-    """从所有地方（会话、持久化存储、向量数据库）删除文件."""
-    file_to_delete = next((f for f in st.session_state.uploaded_files if f['id'] == file_id), None)
-    if not file_to_delete:
+    """软删除文件：登记墓碑并移入回收站，物理文件与向量保留到回收站清理时."""
+    catalog = st.session_state.catalog
+    if file_id not in catalog:
         st.error("尝试删除一个不存在的文件。")
         return False
 
     try:
-        # 从注册表获取文件路径并删除物理文件
-        registry = FileRegistry.load()
-        file_info = registry.get(file_id)
-        if file_info and Path(file_info['filepath']).exists():
-            Path(file_info['filepath']).unlink()
-
-        # 从注册表移除记录
-        FileRegistry.remove_file(file_id)
+        # 注册表中记录删除时间（持久化），并加入检索墓碑集合
+        FileRegistry.mark_deleted(file_id)
+        db_op.tombstone_source(file_id)
 
-        # 从向量数据库删除
-        db_op.delete_from_db_by_source_id(file_id)
+        # 在文档目录中移动到回收站
+        file_to_delete = catalog.mark_deleted(file_id, datetime.now().isoformat(timespec="seconds"))
 
-        # 从会话状态更新
-        st.session_state.uploaded_files = [f for f in st.session_state.uploaded_files if f['id'] != file_id]
-        st.session_state.knowledge_base = [kb for kb in st.session_state.knowledge_base if kb['source_id'] != file_id]
-        
-        # 移动到回收站
-        st.session_state.deleted_files.append({
-            **file_to_delete,
-            'deleted_time': datetime.now().isoformat()
-        })
-        
         st.toast(f"文件 '{file_to_delete['name']}' 已移至回收站。")
         return True
     except Exception as e:
@@ -143,51 +243,45 @@ def delete_file(file_id):
 
 # 恢复已删除文件
 def restore_file(file_id):
-    # 从删除列表中恢复
-    file_to_restore = next((f for f in st.session_state.deleted_files if f['id'] == file_id), None)
-    if file_to_restore:
-        st.session_state.uploaded_files.append({
-            'id': file_to_restore['id'],
-            'name': file_to_restore['name'],
-            'type': file_to_restore['type'],
-            'content': file_to_restore['content'],
-            'upload_time': file_to_restore['upload_time'],
-            'tags': file_to_restore.get('tags', [])
-        })
-        # 从删除列表中移除
-        st.session_state.deleted_files = [f for f in st.session_state.deleted_files if f['id'] != file_id]
-        
-        # 重新分块并添加到知识库和向量数据库
-        content = file_to_restore['content']
-        chunks = st.session_state.text_splitter.split_text(content)
-        
-        metadatas = [{
-            "source": file_to_restore['name'],
-            "source_id": file_id,
-            "type": file_to_restore['type'].split("/")[-1],
-            "upload_time": file_to_restore['upload_time']
-        } for _ in chunks]
-        db_op.add_texts_to_db(texts=chunks, metadatas=metadatas)
+    """从回收站恢复：只清除墓碑标记，不重新分块或嵌入"""
+    catalog = st.session_state.catalog
+    if not catalog.is_deleted(file_id):
+        return False
+    if not FileRegistry.mark_restored(file_id):
+        if file_id in FileRegistry.load():
+            # 其他会话已恢复该文件（墓碑也已由其清除），只同步本会话的目录
+            catalog.restore(file_id)
+            return True
+        # 注册表中已没有该文件：回收站清理已物理删除文件与向量，不能再清除墓碑让它“复活”
+        entry = catalog.remove(file_id)
+        st.warning(f"文件 '{entry['name']}' 已从回收站清理，无法恢复。")
+        return False
+    db_op.revive_source(file_id)
+    catalog.restore(file_id)
+    return True
 
-        for chunk in chunks:
-            st.session_state.knowledge_base.append({
-                "source": file_to_restore['name'],
-                "source_id": file_id,
-                "content": chunk,
-                "type": file_to_restore['type'].split("/")[-1]
-            })
-        return True
-    return False
+# 回收站清理
+def purge_deleted_files(kb, retention_days=RECYCLE_BIN_RETENTION_DAYS):
+    """物理删除回收站中超过保留期的文件及其向量，返回清理的文件ID列表
+
+    可在后台线程中调用，因此不访问会话状态；retention_days=0 表示立即清空回收站。
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    purged = []
+    for file_id, file_info in FileRegistry.load(kb).items():
+        deleted_time = file_info.get("deleted_time")
+        if not deleted_time or datetime.fromisoformat(deleted_time) > cutoff:
+            continue
+        filepath = Path(file_info["filepath"])
+        if filepath.exists():
+            filepath.unlink()
+        db_op.delete_from_db_by_source_id(file_id, kb=kb)
+        FileRegistry.remove_file(file_id, kb)
+        purged.append(file_id)
+    if purged:
+        remove_signatures(purged, kb)
+    return purged
 
 # 标记文件功能
 def toggle_file_tag(file_id, tag):
-    for file in st.session_state.uploaded_files:
-        if file['id'] == file_id:
-            if 'tags' not in file:
-                file['tags'] = []
-            if tag in file['tags']:
-                file['tags'].remove(tag)
-            else:
-                file['tags'].append(tag)
-            return True
-    return False
\ No newline at end of file
+    return st.session_state.catalog.toggle_tag(file_id, tag)
\ No newline at end of file
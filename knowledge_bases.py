@@ -0,0 +1,90 @@
+#knowledge_bases
+import hashlib
+import re
+from pathlib import Path
+import streamlit as st
+from config import (
+    DEFAULT_KNOWLEDGE_BASE,
+    KNOWLEDGE_BASES_ROOT,
+    FILE_REGISTRY_DB,
+    PERSISTENT_UPLOAD_FOLDER,
+    COMPACT_INDEX_PATH,
+    MINHASH_INDEX_PATH,
+    COMPACT_DOC_COLLECTION
+)
+
+# 知识库名称：中英文、数字、下划线和连字符
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-\u4e00-\u9fff]{1,40}$")
+
+
+def check_kb_name(kb):
+    """校验知识库名称（拼接进路径前必须校验，防止“../”之类的名称访问知识库目录之外的文件），不合法时抛出ValueError"""
+    if not isinstance(kb, str) or not _NAME_PATTERN.match(kb):
+        raise ValueError(f"非法的知识库名称: {kb!r}")
+    return kb
+
+
+def _kb_dir(kb):
+    return Path(KNOWLEDGE_BASES_ROOT) / check_kb_name(kb)
+
+
+def list_knowledge_bases():
+    """列出所有知识库，默认知识库总在首位"""
+    root = Path(KNOWLEDGE_BASES_ROOT)
+    # 手工放入、名称不合法的目录不作为知识库（无法通过resolve_kb访问）
+    others = sorted(p.name for p in root.iterdir() if p.is_dir() and _NAME_PATTERN.match(p.name)) \
+        if root.exists() else []
+    return [DEFAULT_KNOWLEDGE_BASE] + [kb for kb in others if kb != DEFAULT_KNOWLEDGE_BASE]
+
+
+def create_knowledge_base(name):
+    """新建知识库目录，名称不合法或已存在时抛出ValueError"""
+    name = (name or "").strip()
+    if not _NAME_PATTERN.match(name):
+        raise ValueError("知识库名称只能包含中英文、数字、下划线和连字符，长度1-40")
+    if name in list_knowledge_bases():
+        raise ValueError(f"知识库 '{name}' 已存在")
+    (_kb_dir(name) / "uploads").mkdir(parents=True, exist_ok=True)
+    return name
+
+
+def get_current_kb():
+    """当前会话选中的知识库"""
+    return st.session_state.get("current_kb", DEFAULT_KNOWLEDGE_BASE)
+
+
+def resolve_kb(kb=None):
+    """kb为None时使用当前会话的知识库；名称不合法时抛出ValueError"""
+    return check_kb_name(kb or get_current_kb())
+
+
+def collection_name(kb, compact=False):
+    """知识库对应的Chroma集合名（集合名只允许ASCII，因此非默认库使用名称摘要）"""
+    if kb == DEFAULT_KNOWLEDGE_BASE:
+        return COMPACT_DOC_COLLECTION if compact else "langchain"
+    digest = hashlib.md5(kb.encode("utf-8")).hexdigest()[:12]
+    return f"kb_{digest}_compact" if compact else f"kb_{digest}"
+
+
+def registry_path(kb):
+    if kb == DEFAULT_KNOWLEDGE_BASE:
+        return Path(FILE_REGISTRY_DB)
+    return _kb_dir(kb) / "file_registry.json"
+
+
+def upload_folder(kb):
+    if kb == DEFAULT_KNOWLEDGE_BASE:
+        return Path(PERSISTENT_UPLOAD_FOLDER)
+    return _kb_dir(kb) / "uploads"
+
+
+def compact_index_path(kb):
+    if kb == DEFAULT_KNOWLEDGE_BASE:
+        return Path(COMPACT_INDEX_PATH)
+    return _kb_dir(kb) / "compact_index"
+
+
+def minhash_index_path(kb):
+    if kb == DEFAULT_KNOWLEDGE_BASE:
+        return Path(MINHASH_INDEX_PATH)
+    return _kb_dir(kb) / "minhash_index.jsonl"
@@ -1,16 +1,15 @@
 #main
 import streamlit as st
-import pandas as pd
 import os
 import time
-import signal
-import psutil
-import webbrowser
 from UI import knowledge_base_section, qa_interface
-from file_registry import FileRegistry
-from session_manager import init_session, clear_session
-from config import PERSISTENT_UPLOAD_FOLDER, API_KEY
+from session_manager import init_session, clear_session, switch_knowledge_base, refresh_catalog_if_stale
+from knowledge_bases import list_knowledge_bases, create_knowledge_base, get_current_kb
+from model_loader import models_ready
 from vector_store import get_vector_count
+from reconcile import last_report, summarize
+from ai_service import summarize_usage
+from conversation_store import count_messages
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 def nuclear_exit():
@@ -65,6 +64,7 @@ def nuclear_exit():
                 ctx._ws.close()
             
             # 杀死相关进程树
+            import psutil
             pid = os.getpid()
             parent = psutil.Process(pid)
             for child in parent.children(recursive=True):
@@ -81,24 +81,13 @@ def main():
         initial_sidebar_state="expanded"
     )
 
-    # 仅在会话首次加载时运行初始化，并显示加载动画
+    # 仅在会话首次加载时运行初始化
+    # init_session() 只做轻量操作，模型与向量库在后台线程中预热，不阻塞首屏渲染
     if "initialized" not in st.session_state:
-        progress_container = st.empty()
-        with progress_container.container():
-            st.subheader("🚀 系统初始化中...")
-            init_progress = st.progress(0, text="准备系统环境...")
-            
-            # init_session() 执行所有耗时的加载操作
-            init_session()
-            
-            init_progress.progress(50, text="AI模型加载完成...")
-            time.sleep(0.5)
-            init_progress.progress(100, text="准备就绪！")
-            time.sleep(0.5)
-        
-        progress_container.empty()
+        init_session()
         st.session_state.initialized = True
         # st.toast(f"当前 API Key: {API_KEY}") # 移除旧的toast提示
+    refresh_catalog_if_stale()
 
     st.title("📚 智能文献问答系统")
     st.caption("知识库构建、管理及智能问答平台 | 支持文档处理与语义分析")
@@ -108,6 +97,29 @@ def main():
         page = st.radio("选择功能", ["知识库管理", "智能问答"], horizontal=True)
         
         st.divider()
+
+        # 知识库选择
+        st.subheader("🗂️ 知识库")
+        knowledge_bases = list_knowledge_bases()
+        current_kb = get_current_kb()
+        selected_kb = st.selectbox(
+            "当前知识库",
+            knowledge_bases,
+            index=knowledge_bases.index(current_kb) if current_kb in knowledge_bases else 0
+        )
+        if selected_kb != current_kb:
+            switch_knowledge_base(selected_kb)
+            st.rerun()
+        with st.expander("➕ 新建知识库", expanded=False):
+            new_kb = st.text_input("知识库名称", key="new_kb_name")
+            if st.button("创建", use_container_width=True):
+                try:
+                    switch_knowledge_base(create_knowledge_base(new_kb))
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+
+        st.divider()
         
         # API密钥设置
         st.subheader("🔑 API密钥设置")
@@ -123,8 +135,11 @@ def main():
         st.divider()
         st.subheader("📊 系统概览")
         col1, col2 = st.columns(2)
-        col1.metric("知识文档", len(st.session_state.get("uploaded_files", [])))
-        col2.metric("回收站", len(st.session_state.get("deleted_files", [])))
+        catalog = st.session_state.catalog
+        col1.metric("知识文档", len(catalog))
+        col2.metric("回收站", catalog.deleted_count())
+        if not models_ready():
+            st.caption("⏳ AI模型后台加载中，首次问答可能稍慢")
         st.divider()
         st.info("""
         **系统功能：**
@@ -149,11 +164,15 @@ def main():
         qa_interface()
 
     with st.expander("🛠️ 调试信息", expanded=False):
+        report = last_report(get_current_kb())
         st.json({
-            "文件上传数": len(st.session_state.get("uploaded_files", [])),
-            "向量存储数": get_vector_count(),
-            "删除文件数": len(st.session_state.get("deleted_files", [])),
-            "对话轮次": len(st.session_state.get("conversation", [])) if isinstance(st.session_state.get("conversation"), list) else 0
+            "当前知识库": get_current_kb(),
+            "文件上传数": len(st.session_state.catalog),
+            "向量存储数": get_vector_count() if models_ready() else "加载中",
+            "删除文件数": st.session_state.catalog.deleted_count(),
+            "对话消息数": count_messages(st.session_state.conversation_id) if st.session_state.get("conversation_id") else 0,
+            "一致性核对": summarize(report) if report else "后台核对中",
+            "大模型用量": summarize_usage(st.session_state.get("llm_usage", []))
         })
 
 
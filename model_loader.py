@@ -0,0 +1,118 @@
+#model_loader
+import logging
+import threading
+import time
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from config import (
+    EMBEDDING_MODEL_SENTENCE_TRANSFORMER,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    EMBEDDING_BACKEND,
+    MODEL_WARMUP_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+# 后台预热状态（进程级，所有会话共享）
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+_models_ready = threading.Event()
+
+
+@st.cache_resource
+def _load_sentence_model():
+    if EMBEDDING_BACKEND == "stub":
+        # 压测/离线调试时使用确定性的替身模型
+        from embedding_backend import StubEmbeddings
+        return StubEmbeddings(dim=384)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_SENTENCE_TRANSFORMER)
+
+
+def get_embedding_model():
+    """获取语义分析用的嵌入模型，首次调用时加载；加载失败返回None"""
+    try:
+        return _load_sentence_model()
+    except Exception as e:
+        # 后台线程没有脚本上下文，无法在页面上提示，只记录日志
+        if get_script_run_ctx(suppress_warning=True) is None:
+            logger.warning("加载嵌入模型失败: %s", e)
+        else:
+            st.error(f"加载嵌入模型失败: {str(e)}")
+        return None
+
+
+@st.cache_resource
+def get_text_splitter():
+    """获取文本分割器"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len
+    )
+
+
+def _run_warmup(tasks):
+    # 稍作等待再开始，避免与首屏渲染争抢GIL
+    time.sleep(MODEL_WARMUP_DELAY)
+    try:
+        for task in tasks:
+            try:
+                task()
+            except Exception as e:
+                # 预热失败不影响页面，首次使用时会再次尝试加载并提示错误
+                logger.exception("后台预热任务失败: %s", e)
+    finally:
+        _models_ready.set()
+
+
+def start_warmup(tasks):
+    """在后台线程中依次执行预热任务（每个进程只启动一次）"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_run_warmup, args=(list(tasks),), name="model-warmup", daemon=True)
+            _warmup_thread.start()
+
+
+_background_tasks = {}
+
+
+def run_in_background(name, task):
+    """在后台线程中执行一次性任务，同名任务仍在运行时不会重复启动"""
+    with _warmup_lock:
+        running = _background_tasks.get(name)
+        if running is not None and running.is_alive():
+            return
+        thread = threading.Thread(target=_run_task, args=(task,), name=name, daemon=True)
+        _background_tasks[name] = thread
+        thread.start()
+
+
+def _run_task(task):
+    try:
+        task()
+    except Exception as e:
+        logger.exception("后台任务失败: %s", e)
+
+
+def run_periodically(name, interval_s, task):
+    """启动一个按固定间隔重复执行任务的后台线程（每个进程同名任务只启动一次）"""
+    def loop():
+        while True:
+            time.sleep(interval_s)
+            _run_task(task)
+
+    with _warmup_lock:
+        if name in _background_tasks:
+            return
+        thread = threading.Thread(target=loop, name=name, daemon=True)
+        _background_tasks[name] = thread
+        thread.start()
+
+
+def models_ready():
+    """后台预热是否已完成"""
+    return _models_ready.is_set()
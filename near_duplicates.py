@@ -0,0 +1,343 @@
+#near_duplicates
+"""近重复文档检测（MinHash + LSH）
+
+每个文件由正文的字符shingle集合计算MinHash签名，签名按知识库保存在注册表旁的追加式日志（JSON Lines）中，
+每次上传只追加一行，过期记录过多时整体压缩；各进程按日志ID与长度增量重放，能看到其他进程的写入。
+追加与压缩都持有日志旁 .lock 文件上的操作系统文件锁，并在锁内先重放到文件末尾，
+因此多个进程同时写入时，压缩不会丢掉其他进程刚追加的记录。
+LSH把签名切成若干段分桶，只有至少一段完全相同的文档才会进入候选，再用签名估计Jaccard相似度。
+共享索引服务模式下索引由索引进程持有，应用副本通过它读写。
+"""
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from knowledge_bases import resolve_kb, minhash_index_path
+from contention import get_lock
+from config import (
+    MINHASH_PERMUTATIONS,
+    MINHASH_BANDS,
+    MINHASH_SHINGLE_SIZE,
+    MINHASH_LOG_COMPACT_MIN,
+    NEAR_DUPLICATE_THRESHOLD,
+    INDEX_SERVICE_URL
+)
+
+_BLOCK = 20000  # 每次与全部哈希函数相乘的shingle数，控制临时矩阵大小
+_rng = np.random.default_rng(20240611)
+# multiply-shift 哈希族：(h ^ b) * a 取高32位，a为奇数
+_A = _rng.integers(1, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 进程内线程由_index_lock串行；跨进程由_file_lock串行
+_index_lock = get_lock("minhash")
+_cache_lock = threading.Lock()
+_indexes = {}
+
+
+def _remote(op, **kwargs):
+    from index_client import get_index_client
+    return get_index_client().call(f"dedup.{op}", **kwargs)
+
+
+def _normalize(text):
+    return " ".join((text or "").lower().split())
+
+
+def _shingle_hashes(normalized, size=MINHASH_SHINGLE_SIZE):
+    """规范化文本中所有长度为size的字符shingle的64位滚动哈希（去重）"""
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < size:
+        return np.empty(0, dtype=np.uint64)
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for j in range(size):
+        # uint64运算按2^64取模自然回绕
+        hashes = hashes * np.uint64(1000003) + codes[j:j + count]
+    return np.unique(hashes)
+
+
+class MinHasher:
+    """增量计算MinHash签名：文本可以分块传入（流式读取的大文件），结果与一次传入整段文本相同"""
+
+    def __init__(self):
+        self._signature = np.full(MINHASH_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint64)
+        self._tail = ""      # 上一块末尾不足一个shingle的字符，与下一块拼接
+        self._space = False  # 上一块以空白结尾
+        self._empty = True
+
+    def update(self, text):
+        normalized = _normalize(text)
+        if not normalized:
+            self._space = self._space or bool(text)
+            return self
+        # 块边界处的空白与整段规范化保持一致：两侧任一有空白时只保留一个空格
+        if self._tail and (self._space or text[:1].isspace()):
+            normalized = " " + normalized
+        normalized = self._tail + normalized
+        self._space = text[-1:].isspace()
+        hashes = _shingle_hashes(normalized)
+        if len(hashes):
+            self._empty = False
+            with np.errstate(over="ignore"):
+                for i in range(0, len(hashes), _BLOCK):
+                    block = hashes[i:i + _BLOCK]
+                    mixed = ((block[None, :] ^ _B[:, None]) * _A[:, None]) >> np.uint64(32)
+                    self._signature = np.minimum(self._signature, mixed.min(axis=1))
+        self._tail = normalized[-(MINHASH_SHINGLE_SIZE - 1):]
+        return self
+
+    def signature(self):
+        """MinHash签名（uint32数组），文本过短时返回None"""
+        return None if self._empty else self._signature.astype(np.uint32)
+
+
+def minhash_signature(text):
+    """文本的MinHash签名（uint32数组），文本过短时返回None"""
+    return MinHasher().update(text).signature()
+
+
+def estimate_similarity(a, b):
+    """两个签名估计的Jaccard相似度"""
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+class MinHashLSH:
+    """签名的LSH分桶索引"""
+
+    def __init__(self, signatures=None, bands=MINHASH_BANDS):
+        self.bands = bands
+        self.rows = MINHASH_PERMUTATIONS // bands
+        self.signatures = {}
+        self.unsigned = set()  # 已处理但没有签名的文件（文本过短或无法解析）
+        self.log_lines = 0     # 从签名日志重放的记录数，用于判断何时压缩
+        self._buckets = [{} for _ in range(bands)]
+        for file_id, signature in (signatures or {}).items():
+            self.add(file_id, signature)
+
+    def _keys(self, signature):
+        signature = np.asarray(signature, dtype=np.uint32)
+        return [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def add(self, file_id, signature):
+        self.remove(file_id)
+        self.signatures[file_id] = np.asarray(signature, dtype=np.uint32)
+        for bucket, key in zip(self._buckets, self._keys(signature)):
+            bucket.setdefault(key, set()).add(file_id)
+
+    def remove(self, file_id):
+        self.unsigned.discard(file_id)
+        signature = self.signatures.pop(file_id, None)
+        if signature is None:
+            return
+        for bucket, key in zip(self._buckets, self._keys(signature)):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.discard(file_id)
+                if not ids:
+                    del bucket[key]
+
+    def query(self, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+        """返回 [(file_id, 估计相似度)]，按相似度降序"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._keys(signature)):
+            candidates |= bucket.get(key, set())
+        scored = [(fid, estimate_similarity(signature, self.signatures[fid])) for fid in candidates]
+        return sorted([(fid, sim) for fid, sim in scored if sim >= threshold], key=lambda item: -item[1])
+
+
+def _read_entries(f, lsh):
+    """从文件当前位置重放日志，返回读到的完整行末尾位置（写到一半的最后一行留到下次再读）"""
+    offset = f.tell()
+    for line in f:
+        if not line.endswith(b"\n"):
+            break
+        offset += len(line)
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "remove" in entry:
+            for file_id in entry["remove"]:
+                lsh.remove(file_id)
+        elif "add" in entry:
+            lsh.remove(entry["add"])
+            if entry.get("signature") is None:
+                lsh.unsigned.add(entry["add"])
+            else:
+                lsh.add(entry["add"], entry["signature"])
+        lsh.log_lines += 1
+    return offset
+
+
+def _header():
+    """日志首行：签名参数，以及每次新建或压缩时生成的日志ID"""
+    return json.dumps({"permutations": MINHASH_PERMUTATIONS, "shingle": MINHASH_SHINGLE_SIZE,
+                       "log": uuid.uuid4().hex}) + "\n"
+
+
+class _CachedIndex:
+    """进程内缓存的LSH索引，记下已重放到的日志位置（日志ID与偏移）"""
+
+    def __init__(self):
+        self.lsh = MinHashLSH()
+        self.log_id = None
+        self.offset = 0
+
+
+def _refresh(kb, cached):
+    """把缓存与日志文件同步：日志被压缩替换（日志ID变化）或参数不一致时整体重读，否则只重放新追加的行
+
+    用首行的日志ID而不是inode判断文件是否被替换：被替换的旧文件删除后，其inode可能立刻分配给新文件。
+    """
+    path = minhash_index_path(kb)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        cached.lsh, cached.log_id, cached.offset = MinHashLSH(), None, 0
+        return cached
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError:
+            header = {}
+        # 本功能之前写入的日志没有ID，压缩前暂以inode代替
+        log_id = header.get("log") or f"inode:{os.fstat(f.fileno()).st_ino}"
+        if log_id == cached.log_id and size >= cached.offset:
+            if size == cached.offset:
+                return cached
+            f.seek(cached.offset)
+        else:
+            cached.lsh, cached.log_id = MinHashLSH(), log_id
+            if (header.get("permutations"), header.get("shingle")) != (MINHASH_PERMUTATIONS, MINHASH_SHINGLE_SIZE):
+                # 签名参数变化后旧签名不可比较，当作空索引（核对时会重新计算）
+                cached.offset = size
+                return cached
+        cached.offset = _read_entries(f, cached.lsh)
+    return cached
+
+
+@contextmanager
+def _file_lock(kb):
+    """日志的跨进程排他锁；锁加在旁边的 .lock 文件上，因为压缩会用新文件替换日志本身"""
+    path = minhash_index_path(kb)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # 约10秒后仍未获得会抛出OSError
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _append(kb, entries):
+    """向签名日志追加记录（每条一行，一次写入），垃圾行过多时压缩"""
+    path = minhash_index_path(kb)
+    data = "".join(json.dumps(entry) + "\n" for entry in entries)
+    with _file_lock(kb):
+        if not path.exists() or path.stat().st_size == 0:
+            data = _header() + data
+        with open(path, "ab") as f:
+            f.write(data.encode("utf-8"))
+        # 锁内重放到文件末尾，压缩时的快照包含其他进程此前追加的全部记录
+        cached = _refresh(kb, _get_cached(kb))
+        live = len(cached.lsh.signatures) + len(cached.lsh.unsigned)
+        if cached.lsh.log_lines > 2 * live + MINHASH_LOG_COMPACT_MIN:
+            _compact(kb, cached)
+
+
+def _compact(kb, cached):
+    """只保留每个文件的最新记录，写入临时文件后整体替换（调用方持有文件锁）"""
+    path = minhash_index_path(kb)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    header = _header()
+    lines = [header]
+    lines += [json.dumps({"add": fid, "signature": sig.tolist()}) + "\n" for fid, sig in cached.lsh.signatures.items()]
+    lines += [json.dumps({"add": fid, "signature": None}) + "\n" for fid in cached.lsh.unsigned]
+    tmp.write_text("".join(lines), encoding="utf-8")
+    tmp.replace(path)
+    cached.lsh.log_lines = len(lines) - 1
+    cached.log_id, cached.offset = json.loads(header)["log"], path.stat().st_size
+
+
+def _get_cached(kb):
+    with _cache_lock:
+        if kb not in _indexes:
+            _indexes[kb] = _CachedIndex()
+        return _indexes[kb]
+
+
+def _get_index(kb):
+    return _refresh(kb, _get_cached(kb)).lsh
+
+
+def register_signature(file_id, signature, kb=None):
+    """保存文件签名；signature为None（文本过短或无法解析）时记为“无签名”，核对时不再重复计算"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        return _remote("register", file_id=file_id,
+                       signature=None if signature is None else [int(v) for v in signature], kb=kb)
+    with _index_lock:
+        _append(kb, [{"add": file_id, "signature": None if signature is None else [int(v) for v in signature]}])
+
+
+def remove_signatures(file_ids, kb=None):
+    """删除文件签名（文件被物理删除时调用）"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        return _remote("remove", file_ids=list(file_ids), kb=kb)
+    with _index_lock:
+        _append(kb, [{"remove": list(file_ids)}])
+
+
+def signature_ids(kb=None):
+    """已记录签名的文件ID（包括记为“无签名”的文件）"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        return set(_remote("ids", kb=kb))
+    with _index_lock:
+        lsh = _get_index(kb)
+        return set(lsh.signatures) | lsh.unsigned
+
+
+def find_near_duplicates(signature, kb=None, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """查找与签名近重复的已入库文件，返回 [(file_id, 估计相似度)]（包括回收站中的文件，由调用方过滤）"""
+    kb = resolve_kb(kb)
+    if signature is None:
+        return []
+    if INDEX_SERVICE_URL:
+        return [tuple(m) for m in _remote("query", signature=[int(v) for v in signature], kb=kb, threshold=threshold)]
+    with _index_lock:
+        return _get_index(kb).query(signature, threshold)
+
+
+def clear_signatures(kb=None):
+    """清空知识库的签名索引（共享索引服务不提供远程清空）"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        raise RuntimeError("共享索引服务模式下不能远程清空签名索引")
+    with _index_lock, _file_lock(kb):
+        minhash_index_path(kb).unlink(missing_ok=True)
+        _refresh(kb, _get_cached(kb))
@@ -0,0 +1,191 @@
+#ooxml_parser
+# 基于 zipfile + ElementTree.iterparse 的DOCX/PPTX流式文本提取：
+# 逐个XML部件增量解析，按段落/幻灯片产出文本，处理完的元素立即释放，不构建完整对象模型。
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+NOTES_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide"
+
+# 备注页中不属于讲者备注正文的占位符
+_NOTES_SKIP_PLACEHOLDERS = {"sldImg", "sldNum", "hdr", "ftr", "dt"}
+
+
+class _TableStack:
+    """跟踪（可能嵌套的）表格：单元格内段落以空格连接，行内单元格以制表符连接"""
+
+    def __init__(self):
+        self._tables = []
+
+    def __bool__(self):
+        return bool(self._tables)
+
+    def push(self):
+        self._tables.append({"cells": [], "cell": []})
+
+    def pop(self):
+        self._tables.pop()
+
+    def add_text(self, text):
+        if text:
+            self._tables[-1]["cell"].append(text)
+
+    def end_cell(self):
+        table = self._tables[-1]
+        table["cells"].append(" ".join(table["cell"]))
+        table["cell"] = []
+
+    def end_row(self):
+        """结束一行；顶层表格返回行文本，嵌套表格的行并入外层单元格"""
+        table = self._tables[-1]
+        row = "\t".join(table["cells"]).strip()
+        table["cells"] = []
+        if len(self._tables) == 1:
+            return row
+        if row:
+            self._tables[-2]["cell"].append(row)
+        return None
+
+
+def _iter_wordprocessing(fp):
+    """逐段产出WordprocessingML正文文本，表格按行产出"""
+    parts = []
+    tables = _TableStack()
+    body = None
+    for event, elem in iterparse(fp, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == W + "body":
+                body = elem
+            elif tag == W + "tbl":
+                tables.push()
+            continue
+
+        if tag == W + "t":
+            parts.append(elem.text or "")
+        elif tag == W + "tab":
+            parts.append("\t")
+        elif tag in (W + "br", W + "cr"):
+            parts.append("\n")
+        elif tag == W + "p":
+            text = "".join(parts)
+            parts = []
+            if tables:
+                tables.add_text(text.strip())
+            else:
+                yield text
+        elif tag == W + "tc":
+            tables.end_cell()
+        elif tag == W + "tr":
+            row = tables.end_row()
+            if row:
+                yield row
+        elif tag == W + "tbl":
+            tables.pop()
+
+        # 顶层块处理完毕后释放已解析的子树
+        if body is not None and not tables and tag in (W + "p", W + "tbl", W + "sectPr"):
+            body.clear()
+
+
+def iter_docx_paragraphs(source):
+    """逐段产出DOCX正文文本（含表格），source为路径或二进制文件对象"""
+    with zipfile.ZipFile(source) as zf, zf.open("word/document.xml") as fp:
+        yield from _iter_wordprocessing(fp)
+
+
+def _read_rels(zf, part_name):
+    """读取部件的关系文件，返回 {rId: (Type, 目标部件路径)}"""
+    rels_name = posixpath.join(posixpath.dirname(part_name), "_rels", posixpath.basename(part_name) + ".rels")
+    if rels_name not in zf.namelist():
+        return {}
+    rels = {}
+    with zf.open(rels_name) as fp:
+        for _, elem in iterparse(fp):
+            if elem.tag == PKG_REL + "Relationship" and elem.get("TargetMode") != "External":
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(part_name), elem.get("Target")))
+                rels[elem.get("Id")] = (elem.get("Type"), target)
+    return rels
+
+
+def _slide_parts(zf):
+    """按演示文稿中的放映顺序返回幻灯片部件路径"""
+    presentation = "ppt/presentation.xml"
+    rels = _read_rels(zf, presentation)
+    order = []
+    with zf.open(presentation) as fp:
+        for _, elem in iterparse(fp):
+            if elem.tag == P + "sldId":
+                rel = rels.get(elem.get(R + "id"))
+                if rel:
+                    order.append(rel[1])
+    return order
+
+
+def _iter_drawing_paragraphs(fp, skip_placeholders=()):
+    """逐段产出DrawingML文本（幻灯片形状、表格、备注页）"""
+    parts = []
+    tables = _TableStack()
+    skip_shape = False
+    for event, elem in iterparse(fp, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == A + "tbl":
+                tables.push()
+            continue
+
+        if tag == P + "ph" and elem.get("type") in skip_placeholders:
+            skip_shape = True
+        elif tag == A + "t":
+            parts.append(elem.text or "")
+        elif tag == A + "br":
+            parts.append("\n")
+        elif tag == A + "p":
+            text = "".join(parts)
+            parts = []
+            if skip_shape:
+                pass
+            elif tables:
+                tables.add_text(text.strip())
+            elif text.strip():
+                yield text
+        elif tag == A + "tc":
+            tables.end_cell()
+        elif tag == A + "tr":
+            row = tables.end_row()
+            if row:
+                yield row
+        elif tag == A + "tbl":
+            tables.pop()
+        elif tag == P + "sp":
+            skip_shape = False
+            elem.clear()
+        elif tag == P + "graphicFrame":
+            elem.clear()
+
+
+def iter_pptx_slides(source, include_notes=True):
+    """逐张幻灯片产出文本（含表格与讲者备注），source为路径或二进制文件对象"""
+    with zipfile.ZipFile(source) as zf:
+        for slide_part in _slide_parts(zf):
+            with zf.open(slide_part) as fp:
+                lines = list(_iter_drawing_paragraphs(fp))
+
+            if include_notes:
+                notes_part = next(
+                    (target for rel_type, target in _read_rels(zf, slide_part).values() if rel_type == NOTES_REL_TYPE),
+                    None
+                )
+                if notes_part:
+                    with zf.open(notes_part) as fp:
+                        notes = list(_iter_drawing_paragraphs(fp, _NOTES_SKIP_PLACEHOLDERS))
+                    if notes:
+                        lines.append("备注：" + "\n".join(notes))
+
+            yield "\n".join(lines)
@@ -0,0 +1,257 @@
+#reconcile
+"""注册表、上传目录与向量库之间的一致性核对
+
+用法: python reconcile.py [--kb default] [--repair]
+
+一次元数据扫描取出向量库中的全部source_id，与注册表和上传目录对比，得到：
+  missing_vectors  已注册、文件存在但没有向量的文件（需要入库）
+  orphan_vectors   向量库中有块、注册表里却没有的source_id（需要删除）
+  stale_paths      注册表路径失效，但上传目录中找到了同ID文件（需要改写路径）
+  missing_uploads  注册表路径失效且上传目录中也找不到的文件（只报告）
+  untracked_files  上传目录中未被注册的文件（只报告）
+  missing_terms    尚未提取词表的文件（本功能之前入库的旧文件，需要补齐）
+  missing_signatures 尚未计算近重复检测签名的文件（需要补齐；无法计算签名的文件会被记录，不再列出）
+会话启动与切换知识库时在后台核对并修复，最近一次报告显示在调试信息中。
+共享索引服务模式下核对与修复都在索引进程内串行执行（“检查是否已有向量-再入库”不会被多个副本同时进行），
+应用副本只取回报告。
+"""
+import argparse
+import json
+import threading
+from datetime import datetime
+from pathlib import Path, PureWindowsPath
+
+import vector_store as db_op
+from file_registry import FileRegistry
+from file_parser import parse_features, iter_chunks
+from knowledge_bases import upload_folder
+from near_duplicates import register_signature, signature_ids
+from contention import get_lock
+from config import DEFAULT_KNOWLEDGE_BASE, INGEST_BATCH_CHUNKS, INDEX_SERVICE_URL
+
+# 核对到修复之间是“先检查再修改”，同一进程内的多次核对必须串行，否则同一文件会被重复入库
+_reconcile_lock = get_lock("reconcile")
+_report_lock = threading.Lock()
+_last_reports = {}
+_catalog_generations = {}  # kb -> 修复改写了注册表路径的次数，会话据此判断文档目录是否需要重建
+
+
+def _upload_files(kb):
+    """上传目录中的文件，按文件名与文件ID前缀（保存时命名为 {file_id}_{文件名}）索引"""
+    by_name, by_id = {}, {}
+    folder = upload_folder(kb)
+    if folder.exists():
+        for path in folder.iterdir():
+            if path.is_file():
+                by_name[path.name] = path
+                by_id.setdefault(path.name.split("_", 1)[0], path)
+    return by_name, by_id
+
+
+def _locate(file_id, file_info, by_name, by_id):
+    """注册表路径有效时返回它；失效时按文件名或ID前缀在上传目录中查找，找不到返回None"""
+    filepath = Path(file_info["filepath"])
+    if filepath.exists():
+        return filepath
+    # 注册表可能来自其他机器（如Windows路径），PureWindowsPath对两种分隔符都能取出文件名
+    return by_name.get(PureWindowsPath(file_info["filepath"]).name) or by_id.get(file_id)
+
+
+def reconcile(kb=DEFAULT_KNOWLEDGE_BASE):
+    """核对知识库并返回报告（不做任何修改）"""
+    # 先扫描向量再读注册表：入库流程先注册后写向量，这样新上传的文件不会被误判为孤立向量
+    counts = db_op.source_counts(kb)
+    signed = signature_ids(kb)
+    registry = FileRegistry.load(kb)
+    by_name, by_id = _upload_files(kb)
+
+    missing_vectors, missing_uploads, missing_terms, missing_signatures, stale_paths = [], [], [], [], {}
+    tracked = set()
+    for file_id, file_info in registry.items():
+        path = _locate(file_id, file_info, by_name, by_id)
+        if path is None:
+            missing_uploads.append(file_id)
+            continue
+        tracked.add(path.name)
+        if path != Path(file_info["filepath"]):
+            stale_paths[file_id] = str(path.absolute())
+        # 回收站中的文件不补齐，等待清理
+        if "deleted_time" in file_info:
+            continue
+        if file_id not in counts:
+            missing_vectors.append(file_id)
+            continue
+        if "terms" not in file_info:
+            missing_terms.append(file_id)
+        if file_id not in signed:
+            missing_signatures.append(file_id)
+
+    return {
+        "kb": kb,
+        "checked_at": datetime.now().isoformat(),
+        "registered": len(registry),
+        "vector_sources": len(counts),
+        "vector_chunks": sum(counts.values()),
+        "missing_vectors": missing_vectors,
+        "orphan_vectors": {sid: n for sid, n in counts.items() if sid not in registry},
+        "stale_paths": stale_paths,
+        "missing_uploads": missing_uploads,
+        "untracked_files": sorted(name for name in by_name if name not in tracked),
+        "missing_terms": missing_terms,
+        "missing_signatures": missing_signatures,
+    }
+
+
+def _open(file_info):
+    filepath = Path(file_info["filepath"])
+    return open(filepath, "rb") if filepath.exists() else None
+
+
+def index_files(file_ids, kb):
+    """解析、分块并分批写入指定文件（路径以注册表为准），同时提取词表并保存近重复检测签名"""
+    from model_loader import get_text_splitter
+    splitter = get_text_splitter()
+    registry = FileRegistry.load(kb)
+    indexed, terms = [], {}
+    for file_id in file_ids:
+        file_info = registry.get(file_id)
+        if not file_info or "deleted_time" in file_info:
+            continue
+        # 核对与修复之间可能有会话刚好完成入库，入库前逐个复查，只针对待修复的少数文件
+        if db_op.has_source(file_id, kb):
+            continue
+
+        f = _open(file_info)
+        if f is None:
+            continue
+        with f:
+            features = parse_features(f, original_filename=file_info["filename"])
+            if features is None:
+                continue
+            content, signature, terms[file_id] = features
+            register_signature(file_id, signature, kb)
+            metadata = {
+                "source": file_info["filename"],
+                "source_id": file_id,
+                "type": file_info["filename"].split(".")[-1],
+                "upload_time": file_info["timestamp"]
+            }
+            batch = []
+            try:
+                for chunk, extra in iter_chunks(f, content, splitter, original_filename=file_info["filename"]):
+                    if chunk.strip():
+                        batch.append((chunk, {**metadata, **extra}))
+                    if len(batch) >= INGEST_BATCH_CHUNKS:
+                        db_op.add_texts_to_db(texts=[c for c, _ in batch], metadatas=[m for _, m in batch], kb=kb)
+                        batch = []
+                if batch:
+                    db_op.add_texts_to_db(texts=[c for c, _ in batch], metadatas=[m for _, m in batch], kb=kb)
+            except Exception:
+                # 部分批次已写入时整体回滚，否则下次核对会把残缺的文件当作已入库
+                db_op.delete_from_db_by_source_id(file_id, kb)
+                raise
+        indexed.append(file_id)
+    if terms:
+        FileRegistry.set_terms(terms, kb)
+    return indexed
+
+
+def backfill_features(file_ids, kb):
+    """为旧文件补齐词表与近重复检测签名（每个文件只解析一次，不重新嵌入），返回 (补齐词表数, 补齐签名数)"""
+    registry = FileRegistry.load(kb)
+    signed = signature_ids(kb)
+    terms, signatures = {}, 0
+    for file_id in file_ids:
+        file_info = registry.get(file_id)
+        if not file_info or ("terms" in file_info and file_id in signed):
+            continue
+        f = _open(file_info)
+        if f is None:
+            continue  # 文件暂时找不到（见missing_uploads），恢复后再补齐
+        with f:
+            features = parse_features(f, original_filename=file_info["filename"])
+        _, signature, file_terms = features or (None, None, [])
+        if "terms" not in file_info:
+            terms[file_id] = file_terms
+        if file_id not in signed:
+            # 文本过短或无法解析时记为“无签名”，之后的核对不再把它列为缺失、反复解析
+            register_signature(file_id, signature, kb)
+            signatures += signature is not None
+    return (FileRegistry.set_terms(terms, kb) if terms else 0), signatures
+
+
+def repair(report):
+    """按报告修复：改写失效路径、删除孤立向量、补齐缺失向量，返回各项实际处理数"""
+    kb = report["kb"]
+    relocated = FileRegistry.relocate(report["stale_paths"], kb) if report["stale_paths"] else 0
+    if relocated:
+        # 修复在后台线程中进行，不能直接改会话状态；标记目录过期，各会话下次运行时重建
+        with _report_lock:
+            _catalog_generations[kb] = _catalog_generations.get(kb, 0) + 1
+
+    orphans = []
+    if report["orphan_vectors"]:
+        # 删除前复查注册表，跳过核对之后才注册的文件
+        registry = FileRegistry.load(kb)
+        orphans = [sid for sid in report["orphan_vectors"] if sid not in registry]
+        db_op.delete_sources(orphans, kb)
+
+    indexed = index_files(report["missing_vectors"], kb) if report["missing_vectors"] else []
+    backfill = list(dict.fromkeys(report["missing_terms"] + report["missing_signatures"]))
+    terms, signatures = backfill_features(backfill, kb) if backfill else (0, 0)
+    return {"relocated": relocated, "orphans_deleted": len(orphans), "indexed": len(indexed),
+            "terms_backfilled": terms, "signatures_backfilled": signatures}
+
+
+def reconcile_knowledge_base(kb=DEFAULT_KNOWLEDGE_BASE, fix=True):
+    """核对（并默认修复）知识库，报告保存为最近一次结果供调试面板读取"""
+    if INDEX_SERVICE_URL:
+        from index_client import get_index_client
+        report = get_index_client().call("reconcile_knowledge_base", kb=kb, fix=fix)
+        if report.get("repaired", {}).get("relocated"):
+            with _report_lock:
+                _catalog_generations[kb] = _catalog_generations.get(kb, 0) + 1
+    else:
+        with _reconcile_lock:
+            report = reconcile(kb)
+            if fix:
+                report["repaired"] = repair(report)
+    with _report_lock:
+        _last_reports[kb] = report
+    return report
+
+
+def last_report(kb):
+    """最近一次核对报告，尚未核对时返回None"""
+    with _report_lock:
+        return _last_reports.get(kb)
+
+
+def catalog_generation(kb):
+    """知识库文档目录的版本号：修复改写了文件路径后递增"""
+    with _report_lock:
+        return _catalog_generations.get(kb, 0)
+
+
+def summarize(report):
+    """报告摘要（各类问题的数量），用于界面展示"""
+    summary = {key: report[key] for key in ("checked_at", "registered", "vector_sources", "vector_chunks")}
+    for key in ("missing_vectors", "orphan_vectors", "stale_paths", "missing_uploads", "untracked_files",
+                "missing_terms", "missing_signatures"):
+        summary[key] = len(report[key])
+    if "repaired" in report:
+        summary["repaired"] = report["repaired"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="核对注册表、上传目录与向量库")
+    parser.add_argument("--kb", default=DEFAULT_KNOWLEDGE_BASE)
+    parser.add_argument("--repair", action="store_true", help="核对后执行修复")
+    args = parser.parse_args()
+    report = reconcile_knowledge_base(args.kb, fix=args.repair)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,122 +1,141 @@
 #session_manager
+import re
+import uuid
 import streamlit as st
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-from vector_store import get_vector_db, clear_db, load_existing_documents
+from vector_store import get_vector_count, get_embedding_function, clear_db
+from model_loader import get_embedding_model, get_text_splitter, start_warmup, run_in_background, run_periodically
+from knowledge_base_manager import purge_deleted_files
+from knowledge_bases import get_current_kb, upload_folder, list_knowledge_bases
 from config import (
-    CHUNK_SIZE, 
-    CHUNK_OVERLAP, 
-    EMBEDDING_MODEL_SENTENCE_TRANSFORMER,
-    PERSISTENT_UPLOAD_FOLDER,
-    API_KEY
+    DEFAULT_KNOWLEDGE_BASE,
+    API_KEY,
+    INDEX_SERVICE_URL,
+    RECYCLE_BIN_PURGE_INTERVAL_S
 )
-from file_parser import parse_file, generate_file_id
 from file_registry import FileRegistry
+from reconcile import reconcile_knowledge_base, catalog_generation
+from intent_classifier import get_intent_classifier
+from document_catalog import DocumentCatalog
+from near_duplicates import clear_signatures
+from conversation_store import conversation_exists
 from pathlib import Path
-import os
+
+def _load_file_list(kb):
+    """从知识库的注册表构建文档目录（不解析内容）"""
+    upload_folder(kb).mkdir(parents=True, exist_ok=True)
+    generation = catalog_generation(kb)  # 在读注册表之前取，之后的修复一定会触发下一次重建
+    registry = FileRegistry.load(kb)
+    entries = []
+    for file_id, file_info in registry.items():
+        filepath = Path(file_info["filepath"])
+        # 注册表记录了大小时直接使用，不逐个stat；旧注册表没有大小时才检查文件并回退到stat
+        if "size" in file_info:
+            size = file_info["size"]
+        elif filepath.exists():
+            size = filepath.stat().st_size
+        else:
+            continue
+        entries.append({
+            "id": file_id,
+            "name": file_info["filename"],
+            "type": file_info["filename"].split(".")[-1],
+            "local_path": str(filepath),
+            "upload_time": file_info["timestamp"],
+            "tags": ["持久化"],
+            "size": size,
+            # 软删除的文件进入回收站，回收站因此在重启后依然保留
+            "deleted_time": file_info.get("deleted_time")
+        })
+    st.session_state.catalog = DocumentCatalog(entries)
+    st.session_state.loaded_kb = kb
+    st.session_state.catalog_generation = generation
+
+def refresh_catalog_if_stale():
+    """后台修复改写了文件路径时重建文档目录（每次运行调用，只比较版本号）"""
+    kb = get_current_kb()
+    if st.session_state.get("catalog_generation") != catalog_generation(kb):
+        _load_file_list(kb)
 
 def init_session():
-    """初始化所有会话状态变量"""
-    # 确保上传目录存在
-    os.makedirs(PERSISTENT_UPLOAD_FOLDER, exist_ok=True)
-    
+    """初始化所有会话状态变量
+
+    这里只做轻量操作：模型、向量库和缺失文件的入库都交给后台预热线程，
+    首次使用时若尚未就绪则同步加载。
+    """
     # 基础会话状态
+    if "current_kb" not in st.session_state:
+        st.session_state.current_kb = DEFAULT_KNOWLEDGE_BASE
     if "api_key" not in st.session_state:
         st.session_state.api_key = API_KEY
-    if "conversation" not in st.session_state:
-        st.session_state.conversation = []
-    if "knowledge_base" not in st.session_state:
-        st.session_state.knowledge_base = []
-    if "deleted_files" not in st.session_state:
-        st.session_state.deleted_files = []
-    
-    # 初始化模型
-    if "embedding_model" not in st.session_state:
-        try:
-            st.session_state.embedding_model = SentenceTransformer(
-                EMBEDDING_MODEL_SENTENCE_TRANSFORMER
-            )
-        except Exception as e:
-            st.error(f"加载嵌入模型失败: {str(e)}")
-            st.session_state.embedding_model = None
+    if "client_id" not in st.session_state:
+        # 浏览器标识：对话库由所有会话共用，对话按它归属；保存在地址栏中，刷新页面后不变
+        client_id = st.query_params.get("client", "")
+        if not re.fullmatch(r"[0-9a-f]{32}", client_id):
+            client_id = uuid.uuid4().hex
+            st.query_params["client"] = client_id
+        st.session_state.client_id = client_id
+    if "conversation_id" not in st.session_state:
+        # 对话记录保存在SQLite中，会话里只保存对话ID；地址栏带有对话ID时（刷新页面后）继续该对话
+        conversation_id = st.query_params.get("conversation")
+        st.session_state.conversation_id = conversation_id \
+            if conversation_id and conversation_exists(conversation_id, st.session_state.client_id) else None
+    if "history_offset" not in st.session_state:
+        st.session_state.history_offset = 0  # 当前窗口之后（更新）的消息条数，0表示显示最新一页
+    if "llm_usage" not in st.session_state:
+        st.session_state.llm_usage = []  # 每次回答的tokens用量，调试面板据此计算缓存命中率与费用
+    if "pending_duplicates" not in st.session_state:
+        st.session_state.pending_duplicates = {}  # 等待用户选择处理方式的近重复上传
+    if "skipped_uploads" not in st.session_state:
+        st.session_state.skipped_uploads = set()  # 已选择跳过的近重复上传，上传控件回调时不再提示
 
-    # 初始化文本分割器
-    if "text_splitter" not in st.session_state:
-        st.session_state.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len
-        )
-    
-    # 初始化向量数据库
-    if "vector_db" not in st.session_state:
-        st.session_state.vector_db = get_vector_db()
-    
-    # 从持久化存储加载文件
-    # 此逻辑仅在会话中尚未填充文件列表时运行。
-    # 这能处理初次启动和会话清除后的重新加载。
-    if "uploaded_files" not in st.session_state or not st.session_state.uploaded_files:
-        st.session_state.uploaded_files = []
-        st.session_state.knowledge_base = []  # 重置以防止重复加载
-        registry = FileRegistry.load()
-        
-        # 加载已注册文件到知识库
-        for file_id, file_info in registry.items():
-            filepath = Path(file_info["filepath"])
-            if filepath.exists():
-                # 1. 首先加载并解析文件内容
-                with open(filepath, "rb") as f:
-                    content = parse_file(f, original_filename=file_info["filename"])
+    # 从持久化存储构建当前知识库的文档目录
+    # 此逻辑仅在会话中尚无目录时运行（初次启动和会话清除后）。
+    kb = get_current_kb()
+    if "catalog" not in st.session_state:
+        _load_file_list(kb)
+
+    # 后台预热：嵌入模型、向量库，以及核对并修复注册表、上传目录与向量库（一次元数据扫描）
+    start_warmup([
+        get_embedding_model,
+        get_intent_classifier,
+        get_text_splitter,
+        get_embedding_function,
+        lambda: get_vector_count(kb),  # 打开向量库（共享索引服务模式下建立连接）
+        lambda: reconcile_knowledge_base(kb),
+        lambda: purge_deleted_files(kb)
+    ])
+    # 长时间运行的服务器上定期清理所有知识库的回收站，不依赖进程重启或切换知识库
+    run_periodically("recycle-bin-purge", RECYCLE_BIN_PURGE_INTERVAL_S, _purge_all_knowledge_bases)
 
-                # 2. 将包含完整内容的文件信息添加到会话状态
-                st.session_state.uploaded_files.append({
-                    "id": file_id,
-                    "name": file_info["filename"],
-                    "type": file_info["filename"].split(".")[-1],
-                    "local_path": str(filepath),
-                    "upload_time": file_info["timestamp"],
-                    "tags": ["持久化"],
-                    "content": content or ""  # 确保content键存在
-                })
-                
-                # 3. 如果成功解析出内容，则继续处理知识片段
-                if content:
-                    # 检查向量数据库中是否已存在该文件的块
-                    existing_docs = st.session_state.vector_db.get(where={"source_id": file_id})
-                    
-                    # 无论是否存在于DB，都加载到内存知识库以供UI显示
-                    chunks = st.session_state.text_splitter.split_text(content)
-                    for chunk in chunks:
-                        st.session_state.knowledge_base.append({
-                            "source": file_info["filename"],
-                            "source_id": file_id,
-                            "content": chunk,
-                            "type": file_info["filename"].split(".")[-1]
-                        })
+def _purge_all_knowledge_bases():
+    for kb in list_knowledge_bases():
+        purge_deleted_files(kb)
 
-                    # 如果DB中不存在，则添加入库
-                    if not (existing_docs and existing_docs.get('ids')):
-                        metadatas = [{
-                            "source": file_info["filename"],
-                            "source_id": file_id,
-                            "type": file_info["filename"].split(".")[-1],
-                            "upload_time": file_info["timestamp"]
-                        } for _ in chunks]
-                        
-                        st.session_state.vector_db.add_texts(
-                            texts=chunks,
-                            metadatas=metadatas
-                        )
+def switch_knowledge_base(kb):
+    """切换当前会话的知识库，并在后台核对修复该知识库"""
+    st.session_state.current_kb = kb
+    _load_file_list(kb)
+    run_in_background(f"reconcile-{kb}", lambda: reconcile_knowledge_base(kb))
+    run_in_background(f"purge-{kb}", lambda: purge_deleted_files(kb))
 
 def clear_session():
-    """清除会话和向量数据库"""
-    st.session_state.uploaded_files = []
-    st.session_state.knowledge_base = []
-    st.session_state.conversation = []
-    st.session_state.deleted_files = []
+    """清除当前知识库的会话数据、持久化文件和向量数据库"""
+    kb = get_current_kb()
+    st.session_state.catalog = DocumentCatalog()
+    # 对话记录保留在对话库中，只是开始一个新对话
+    st.session_state.conversation_id = None
+    st.session_state.history_offset = 0
+    st.query_params.pop("conversation", None)
+    st.session_state.pending_duplicates = {}
+    st.session_state.skipped_uploads = set()
+
+    # 共享索引服务不提供远程清空，多个副本共用的知识库只能在索引服务节点上清理
+    if INDEX_SERVICE_URL:
+        st.toast("共享索引服务模式下不能在应用中清空知识库，已仅重置当前会话。")
+        return
     
     # 清除持久化存储
-    registry = FileRegistry.load()
+    registry = FileRegistry.load(kb)
     for file_id, file_info in registry.items():
         try:
             if Path(file_info["filepath"]).exists():
@@ -124,6 +143,7 @@ def clear_session():
         except Exception as e:
             st.error(f"删除文件失败: {file_info['filepath']} - {str(e)}")
     
-    # 清除注册表和向量数据库
-    FileRegistry.save({})
-    clear_db()
\ No newline at end of file
+    # 清除注册表、向量数据库和近重复签名索引
+    FileRegistry.save({}, kb)
+    clear_db(kb)
+    clear_signatures(kb)
\ No newline at end of file
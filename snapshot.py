@@ -0,0 +1,364 @@
+#snapshot
+"""知识库快照的导出与导入
+
+用法:
+  python snapshot.py export OUTPUT.tar [--kb default] [--incremental]
+  python snapshot.py import ARCHIVE.tar [--kb 名称] [--force]
+  python snapshot.py verify ARCHIVE.tar
+
+快照是一个tar包：manifest.json（格式版本、各成员的sha256、嵌入模型与分块指纹）、
+registry.json、chunks.jsonl（块id/文本/元数据）、vectors.f32（与chunks.jsonl同序的float32向量）
+以及 uploads/ 下的原始文件。导入时直接批量写入向量，不重新嵌入。
+增量快照只包含自上次导出以来新增或变化的文件及其向量，并列出已移除的文件；
+导入增量快照前要求本节点最近一次导入的正是它的基线快照。
+需在持有向量库的进程所在节点执行（共享索引服务模式下在索引服务节点上执行）。
+"""
+import argparse
+import hashlib
+import json
+import shutil
+import sys
+import tarfile
+import tempfile
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import vector_store as db_op
+from file_registry import FileRegistry
+from knowledge_bases import upload_folder
+from near_duplicates import clear_signatures, remove_signatures
+from config import (
+    DEFAULT_KNOWLEDGE_BASE,
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL_LANGCHAIN,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    VECTOR_STORAGE,
+    INDEX_SERVICE_URL,
+    SNAPSHOT_STATE_PATH
+)
+
+FORMAT_VERSION = 1
+
+
+def current_fingerprints():
+    """本节点的嵌入模型与分块配置指纹"""
+    return {
+        "embedding": {
+            "model": "stub" if EMBEDDING_BACKEND == "stub" else EMBEDDING_MODEL_LANGCHAIN,
+            "backend": EMBEDDING_BACKEND
+        },
+        "chunking": {
+            "splitter": "RecursiveCharacterTextSplitter",
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP
+        }
+    }
+
+
+def _load_state():
+    path = Path(SNAPSHOT_STATE_PATH)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {}
+
+
+def _save_state(state):
+    Path(SNAPSHOT_STATE_PATH).write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _require_local():
+    if INDEX_SERVICE_URL:
+        raise RuntimeError("共享索引服务模式下请在索引服务节点上执行快照操作")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chunk_counts(kb, batch_size):
+    """扫描一次元数据，统计每个source_id的块数"""
+    collection = db_op.get_vector_db(kb)._collection
+    counts, offset = {}, 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            return counts
+        for meta in batch["metadatas"]:
+            sid = (meta or {}).get("source_id", "")
+            counts[sid] = counts.get(sid, 0) + 1
+        offset += batch_size
+
+
+def _iter_chunks(kb, source_ids, batch_size):
+    """按批产出 (ids, documents, metadatas, vectors)；source_ids为None时导出全部"""
+    collection = db_op.get_vector_db(kb)._collection
+    index = db_op.get_compact_index(kb)
+    if index is not None:
+        # 紧凑模式下Chroma中只有占位向量，全精度向量从紧凑索引读取
+        for ids, vectors in index.iter_vectors(source_ids, block_rows=batch_size):
+            got = collection.get(ids=ids, include=["documents", "metadatas"])
+            by_id = {i: (d, m) for i, d, m in zip(got["ids"], got["documents"], got["metadatas"])}
+            ids_found = [i for i in ids if i in by_id]
+            rows = [n for n, i in enumerate(ids) if i in by_id]
+            yield ids_found, [by_id[i][0] for i in ids_found], [by_id[i][1] for i in ids_found], vectors[rows]
+        return
+
+    where = {"source_id": {"$in": sorted(source_ids)}} if source_ids is not None else None
+    offset = 0
+    while True:
+        batch = collection.get(
+            where=where,
+            include=["documents", "metadatas", "embeddings"],
+            limit=batch_size,
+            offset=offset
+        )
+        if not batch["ids"]:
+            return
+        yield batch["ids"], batch["documents"], batch["metadatas"], np.asarray(batch["embeddings"], dtype=np.float32)
+        offset += batch_size
+
+
+def export_snapshot(output, kb=DEFAULT_KNOWLEDGE_BASE, incremental=False, batch_size=512):
+    """导出知识库快照，返回manifest"""
+    _require_local()
+    state = _load_state()
+    base = state.get(kb, {}).get("last_export") if incremental else None
+    if incremental and base is None:
+        raise ValueError(f"知识库 '{kb}' 尚无导出记录，请先导出一次全量快照")
+
+    registry = FileRegistry.load(kb)
+    counts = _chunk_counts(kb, batch_size)
+    # 文件指纹：注册时间 + 块数；后台补齐入库后块数变化，也会进入下一次增量
+    sources = {fid: f"{info['timestamp']}|{counts.get(fid, 0)}" for fid, info in registry.items()}
+    if base is None:
+        changed = sorted(sources)
+        removed = []
+    else:
+        changed = sorted(fid for fid, fp in sources.items() if base["sources"].get(fid) != fp)
+        removed = sorted(fid for fid in base["sources"] if fid not in sources)
+
+    snapshot_id = uuid.uuid4().hex
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "registry.json").write_text(json.dumps(registry, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        chunk_count, dim = 0, None
+        if changed:
+            with open(tmp / "chunks.jsonl", "w", encoding="utf-8") as chunks_file, \
+                    open(tmp / "vectors.f32", "wb") as vectors_file:
+                for ids, documents, metadatas, vectors in _iter_chunks(kb, None if base is None else changed, batch_size):
+                    for i, doc, meta in zip(ids, documents, metadatas):
+                        chunks_file.write(json.dumps({"id": i, "document": doc, "metadata": meta}, ensure_ascii=False) + "\n")
+                    vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                    chunk_count += len(ids)
+                    dim = vectors.shape[1] if len(vectors) else dim
+
+        members = {"registry.json": tmp / "registry.json"}
+        if chunk_count:
+            members["chunks.jsonl"] = tmp / "chunks.jsonl"
+            members["vectors.f32"] = tmp / "vectors.f32"
+        for fid in changed:
+            path = Path(registry[fid]["filepath"])
+            if path.exists():
+                members[f"uploads/{path.name}"] = path
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "snapshot_id": snapshot_id,
+            "type": "full" if base is None else "delta",
+            "base_snapshot_id": None if base is None else base["snapshot_id"],
+            "kb": kb,
+            "created": datetime.now().isoformat(),
+            "vector_storage": VECTOR_STORAGE,
+            "fingerprints": current_fingerprints(),
+            "vectors": {"count": chunk_count, "dim": dim, "dtype": "float32"},
+            "sources": sorted(changed),
+            "removed_sources": removed,
+            "checksums": {name: _sha256(path) for name, path in members.items()}
+        }
+        manifest_path = tmp / "manifest.json"
+        manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        # manifest放在第一个成员，verify/import可以先读它
+        with tarfile.open(output, "w") as tar:
+            tar.add(manifest_path, arcname="manifest.json")
+            for name, path in members.items():
+                tar.add(path, arcname=name)
+
+    state.setdefault(kb, {})["last_export"] = {
+        "snapshot_id": snapshot_id,
+        "created": manifest["created"],
+        "sources": sources
+    }
+    _save_state(state)
+    return manifest
+
+
+def _read_manifest(tar):
+    manifest = json.load(tar.extractfile("manifest.json"))
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"不支持的快照格式版本: {manifest.get('format_version')}")
+    return manifest
+
+
+def verify_snapshot(archive):
+    """校验快照中每个成员的sha256，返回manifest；不一致时抛出ValueError"""
+    with tarfile.open(archive, "r") as tar:
+        manifest = _read_manifest(tar)
+        names = set(tar.getnames()) - {"manifest.json"}
+        if names != set(manifest["checksums"]):
+            raise ValueError("快照成员与manifest记录不一致")
+        for name, expected in manifest["checksums"].items():
+            digest = hashlib.sha256()
+            stream = tar.extractfile(name)
+            for block in iter(lambda: stream.read(1 << 20), b""):
+                digest.update(block)
+            if digest.hexdigest() != expected:
+                raise ValueError(f"校验失败: {name}")
+    return manifest
+
+
+def check_compatibility(manifest):
+    """返回 (不兼容项, 警告)：嵌入模型不同则向量不可用；后端或分块配置不同只给出警告"""
+    local = current_fingerprints()
+    remote = manifest["fingerprints"]
+    errors, warnings = [], []
+    if remote["embedding"]["model"] != local["embedding"]["model"]:
+        errors.append(f"嵌入模型不一致: 快照 {remote['embedding']['model']} / 本节点 {local['embedding']['model']}")
+    if remote["embedding"]["backend"] != local["embedding"]["backend"]:
+        warnings.append(f"嵌入后端不同: 快照 {remote['embedding']['backend']} / 本节点 {local['embedding']['backend']}")
+    if remote["chunking"] != local["chunking"]:
+        warnings.append("分块配置不同，之后新上传的文件与快照中的文件分块方式不一致")
+    return errors, warnings
+
+
+def _bulk_load(tar, manifest, kb, batch_size):
+    count, dim = manifest["vectors"]["count"], manifest["vectors"]["dim"]
+    if not count:
+        return 0
+    chunks = tar.extractfile("chunks.jsonl")
+    vectors = tar.extractfile("vectors.f32")
+    loaded = 0
+    while loaded < count:
+        lines = [json.loads(chunks.readline()) for _ in range(min(batch_size, count - loaded))]
+        block = np.frombuffer(vectors.read(len(lines) * dim * 4), dtype=np.float32).reshape(len(lines), dim)
+        db_op.add_embedded_texts(
+            texts=[c["document"] for c in lines],
+            metadatas=[c["metadata"] for c in lines],
+            vectors=block,
+            kb=kb,
+            ids=[c["id"] for c in lines]
+        )
+        loaded += len(lines)
+    return loaded
+
+
+def import_snapshot(archive, kb=None, force=False, batch_size=512):
+    """导入快照：批量写入向量与文本，恢复上传文件与注册表，返回导入报告"""
+    _require_local()
+    manifest = verify_snapshot(archive)
+    kb = kb or manifest["kb"]
+    errors, warnings = check_compatibility(manifest)
+    if errors and not force:
+        raise ValueError("；".join(errors))
+
+    state = _load_state()
+    last = state.get(kb, {}).get("last_import")
+    if manifest["type"] == "delta" and not force:
+        if last is None or last["snapshot_id"] != manifest["base_snapshot_id"]:
+            raise ValueError("增量快照的基线与本节点最近一次导入的快照不一致，请先导入基线快照")
+
+    folder = upload_folder(kb)
+    folder.mkdir(parents=True, exist_ok=True)
+    local_registry = FileRegistry.load(kb)
+    if manifest["type"] == "full":
+        # 全量导入替换整个知识库：向量、注册表、上传文件与近重复签名都先清空，
+        # 否则本节点原有的文件会在核对时成为孤立向量或未注册文件
+        db_op.clear_db(kb)
+        FileRegistry.save({}, kb)
+        clear_signatures(kb)
+        for path in folder.iterdir():
+            if path.is_file():
+                path.unlink()
+    else:
+        # 移除的文件连同上传文件一起删除；变化的文件先删旧块，保证重复导入幂等
+        for fid in manifest["removed_sources"] + manifest["sources"]:
+            db_op.delete_from_db_by_source_id(fid, kb)
+        for fid in manifest["removed_sources"]:
+            path = Path(local_registry.get(fid, {}).get("filepath", ""))
+            if path.name and path.exists():
+                path.unlink()
+        # 签名不在快照中：移除与变化的文件丢弃旧签名，变化的文件由核对重新计算
+        remove_signatures(manifest["removed_sources"] + manifest["sources"], kb)
+
+    with tarfile.open(archive, "r") as tar:
+        loaded = _bulk_load(tar, manifest, kb, batch_size)
+        for name in manifest["checksums"]:
+            if name.startswith("uploads/"):
+                with tar.extractfile(name) as src, open(folder / Path(name).name, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+        registry = json.load(tar.extractfile("registry.json"))
+
+    # 注册表中的路径改写为本节点的上传目录
+    for info in registry.values():
+        info["filepath"] = str((folder / Path(info["filepath"]).name).absolute())
+    FileRegistry.save(registry, kb)
+    db_op.reset_tombstones(kb)
+
+    state.setdefault(kb, {})["last_import"] = {
+        "snapshot_id": manifest["snapshot_id"],
+        "imported": datetime.now().isoformat()
+    }
+    _save_state(state)
+    return {
+        "kb": kb,
+        "snapshot_id": manifest["snapshot_id"],
+        "type": manifest["type"],
+        "chunks_loaded": loaded,
+        "files": len(manifest["sources"]),
+        "removed_files": len(manifest["removed_sources"]),
+        "errors_ignored": errors,
+        "warnings": warnings
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库快照导出/导入")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="导出快照")
+    export_cmd.add_argument("output")
+    export_cmd.add_argument("--kb", default=DEFAULT_KNOWLEDGE_BASE)
+    export_cmd.add_argument("--incremental", action="store_true", help="只导出自上次导出以来的变化")
+    import_cmd = sub.add_parser("import", help="导入快照")
+    import_cmd.add_argument("archive")
+    import_cmd.add_argument("--kb", default=None, help="目标知识库，默认使用快照中记录的知识库")
+    import_cmd.add_argument("--force", action="store_true", help="忽略指纹不一致与增量基线检查")
+    verify_cmd = sub.add_parser("verify", help="校验快照完整性")
+    verify_cmd.add_argument("archive")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            result = export_snapshot(args.output, kb=args.kb, incremental=args.incremental)
+            result = {k: v for k, v in result.items() if k not in ("checksums", "sources")}
+        elif args.command == "import":
+            result = import_snapshot(args.archive, kb=args.kb, force=args.force)
+        else:
+            result = verify_snapshot(args.archive)
+            result = {k: v for k, v in result.items() if k != "checksums"}
+    except (ValueError, RuntimeError) as e:
+        print(f"快照操作失败: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#test_compact_index
+import numpy as np
+import pytest
+
+from compact_index import CompactVectorIndex
+
+
+def _vectors(rows, dim, seed=0):
+    return np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+
+
+def _add(index, start, vectors):
+    ids = [f"c{i}" for i in range(start, start + len(vectors))]
+    index.add(ids, ["s"] * len(vectors), vectors)
+    return ids
+
+
+def test_pq_dimension_is_checked_before_anything_is_written(tmp_path):
+    index = CompactVectorIndex(tmp_path, mode="pq", pq_subvectors=64)
+    with pytest.raises(ValueError):
+        _add(index, 0, _vectors(10, 10))
+    assert index.dim is None and index.ids == []
+    assert not (tmp_path / "full.f32").exists() or (tmp_path / "full.f32").stat().st_size == 0
+
+
+def test_failed_training_rolls_back_rows(tmp_path, monkeypatch):
+    index = CompactVectorIndex(tmp_path, mode="pq", pq_subvectors=4, pq_train_min=256)
+    _add(index, 0, _vectors(200, 8))
+
+    def fail():
+        raise MemoryError("训练失败")
+    monkeypatch.setattr(index, "_train_pq", fail)
+    with pytest.raises(MemoryError):
+        _add(index, 200, _vectors(100, 8, seed=1))
+
+    assert len(index.ids) == len(index.source_ids) == len(index.alive) == 200
+    assert (tmp_path / "full.f32").stat().st_size == 200 * 8 * 4
+    reloaded = CompactVectorIndex(tmp_path, mode="pq", pq_subvectors=4, pq_train_min=256)
+    assert reloaded.ids == index.ids
+
+
+def test_failed_save_rolls_back_and_later_rows_stay_aligned(tmp_path, monkeypatch):
+    index = CompactVectorIndex(tmp_path, mode="float16")
+    first = _vectors(5, 8)
+    _add(index, 0, first)
+
+    original_save = index._save
+    monkeypatch.setattr(index, "_save", lambda: (_ for _ in ()).throw(OSError("磁盘已满")))
+    with pytest.raises(OSError):
+        _add(index, 5, _vectors(3, 8, seed=1))
+    monkeypatch.setattr(index, "_save", original_save)
+
+    second = _vectors(4, 8, seed=2)
+    _add(index, 5, second)
+    reloaded = CompactVectorIndex(tmp_path, mode="float16")
+    assert reloaded.ids == [f"c{i}" for i in range(9)]
+    np.testing.assert_array_equal(np.asarray(reloaded._full_vectors()), np.vstack([first, second]))
+
+
+def test_load_truncates_rows_written_after_the_last_save(tmp_path):
+    index = CompactVectorIndex(tmp_path, mode="float16")
+    first = _vectors(5, 8)
+    _add(index, 0, first)
+    with open(tmp_path / "full.f32", "ab") as f:
+        f.write(_vectors(2, 8, seed=3).tobytes())  # 模拟写入向量后、保存元数据前中断
+
+    reloaded = CompactVectorIndex(tmp_path, mode="float16")
+    assert (tmp_path / "full.f32").stat().st_size == 5 * 8 * 4
+    np.testing.assert_array_equal(np.asarray(reloaded._full_vectors()), first)
@@ -0,0 +1,25 @@
+#test_embedding_parity
+import pytest
+
+from benchmarks.embedding_parity import SAMPLE_TEXTS
+from config import EMBEDDING_MODEL_LANGCHAIN
+from embedding_backend import check_parity, create_embedding_function
+
+# 需要torch、onnxruntime与本地已缓存的嵌入模型，缺少任何一项时跳过（不在测试中下载模型）
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+huggingface_hub = pytest.importorskip("huggingface_hub")
+if not isinstance(huggingface_hub.try_to_load_from_cache(EMBEDDING_MODEL_LANGCHAIN, "config.json"), str):
+    pytest.skip(f"本地没有嵌入模型 {EMBEDDING_MODEL_LANGCHAIN}", allow_module_level=True)
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return create_embedding_function("torch")
+
+
+@pytest.mark.parametrize("backend, min_cosine", [("onnx", 0.999), ("onnx_int8", 0.99), ("torch_int8", 0.99)])
+def test_backend_matches_torch(reference, backend, min_cosine):
+    report = check_parity(SAMPLE_TEXTS, backend, reference=reference)
+    assert report["texts"] == len(SAMPLE_TEXTS)
+    assert report["min_cosine"] >= min_cosine
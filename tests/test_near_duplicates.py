@@ -0,0 +1,60 @@
+#test_near_duplicates
+import multiprocessing
+import random
+import sys
+
+import numpy as np
+import pytest
+
+import near_duplicates
+from near_duplicates import MinHasher, minhash_signature
+
+
+def _chunked_signature(text, cuts):
+    hasher = MinHasher()
+    start = 0
+    for end in sorted(cuts) + [len(text)]:
+        hasher.update(text[start:end])
+        start = end
+    return hasher.signature()
+
+
+def test_chunked_signature_equals_one_shot():
+    rng = random.Random(0)
+    words = ["知识库", "检索", "vector", "store", " ", "  ", "\n", "\t", "近重复", "MinHash"]
+    for _ in range(100):
+        text = "".join(rng.choices(words, k=rng.randint(5, 80)))
+        cuts = rng.sample(range(len(text) + 1), k=min(len(text) + 1, rng.randint(1, 10)))
+        expected = minhash_signature(text)
+        actual = _chunked_signature(text, cuts)
+        if expected is None:
+            assert actual is None
+        else:
+            np.testing.assert_array_equal(actual, expected)
+
+
+def test_short_text_has_no_signature():
+    assert minhash_signature("abc") is None
+    assert MinHasher().update("ab").update("  ").signature() is None
+
+
+def _register_many(worker, count):
+    for i in range(count):
+        near_duplicates.register_signature(f"w{worker}-{i}", None, "default")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="需要fork")
+def test_concurrent_processes_do_not_lose_appends(tmp_path, monkeypatch):
+    # fork出的子进程继承这里的替换：每次追加后都满足压缩条件，压缩与其他进程的追加交错发生
+    monkeypatch.setattr(near_duplicates, "minhash_index_path", lambda kb: tmp_path / "minhash_index.jsonl")
+    monkeypatch.setattr(near_duplicates, "MINHASH_LOG_COMPACT_MIN", -10 ** 6)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_register_many, args=(w, 50)) for w in range(6)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+
+    assert near_duplicates.signature_ids("default") == {f"w{w}-{i}" for w in range(6) for i in range(50)}
+    assert list(tmp_path.glob("*.tmp")) == []
@@ -0,0 +1,56 @@
+#test_text_stream
+import io
+
+from text_stream import detect_encoding, iter_lines, iter_markdown_chunks, iter_text_blocks
+
+
+class _Splitter:
+    """按固定长度切分，代替langchain的文本分割器"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def split_text(self, text):
+        return [text[i:i + self.size] for i in range(0, len(text), self.size)]
+
+
+def _chunks(markdown, chunk_size=200):
+    return list(iter_markdown_chunks(io.StringIO(markdown), _Splitter(chunk_size), chunk_size))
+
+
+def test_heading_path_follows_levels():
+    chunks = _chunks("# 总论\n\n第一段\n\n## 方法\n\n第二段\n\n# 结论\n\n第三段\n")
+    assert [(text.splitlines()[-1], path) for text, path in chunks] == [
+        ("第一段", "总论"), ("第二段", "总论 > 方法"), ("第三段", "结论")
+    ]
+
+
+def test_hash_lines_inside_code_fence_are_not_headings():
+    markdown = "# 安装\n\n```bash\n# 这是注释\npip install x\n```\n\n~~~\n## 也不是标题\n~~~\n"
+    chunks = _chunks(markdown)
+    assert {path for _, path in chunks} == {"安装"}
+    text = "\n".join(text for text, _ in chunks)
+    assert "# 这是注释" in text and "## 也不是标题" in text
+
+
+def test_shorter_fence_does_not_close_longer_one():
+    chunks = _chunks("# 示例\n\n````\n```\n# 仍在代码块中\n````\n\n# 下一节\n\n正文\n")
+    assert [path for _, path in chunks] == ["示例", "下一节"]
+
+
+def test_oversized_unit_goes_through_splitter():
+    chunks = _chunks("# 长段落\n\n" + "字" * 450 + "\n", chunk_size=200)
+    assert all(len(text) <= 200 for text, _ in chunks)
+    assert {path for _, path in chunks} == {"长段落"}
+
+
+def test_detect_encoding_ignores_truncated_tail():
+    sample = "中文文本".encode("utf-8")
+    assert detect_encoding(sample[:-1]) == "utf-8"
+    assert detect_encoding("中文文本".encode("gbk")) == "gb18030"
+
+
+def test_blocks_and_lines_round_trip():
+    text = "第一行\r\n第二行\n" + "长" * 50 + "\n末行"
+    blocks = list(iter_text_blocks(io.BytesIO(text.encode("gb18030")), block_chars=7))
+    assert "".join(iter_lines(blocks)) == text.replace("\r\n", "\n")
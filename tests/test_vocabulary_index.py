@@ -0,0 +1,26 @@
+#test_vocabulary_index
+import random
+
+from vocabulary_index import AhoCorasick
+
+
+def _brute_force(patterns, text):
+    return sorted((i, p) for p in set(patterns) for i in range(len(text) - len(p) + 1) if text.startswith(p, i))
+
+
+def test_matches_classic_example():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    assert sorted(automaton.find("ushers")) == [(1, "she"), (2, "he"), (2, "hers")]
+
+
+def test_matches_brute_force_on_random_inputs():
+    rng = random.Random(0)
+    alphabet = "ab知识库"
+    for _ in range(200):
+        patterns = ["".join(rng.choices(alphabet, k=rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 40)))
+        assert sorted(AhoCorasick(patterns).find(text)) == _brute_force(patterns, text)
+
+
+def test_empty_pattern_set_finds_nothing():
+    assert AhoCorasick([]).find("任意文本") == []
@@ -0,0 +1,168 @@
+#text_stream
+"""纯文本与Markdown的流式读取和分块
+
+编码由文件开头的样本判断（BOM → UTF-8 → GB18030，都失败时按latin-1读取），之后按固定字符数分块读取，
+不写临时文件，也不把整个文件解码成一个字符串。分块同样是流式的：纯文本每积累一段就交给文本分割器，
+Markdown按标题与代码围栏切分，块的metadata中记录标题路径（heading_path）。
+"""
+import codecs
+import io
+import re
+from config import CHUNK_SIZE, TEXT_SAMPLE_BYTES, TEXT_BLOCK_CHARS
+
+STREAMED_TYPES = ("txt", "md")
+_CANDIDATE_ENCODINGS = ("utf-8", "gb18030")
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+_HEADING = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+
+def detect_encoding(sample):
+    """根据文件开头的字节样本判断编码；样本末尾被截断的多字节字符不算解码错误"""
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in _CANDIDATE_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def iter_text_blocks(file, block_chars=TEXT_BLOCK_CHARS, encoding=None):
+    """从二进制文件对象按块读取文本（统一换行符为\\n），内存占用与文件大小无关"""
+    file.seek(0)
+    if encoding is None:
+        encoding = detect_encoding(file.read(TEXT_SAMPLE_BYTES))
+        file.seek(0)
+    # 样本之后仍可能出现个别非法字节，替换而不是中断整个文件
+    text = io.TextIOWrapper(file, encoding=encoding, errors="replace")
+    try:
+        while True:
+            block = text.read(block_chars)
+            if not block:
+                return
+            yield block
+    finally:
+        text.detach()  # 不关闭调用方的文件对象
+
+
+def read_text(file):
+    """读取整个文本文件（需要完整字符串的调用方使用，如parse_file）"""
+    return "".join(iter_text_blocks(file))
+
+
+def iter_lines(blocks):
+    """把文本块拼接为逐行输出（保留行尾换行符）"""
+    tail = ""
+    for block in blocks:
+        lines = (tail + block).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if tail:
+        yield tail
+
+
+def iter_plain_chunks(blocks, splitter, chunk_size=CHUNK_SIZE):
+    """纯文本流式分块：待分割文本积累到若干块大小后分割，最后一块留到下一轮与后续文本一起分割"""
+    pending = ""
+    for block in blocks:
+        pending += block
+        if len(pending) < 4 * chunk_size:
+            continue
+        chunks = splitter.split_text(pending)
+        yield from chunks[:-1]
+        start = pending.rfind(chunks[-1]) if chunks else -1
+        pending = pending[start:] if start >= 0 else chunks[-1] if chunks else ""
+    if pending.strip():
+        yield from splitter.split_text(pending)
+
+
+def iter_markdown_chunks(lines, splitter, chunk_size=CHUNK_SIZE):
+    """Markdown分块：返回 (块文本, 标题路径)
+
+    标题开始新的一节，节内按段落与代码围栏组成的“单元”装箱，单元不跨块拆分；
+    超过chunk_size的单元（长代码块或长段落）再交给文本分割器。代码围栏内的#行不视为标题。
+    """
+    path = []        # [(级别, 标题)]
+    unit, unit_len = [], 0
+    chunk, chunk_len = [], 0
+    fence = None
+
+    def heading_path():
+        return " > ".join(title for _, title in path)
+
+    def close_unit():
+        nonlocal unit, unit_len, chunk, chunk_len
+        text = "".join(unit)
+        unit, unit_len = [], 0
+        if not text.strip():
+            return
+        if chunk_len + len(text) > chunk_size and chunk:
+            yield "".join(chunk).strip(), heading_path()
+            chunk, chunk_len = [], 0
+        if len(text) > chunk_size:
+            for piece in splitter.split_text(text):
+                yield piece, heading_path()
+        else:
+            chunk.append(text)
+            chunk_len += len(text)
+
+    def close_section():
+        nonlocal chunk, chunk_len
+        yield from close_unit()
+        if chunk and "".join(chunk).strip():
+            yield "".join(chunk).strip(), heading_path()
+        chunk, chunk_len = [], 0
+
+    for line in lines:
+        stripped = line.rstrip("\n")
+        fence_match = _FENCE.match(stripped)
+        if fence is not None:
+            unit.append(line)
+            unit_len += len(line)
+            # 关闭围栏：同一字符、长度不短于开启围栏、且没有其他内容
+            if fence_match and stripped.strip() == fence_match.group(1) and \
+                    fence_match.group(1)[0] == fence[0] and len(fence_match.group(1)) >= len(fence):
+                fence = None
+                yield from close_unit()
+            elif unit_len > TEXT_BLOCK_CHARS:
+                yield from close_unit()  # 未闭合的超长围栏，按块大小截断，保证内存有界
+            continue
+
+        heading = _HEADING.match(stripped)
+        if heading:
+            yield from close_section()
+            level = len(heading.group(1))
+            path = [(lvl, title) for lvl, title in path if lvl < level] + [(level, heading.group(2).strip())]
+            unit, unit_len = [line], len(line)
+            continue
+        if fence_match:
+            yield from close_unit()
+            fence = fence_match.group(1)
+            unit, unit_len = [line], len(line)
+            continue
+        if not stripped.strip():
+            unit.append(line)
+            yield from close_unit()
+            continue
+        unit.append(line)
+        unit_len += len(line)
+        if unit_len > TEXT_BLOCK_CHARS:
+            yield from close_unit()
+    yield from close_section()
+
+
+def iter_text_chunks(file, file_type, splitter):
+    """流式读取并分块文本/Markdown文件，返回 (块文本, 额外metadata)"""
+    blocks = iter_text_blocks(file)
+    if file_type == "md":
+        for text, path in iter_markdown_chunks(iter_lines(blocks), splitter):
+            yield text, {"heading_path": path}
+    else:
+        for text in iter_plain_chunks(blocks, splitter):
+            yield text, {}
@@ -1,24 +1,72 @@
+import shutil
+import threading
+import uuid
 import streamlit as st
-from langchain.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from config import EMBEDDING_MODEL_LANGCHAIN, CHROMA_DB_PATH
+from concurrent.futures import ThreadPoolExecutor
+from embedding_backend import create_embedding_function, BatchingEmbeddings
+from knowledge_bases import resolve_kb, collection_name, compact_index_path, registry_path
+from file_registry import FileRegistry
+from contention import get_lock
+from config import (
+    CHROMA_DB_PATH,
+    DEFAULT_KNOWLEDGE_BASE,
+    MULTI_QUERY_FETCH_K,
+    RRF_K,
+    VECTOR_STORAGE,
+    COMPACT_RESCORE_CANDIDATES,
+    PQ_SUBVECTORS,
+    PQ_TRAIN_MIN,
+    EMBEDDING_BATCH_WINDOW_MS,
+    INDEX_SERVICE_URL
+)
 from typing import List, Dict, Optional
 
 @st.cache_resource
 def get_embedding_function():
-    """获取LangChain的嵌入函数"""
-    return HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL_LANGCHAIN,
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': False}
+    """获取LangChain的嵌入函数（后端由EMBEDDING_BACKEND配置决定）"""
+    if INDEX_SERVICE_URL:
+        from index_client import RemoteEmbeddings, get_index_client
+        return RemoteEmbeddings(get_index_client())
+    embeddings = create_embedding_function()
+    if EMBEDDING_BATCH_WINDOW_MS > 0:
+        embeddings = BatchingEmbeddings(embeddings, EMBEDDING_BATCH_WINDOW_MS)
+    return embeddings
+
+def _remote(op: str, **kwargs):
+    """共享索引服务模式：把操作转发给索引进程"""
+    from index_client import get_index_client
+    return get_index_client().call(op, **kwargs)
+
+def _to_documents(items: List[Dict]) -> List:
+    from langchain.schema import Document
+    return [Document(page_content=item["page_content"], metadata=item["metadata"] or {}) for item in items]
+
+@st.cache_resource
+def _open_compact_index(kb: str):
+    if VECTOR_STORAGE == "chroma":
+        return None
+    from compact_index import CompactVectorIndex
+    return CompactVectorIndex(
+        compact_index_path(kb),
+        mode=VECTOR_STORAGE,
+        pq_subvectors=PQ_SUBVECTORS,
+        pq_train_min=PQ_TRAIN_MIN
     )
 
+def get_compact_index(kb: Optional[str] = None):
+    """紧凑存储模式下返回知识库的紧凑向量索引，Chroma原生存储时返回None"""
+    return _open_compact_index(resolve_kb(kb))
+
 @st.cache_resource
-def get_vector_db():
-    """初始化并返回ChromaDB实例"""
+def _open_vector_db(kb: str):
+    # langchain/chromadb导入较慢，放到首次使用时
+    from langchain.vectorstores import Chroma
     embedding_function = get_embedding_function()
+    # 每个知识库一个独立集合；紧凑模式下Chroma只作为文本与元数据存储
+    name = collection_name(kb, compact=VECTOR_STORAGE != "chroma")
     try:
         return Chroma(
+            collection_name=name,
             embedding_function=embedding_function,
             persist_directory=CHROMA_DB_PATH
         )
@@ -26,53 +74,349 @@ def get_vector_db():
         # 尝试清理缓存并重建
         st.cache_resource.clear()
         return Chroma(
+            collection_name=name,
             embedding_function=embedding_function,
             persist_directory=CHROMA_DB_PATH
         )
 
-def add_texts_to_db(texts: List[str], metadatas: List[Dict]):
+def get_vector_db(kb: Optional[str] = None):
+    """初始化并返回知识库对应的ChromaDB实例，kb为None时使用当前知识库
+
+    共享索引服务模式下Chroma由索引进程持有，本进程不能直接打开。
+    """
+    if INDEX_SERVICE_URL:
+        raise RuntimeError("共享索引服务模式下不能在应用进程内打开向量库")
+    return _open_vector_db(resolve_kb(kb))
+
+# Chroma写操作（嵌入式持久化存储）在进程内串行化
+_chroma_write_lock = get_lock("chroma")
+
+# 墓碑集合：回收站中文件的source_id，检索时过滤；按知识库缓存在内存中
+# 缓存记下注册表文件的修改时间，其他应用进程改写注册表后自动重新加载
+_tombstone_lock = threading.Lock()
+_tombstones = {}  # kb -> (注册表修改时间, 墓碑集合)
+
+def _registry_signature(kb: str):
+    path = registry_path(kb)
+    return path.stat().st_mtime_ns if path.exists() else None
+
+def get_tombstones(kb: Optional[str] = None) -> set:
+    """返回知识库的墓碑集合（首次访问或注册表文件修改后从注册表加载）"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        return set(_remote("get_tombstones", kb=kb))
+    signature = _registry_signature(kb)
+    with _tombstone_lock:
+        cached = _tombstones.get(kb)
+        if cached is not None and cached[0] == signature:
+            return set(cached[1])
+    tombstones = FileRegistry.deleted_ids(kb)
+    with _tombstone_lock:
+        _tombstones[kb] = (signature, tombstones)
+        return set(tombstones)
+
+def tombstone_source(source_id: str, kb: Optional[str] = None):
+    """软删除：只把source_id加入墓碑集合，向量保持不变"""
+    if INDEX_SERVICE_URL:
+        return _remote("tombstone_source", source_id=source_id, kb=resolve_kb(kb))
+    kb = resolve_kb(kb)
+    get_tombstones(kb)
+    with _tombstone_lock:
+        cached = _tombstones.get(kb)
+        if cached is not None:
+            cached[1].add(source_id)
+
+def revive_source(source_id: str, kb: Optional[str] = None):
+    """恢复：从墓碑集合移除source_id"""
+    if INDEX_SERVICE_URL:
+        return _remote("revive_source", source_id=source_id, kb=resolve_kb(kb))
+    kb = resolve_kb(kb)
+    get_tombstones(kb)
+    with _tombstone_lock:
+        cached = _tombstones.get(kb)
+        if cached is not None:
+            cached[1].discard(source_id)
+
+def _tombstone_filter(tombstones: set) -> Optional[Dict]:
+    """构造排除墓碑的Chroma元数据过滤条件"""
+    if not tombstones:
+        return None
+    return {"source_id": {"$nin": sorted(tombstones)}}
+
+def reset_tombstones(kb: Optional[str] = None):
+    """丢弃墓碑缓存，下次访问时从注册表重新加载（注册表被整体替换后调用）"""
+    with _tombstone_lock:
+        _tombstones.pop(resolve_kb(kb), None)
+
+def _add_to_compact(db, index, texts: List[str], metadatas: List[Dict], vectors=None, ids=None):
+    """紧凑模式写入：向量进入紧凑索引，Chroma中只保留1维占位向量"""
+    if vectors is None:
+        vectors = get_embedding_function().embed_documents(texts)
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    db._collection.add(
+        ids=ids,
+        documents=texts,
+        metadatas=metadatas,
+        embeddings=[[0.0]] * len(texts)
+    )
+    try:
+        index.add(ids, [(m or {}).get("source_id", "") for m in metadatas], vectors)
+    except Exception:
+        # 紧凑索引写入失败时撤回占位行，否则Chroma中会留下没有向量、却被计为已入库的块
+        db._collection.delete(ids=ids)
+        raise
+
+def _docs_by_ids(db, ids: List[str]) -> List:
+    """按id顺序从Chroma取回文档，块id记在metadata的chunk_id中"""
+    if not ids:
+        return []
+    from langchain.schema import Document
+    got = db._collection.get(ids=ids, include=["documents", "metadatas"])
+    by_id = {i: (d, m) for i, d, m in zip(got["ids"], got["documents"], got["metadatas"])}
+    return [
+        Document(page_content=by_id[i][0], metadata={**(by_id[i][1] or {}), "chunk_id": i})
+        for i in ids if i in by_id
+    ]
+
+def _query_chroma(db, vector, k: int, where: Optional[Dict]) -> List:
+    """Chroma原生向量检索（直接查询底层集合，以便带回块id）"""
+    from langchain.schema import Document
+    got = db._collection.query(query_embeddings=[list(vector)], n_results=k, where=where,
+                               include=["documents", "metadatas"])
+    return [
+        Document(page_content=text, metadata={**(metadata or {}), "chunk_id": chunk_id})
+        for chunk_id, text, metadata in zip(got["ids"][0], got["documents"][0], got["metadatas"][0])
+    ]
+
+def _tag_kb(docs: List, kb: str) -> List:
+    """在检索结果的metadata中记下所属知识库（与chunk_id一起唯一定位一个块）"""
+    for doc in docs:
+        doc.metadata["kb"] = kb
+    return docs
+
+def _scoped_sources(tombstones: set, sources) -> Optional[set]:
+    """检索限定的来源集合（已排除墓碑）；sources为None表示不限定"""
+    if sources is None:
+        return None
+    return set(sources) - tombstones
+
+def _search_by_vector(db, index, vector, k: int, tombstones: set = frozenset(), sources=None) -> List:
+    """按向量检索，自动选择Chroma原生或紧凑索引路径，并过滤墓碑；sources不为None时只在这些来源中检索"""
+    allowed = _scoped_sources(tombstones, sources)
+    if allowed is not None and not allowed:
+        return []
+    if index is None:
+        where = {"source_id": {"$in": sorted(allowed)}} if allowed is not None else _tombstone_filter(tombstones)
+        return _query_chroma(db, vector, k, where)
+    if allowed is not None:
+        mask = index.source_mask(allowed, include=True)
+    else:
+        mask = index.source_mask(tombstones, include=False) if tombstones else None
+    ids, _ = index.search(vector, k=k, candidates=COMPACT_RESCORE_CANDIDATES, mask=mask)
+    return _docs_by_ids(db, ids)
+
+def add_texts_to_db(texts: List[str], metadatas: List[Dict], kb: Optional[str] = None):
     """添加文本和元数据到向量数据库"""
     assert len(texts) == len(metadatas), f"texts({len(texts)})和metadatas({len(metadatas)})长度不一致"
-    db = get_vector_db()
-    db.add_texts(texts=texts, metadatas=metadatas)
-    
-    # 更新会话状态（如果需要）
-    if "vector_db" not in st.session_state:
-        st.session_state.vector_db = db
+    if INDEX_SERVICE_URL:
+        return _remote("add_texts_to_db", texts=texts, metadatas=metadatas, kb=resolve_kb(kb))
+    # 嵌入计算放在锁外，只串行化写入
+    vectors = get_embedding_function().embed_documents(texts)
+    add_embedded_texts(texts, metadatas, vectors, kb=kb)
+
+def add_embedded_texts(texts: List[str], metadatas: List[Dict], vectors, kb: Optional[str] = None,
+                       ids: Optional[List[str]] = None):
+    """写入已计算好嵌入的文本（快照导入等批量加载场景，不重新嵌入）；ids为None时自动生成"""
+    if INDEX_SERVICE_URL:
+        return _remote("add_embedded_texts", texts=texts, metadatas=metadatas, vectors=vectors,
+                       kb=resolve_kb(kb), ids=ids)
+    db = get_vector_db(kb)
+    index = get_compact_index(kb)
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    with _chroma_write_lock:
+        if index is None:
+            db._collection.add(
+                ids=ids,
+                documents=texts,
+                metadatas=metadatas,
+                embeddings=vectors
+            )
+        else:
+            _add_to_compact(db, index, texts, metadatas, vectors=vectors, ids=ids)
+
+def has_source(source_id: str, kb: Optional[str] = None) -> bool:
+    """向量数据库中是否已有该文件的块"""
+    if INDEX_SERVICE_URL:
+        return _remote("has_source", source_id=source_id, kb=resolve_kb(kb))
+    got = get_vector_db(kb)._collection.get(where={"source_id": source_id}, limit=1, include=[])
+    return bool(got["ids"])
+
+def source_chunks(source_id: str, kb: Optional[str] = None) -> Dict[str, List[float]]:
+    """取出一个文件已入库的块：块文本 -> 向量（近重复文档重新入库时复用未变化块的嵌入）"""
+    if INDEX_SERVICE_URL:
+        return _remote("source_chunks", source_id=source_id, kb=resolve_kb(kb))
+    collection = get_vector_db(kb)._collection
+    index = get_compact_index(kb)
+    if index is None:
+        got = collection.get(where={"source_id": source_id}, include=["documents", "embeddings"])
+        return {text: [float(v) for v in vector] for text, vector in zip(got["documents"], got["embeddings"])}
+    chunks = {}
+    for ids, vectors in index.iter_vectors(source_ids=[source_id]):
+        got = collection.get(ids=ids, include=["documents"])
+        texts = dict(zip(got["ids"], got["documents"]))
+        for chunk_id, vector in zip(ids, vectors):
+            if chunk_id in texts:
+                chunks[texts[chunk_id]] = vector.tolist()
+    return chunks
 
-def search_db(query: str, k: int = 3) -> List:
-    """在向量数据库中执行相似性搜索"""
-    db = get_vector_db()
+def source_counts(kb: Optional[str] = None, batch_size: int = 5000) -> Dict[str, int]:
+    """一次元数据扫描统计向量库中每个source_id的块数（分页读取，只取元数据）"""
+    if INDEX_SERVICE_URL:
+        return _remote("source_counts", kb=resolve_kb(kb))
+    collection = get_vector_db(kb)._collection
+    counts = {}
+    offset = 0
+    while True:
+        got = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        metadatas = got["metadatas"] or []
+        for metadata in metadatas:
+            source_id = (metadata or {}).get("source_id")
+            if source_id:
+                counts[source_id] = counts.get(source_id, 0) + 1
+        if len(metadatas) < batch_size:
+            return counts
+        offset += batch_size
+
+def search_db(query: str, k: int = 3, kb: Optional[str] = None, sources: Optional[List[str]] = None) -> List:
+    """在向量数据库中执行相似性搜索；sources不为None时只检索这些source_id的块"""
+    if INDEX_SERVICE_URL:
+        try:
+            return _to_documents(_remote("search_db", query=query, k=k, kb=resolve_kb(kb),
+                                         sources=sorted(sources) if sources is not None else None))
+        except Exception as e:
+            st.error(f"知识库检索失败: {str(e)}")
+            return []
+    kb = resolve_kb(kb)
+    db = get_vector_db(kb)
+    index = get_compact_index(kb)
+    tombstones = get_tombstones(kb)
     try:
-        return db.similarity_search(query, k=k)
+        vector = get_embedding_function().embed_query(query)
+        return _tag_kb(_search_by_vector(db, index, vector, k, tombstones, sources), kb)
     except Exception as e:
         st.error(f"知识库检索失败: {str(e)}")
         return []
 
-def delete_from_db_by_source_id(source_id: str):
-    """根据source_id元数据删除向量"""
-    db = get_vector_db()
-    db.delete(where={"source_id": source_id})
+def reciprocal_rank_fusion(ranked_lists: List[List], k: int = 3, rrf_k: int = RRF_K) -> List:
+    """用倒数排名融合(RRF)合并多路检索结果"""
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            # 同一来源的同一片段视为同一文档
+            key = (doc.metadata.get("source_id"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
+
+def search_db_multi(queries: List[str], k: int = 3, fetch_k: int = MULTI_QUERY_FETCH_K,
+                    kbs: Optional[List[str]] = None, sources: Optional[Dict[str, List[str]]] = None) -> List:
+    """多查询检索：一次批量嵌入所有查询变体，在一个或多个知识库中并发检索后用RRF融合；
+    sources为 知识库 -> source_id列表，只限定其中出现的知识库，其余知识库不限定"""
+    queries = [q for q in queries if q and q.strip()]
+    kbs = kbs or [resolve_kb()]
+    sources = sources or {}
+    if not queries:
+        return []
+    if len(queries) == 1 and len(kbs) == 1:
+        return search_db(queries[0], k=k, kb=kbs[0], sources=sources.get(kbs[0]))
 
-def clear_db():
-    """清空向量数据库集合"""
-    db = get_vector_db()
     try:
-        db.delete_collection()
+        if INDEX_SERVICE_URL:
+            return _to_documents(_remote("search_db_multi", queries=queries, k=k, fetch_k=fetch_k, kbs=kbs,
+                                         sources={kb: sorted(ids) for kb, ids in sources.items()}))
+        # 所有变体在同一次前向计算中完成嵌入，延迟接近单次查询；
+        # 各知识库使用同一嵌入模型，向量可直接复用
+        vectors = get_embedding_function().embed_documents(queries)
+        targets = [(kb, get_vector_db(kb), get_compact_index(kb), get_tombstones(kb)) for kb in kbs]
+        jobs = [(kb, db, index, tombstones, v) for kb, db, index, tombstones in targets for v in vectors]
+
+        def run(job):
+            kb, db, index, tombstones, vector = job
+            return _tag_kb(_search_by_vector(db, index, vector, max(k, fetch_k), tombstones, sources.get(kb)), kb)
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            ranked_lists = list(pool.map(run, jobs))
+        return reciprocal_rank_fusion(ranked_lists, k=k)
+    except Exception as e:
+        st.error(f"知识库检索失败: {str(e)}")
+        return []
+
+def get_chunks(chunk_ids: List[str], kb: Optional[str] = None) -> List:
+    """按块id取回文档（对话记录中的参考文献按需加载），已被删除的块不返回"""
+    if INDEX_SERVICE_URL:
+        return _to_documents(_remote("get_chunks", chunk_ids=list(chunk_ids), kb=resolve_kb(kb)))
+    return _tag_kb(_docs_by_ids(get_vector_db(kb), list(chunk_ids)), resolve_kb(kb))
+
+def delete_from_db_by_source_id(source_id: str, kb: Optional[str] = None):
+    """根据source_id元数据物理删除向量（回收站清理时调用）"""
+    if INDEX_SERVICE_URL:
+        return _remote("delete_from_db_by_source_id", source_id=source_id, kb=resolve_kb(kb))
+    db = get_vector_db(kb)
+    index = get_compact_index(kb)
+    with _chroma_write_lock:
+        # langchain的Chroma.delete会丢弃where参数，直接调用底层集合
+        db._collection.delete(where={"source_id": source_id})
+        if index is not None:
+            index.remove_sources([source_id])
+    revive_source(source_id, kb)
+
+def delete_sources(source_ids: List[str], kb: Optional[str] = None):
+    """批量物理删除多个source_id的向量（一次$in删除）"""
+    if INDEX_SERVICE_URL:
+        return _remote("delete_sources", source_ids=list(source_ids), kb=resolve_kb(kb))
+    source_ids = sorted(set(source_ids))
+    if not source_ids:
+        return
+    db = get_vector_db(kb)
+    index = get_compact_index(kb)
+    with _chroma_write_lock:
+        db._collection.delete(where={"source_id": {"$in": source_ids}})
+        if index is not None:
+            index.remove_sources(source_ids)
+    for source_id in source_ids:
+        revive_source(source_id, kb)
+
+def clear_db(kb: Optional[str] = None):
+    """清空知识库的向量数据库集合（共享索引服务不提供远程清空，只能在索引进程所在节点调用）"""
+    kb = resolve_kb(kb)
+    if INDEX_SERVICE_URL:
+        raise RuntimeError("共享索引服务模式下不能远程清空向量库")
+    db = get_vector_db(kb)
+    try:
+        with _chroma_write_lock:
+            db.delete_collection()
     except Exception as e:
         st.warning(f"清空向量数据库集合时出错: {e}。可能集合已不存在。")
     
-    # 重置会话状态
-    if "vector_db" in st.session_state:
-        del st.session_state.vector_db
-        
+    with _tombstone_lock:
+        _tombstones.pop(kb, None)
+
+    # 紧凑索引文件一并删除
+    if get_compact_index(kb) is not None:
+        shutil.rmtree(compact_index_path(kb), ignore_errors=True)
+        _open_compact_index.clear()
+
     # 清理与DB相关的资源缓存，而不是所有缓存
-    get_vector_db.clear()
+    _open_vector_db.clear()
 
-def load_existing_documents() -> Optional[List[Dict]]:
+def load_existing_documents(kb: Optional[str] = None) -> Optional[List[Dict]]:
     """加载向量数据库中现有的文档"""
     try:
-        db = get_vector_db()
+        if INDEX_SERVICE_URL:
+            return _remote("load_existing_documents", kb=resolve_kb(kb))
+        db = get_vector_db(kb)
         collection = db._collection
         if collection is not None:
             return collection.get(include=["metadatas", "documents"])
@@ -81,10 +425,12 @@ def load_existing_documents() -> Optional[List[Dict]]:
         st.error(f"加载现有文档失败: {str(e)}")
         return None
 
-def get_vector_count():
+def get_vector_count(kb: Optional[str] = None):
     """安全获取向量数据库的条目数"""
     try:
-        db = get_vector_db()
+        if INDEX_SERVICE_URL:
+            return _remote("get_vector_count", kb=resolve_kb(kb))
+        db = get_vector_db(kb)
         if hasattr(db, "collection") and hasattr(db.collection, "count"):
             return db.collection.count()
         elif hasattr(db, "_collection") and hasattr(db._collection, "count"):
@@ -92,4 +438,34 @@ def get_vector_count():
         else:
             return 0
     except Exception as e:
-        return 0
\ No newline at end of file
+        return 0
+
+def migrate_to_compact_storage(kb: str = DEFAULT_KNOWLEDGE_BASE, batch_size: int = 512) -> int:
+    """将Chroma原生集合中的向量与文档迁移到紧凑存储，不重新计算嵌入，返回迁移条数"""
+    if INDEX_SERVICE_URL:
+        return _remote("migrate_to_compact_storage", kb=kb, batch_size=batch_size)
+    index = get_compact_index(kb)
+    if index is None:
+        raise RuntimeError("当前VECTOR_STORAGE为chroma，请先配置为float16或pq")
+    from langchain.vectorstores import Chroma
+    db = get_vector_db(kb)
+    source = Chroma(
+        collection_name=collection_name(kb),
+        embedding_function=get_embedding_function(),
+        persist_directory=CHROMA_DB_PATH
+    )._collection
+
+    migrated, offset = 0, 0
+    while True:
+        batch = source.get(
+            include=["documents", "metadatas", "embeddings"],
+            limit=batch_size,
+            offset=offset
+        )
+        if not batch["ids"]:
+            break
+        with _chroma_write_lock:
+            _add_to_compact(db, index, batch["documents"], batch["metadatas"], vectors=batch["embeddings"])
+        migrated += len(batch["ids"])
+        offset += batch_size
+    return migrated
\ No newline at end of file
@@ -0,0 +1,224 @@
+#vocabulary_index
+"""语料词表与实体链接
+
+入库时为每个文件提取词表（高频中文词组与英文标识符），随注册表一起保存；文件标题直接取自注册表的文件名。
+查询时用全部词条构建的Aho-Corasick自动机线性扫描问题，命中文件标题或专属词条时返回对应的source_id，
+检索可以据此只在这些文件中进行。自动机按知识库缓存，注册表文件变化后重建。
+"""
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from file_registry import FileRegistry
+from knowledge_bases import registry_path
+from config import (
+    VOCABULARY_TERMS_PER_SOURCE,
+    VOCABULARY_MIN_COUNT,
+    VOCABULARY_SCAN_CHARS,
+    VOCABULARY_MAX_SOURCE_FRACTION,
+    VOCABULARY_MIN_TITLE_CHARS
+)
+
+_CHINESE_RUN = re.compile(r"[\u4e00-\u9fff]+")
+_IDENTIFIER = re.compile(r"[A-Za-z][A-Za-z0-9_\-.]*[A-Za-z0-9]")
+_TITLE_SPLIT = re.compile(r"[\s_\-—–.()（）\[\]【】]+")
+# 含有这些虚词的中文词组不作为词条
+_FUNCTION_CHARS = set("的了是在和与及或也就都而我你他她它们这那个之其为以于上下中不有被把将从对")
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "are", "was", "were", "has", "have", "not",
+    "but", "can", "will", "all", "any", "its", "into", "than", "then", "there", "which", "when", "you",
+    "your", "our", "their", "they", "what", "how", "why", "use", "used", "using", "also", "may", "one",
+}
+
+
+def _is_ascii_word(ch):
+    return ch.isascii() and ch.isalnum()
+
+
+def title_stem(filename):
+    """去掉扩展名的完整标题（小写）"""
+    return Path(filename).stem.strip().lower()
+
+
+def title_terms(filename):
+    """文件标题词条：去掉扩展名的完整标题，以及按分隔符切开的较长部分"""
+    stem = title_stem(filename)
+    terms = [stem] if len(stem) >= 2 else []
+    for part in _TITLE_SPLIT.split(stem):
+        if part != stem and (len(part) >= 4 or (len(part) >= 2 and not part.isascii())):
+            terms.append(part)
+    return terms
+
+
+def extract_terms(text, limit=VOCABULARY_TERMS_PER_SOURCE):
+    """从文件正文提取词表：高频英文标识符与高频中文词组（2-6字，较长词组优先，去掉被其包含的片段）"""
+    text = (text or "")[:VOCABULARY_SCAN_CHARS]
+
+    identifiers = Counter(
+        word for word in (m.group().lower() for m in _IDENTIFIER.finditer(text))
+        if len(word) >= 3 and word not in _STOPWORDS
+    )
+
+    grams = Counter()
+    for run in _CHINESE_RUN.findall(text):
+        for n in range(2, 7):
+            for i in range(len(run) - n + 1):
+                gram = run[i:i + n]
+                if not _FUNCTION_CHARS.intersection(gram):
+                    grams[gram] += 1
+
+    candidates = [(count * len(term), term) for term, count in identifiers.items() if count >= 2]
+    candidates += [(count * len(term), term) for term, count in grams.items() if count >= VOCABULARY_MIN_COUNT]
+    candidates.sort(key=lambda item: (-item[0], item[1]))
+
+    selected = []
+    for _, term in candidates:
+        if len(selected) >= limit:
+            break
+        # 跳过已选词条的子串，以及与已选词条错位重叠的片段（如“知识库管”之后的“识库管理”）
+        fragments = (term, term[1:], term[:-1]) if len(term) >= 3 and not term.isascii() else (term,)
+        if any(f in chosen for f in fragments for chosen in selected if len(chosen) >= len(term)):
+            continue
+        selected.append(term)
+    return selected
+
+
+class AhoCorasick:
+    """多模式匹配自动机：构建O(模式总长)，匹配O(文本长度+命中数)"""
+
+    def __init__(self, patterns):
+        # 转移表用一个字典保存：键为 状态 * 0x110000 + 字符码
+        self._delta = {}
+        self._fail = [0]
+        self._output = [()]
+        # 重复的模式只登记一次，空模式忽略
+        for pattern in dict.fromkeys(p for p in patterns if p):
+            state = 0
+            for ch in pattern:
+                key = state * 0x110000 + ord(ch)
+                nxt = self._delta.get(key)
+                if nxt is None:
+                    nxt = len(self._fail)
+                    self._delta[key] = nxt
+                    self._fail.append(0)
+                    self._output.append(())
+                state = nxt
+            self._output[state] = self._output[state] + (pattern,)
+
+        # 按BFS顺序计算失败链接，并把失败状态的输出合并进来
+        children = {}
+        for key, nxt in self._delta.items():
+            children.setdefault(key // 0x110000, []).append((key % 0x110000, nxt))
+        queue = [nxt for _, nxt in children.get(0, [])]
+        for state in queue:
+            for code, nxt in children.get(state, []):
+                fail = self._fail[state]
+                while fail and fail * 0x110000 + code not in self._delta:
+                    fail = self._fail[fail]
+                target = self._delta.get(fail * 0x110000 + code, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text):
+        """返回所有命中 [(起始位置, 词条)]（可能重叠）"""
+        delta, fail, output = self._delta, self._fail, self._output
+        state = 0
+        matches = []
+        for end, ch in enumerate(text, 1):
+            code = ord(ch)
+            while state and state * 0x110000 + code not in delta:
+                state = fail[state]
+            state = delta.get(state * 0x110000 + code, 0)
+            for pattern in output[state]:
+                matches.append((end - len(pattern), pattern))
+        return matches
+
+
+class VocabularyIndex:
+    """一个知识库的词表：词条 -> source_id集合，附带完整标题标记与匹配自动机"""
+
+    def __init__(self, registry):
+        self.sources = {}  # 词条 -> source_id集合
+        self.titles = set()  # 足够长的完整标题，命中即点名了文件；标题片段与正文词条同等对待
+        active = {fid: info for fid, info in registry.items() if "deleted_time" not in info}
+        for file_id, info in active.items():
+            for term in title_terms(info["filename"]):
+                self.sources.setdefault(term, set()).add(file_id)
+            stem = title_stem(info["filename"])
+            if len(stem) >= VOCABULARY_MIN_TITLE_CHARS:
+                self.titles.add(stem)
+            for term in info.get("terms", []):
+                self.sources.setdefault(term, set()).add(file_id)
+        self.source_count = len(active)
+        self.automaton = AhoCorasick(self.sources)
+
+    def match(self, question):
+        """问题中命中的词条：优先最长、互不重叠，英文词条要求完整单词"""
+        text = question.lower()
+        hits = sorted(self.automaton.find(text), key=lambda hit: (hit[0], -len(hit[1])))
+        terms, covered_until = [], 0
+        for start, term in hits:
+            end = start + len(term)
+            if start < covered_until:
+                continue
+            if term.isascii() and ((start > 0 and _is_ascii_word(text[start - 1])) or
+                                   (end < len(text) and _is_ascii_word(text[end]))):
+                continue
+            if term not in terms:
+                terms.append(term)
+            covered_until = end
+        return terms
+
+    def link(self, question):
+        """返回 {"terms": 命中词条, "sources": 限定的source_id集合或None}
+
+        命中完整文件标题时只限定到这些文件；否则使用只关联少数文件的专属词条（标题片段也按此判断），
+        通用词不参与限定。
+        """
+        terms = self.match(question)
+        max_sources = max(1, int(self.source_count * VOCABULARY_MAX_SOURCE_FRACTION))
+        titles = [t for t in terms if t in self.titles]
+        specific = titles or [t for t in terms if len(self.sources[t]) <= max_sources]
+        scope = set().union(*(self.sources[t] for t in specific)) if specific else set()
+        # 限定范围覆盖了全部文件时等同于不限定
+        if not scope or len(scope) >= self.source_count:
+            return {"terms": terms, "sources": None}
+        return {"terms": terms, "sources": scope}
+
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+def _registry_signature(kb):
+    path = registry_path(kb)
+    return path.stat().st_mtime_ns if path.exists() else None
+
+
+def get_vocabulary_index(kb):
+    """知识库的词表索引，注册表文件修改后自动重建"""
+    signature = _registry_signature(kb)
+    with _index_lock:
+        cached = _indexes.get(kb)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    index = VocabularyIndex(FileRegistry.load(kb))
+    with _index_lock:
+        _indexes[kb] = (signature, index)
+    return index
+
+
+def link_question(question, kbs):
+    """在多个知识库中链接问题里的实体，返回 {"terms", "sources"}
+
+    sources为 知识库 -> 限定的source_id集合，只包含被限定的知识库（其余知识库照常全库检索）；
+    所有知识库都未限定时为空字典。
+    """
+    terms, sources = [], {}
+    for kb in kbs:
+        linked = get_vocabulary_index(kb).link(question)
+        terms += [t for t in linked["terms"] if t not in terms]
+        if linked["sources"] is not None:
+            sources[kb] = linked["sources"]
+    return {"terms": terms, "sources": sources}